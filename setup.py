@@ -8,6 +8,7 @@ setup(name='slicetool',
       packages=['slicetool'],
       python_requires= '>=3.6',
       install_requires=['sh', 'pymysql', 'SortedContainers'],
+      extras_require={ 'async' : ['aiomysql'] },
       entry_points={'console_scripts' : [
 
           # sync a billing-slice of meta from source to dest, clobbering dest data
@@ -25,6 +26,9 @@ setup(name='slicetool',
           # given an empty local database, pull a remote schema (with no foreign keys) into it
           'pull_schema = slicetool.schema:pull',
 
+          # print the schema changes (and their rebuild cost) that a sync would make, without making them
+          'diff_schema = slicetool.schema:diff',
+
           # remove foreign keys from a local database
           'strip_fk = slicetool.fk:strip',
 
@@ -34,4 +38,13 @@ setup(name='slicetool',
           # see test/test.sh for more about these
           'pull_test = slicetool.slice:test',
 
+          # the same, but with the asyncio engine (needs slicetool[async])
+          'pull_test_async = slicetool.aio:test',
+
+          # apply a changeset (written by a sync with --changeset) to a database
+          'replay_changeset = slicetool.changeset:replay_changeset',
+
+          # generate diverged tables on a local mysql server, sync them, and record the cost
+          'bench_slice = slicetool.bench:run',
+
           ]})
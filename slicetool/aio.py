@@ -0,0 +1,292 @@
+#! /usr/bin/env python3
+import os
+import ssl
+import time
+import asyncio
+from collections import OrderedDict
+from subprocess import CalledProcessError
+from slicetool.cli import parse_pull_args, make_printer, Prindenter, Indent, QUERIES, RESULTS, \
+                          mysqldump_data_command, mysqlload_command, count_dumped_rows, bulk_settings
+from slicetool.mysql import Connection, LocalArgs
+import slicetool.db as Db
+import slicetool.ids as Ids
+import slicetool.table as Table
+import slicetool.sync as Sync
+import slicetool.plan as Plan
+import slicetool.constants as Constants
+
+# aiomysql is optional, only this engine needs it (pip install slicetool[async])
+try:
+    import aiomysql
+except ImportError:
+    aiomysql = None
+
+# An asyncio engine for 'general' syncs
+# =====================================
+
+# slice.main syncs one table at a time, and within a table one query or command at a time, so while one
+# server is busy the other sits idle.  Here every table in the slice is synced by its own coroutine, both
+# servers fingerprint a batch at the same time, batches run concurrently, and so do the dumps and loads
+# that transfer them.  Connection pools cap how many queries each server sees at once, semaphores cap the
+# mysqldump and mysql processes.
+
+# The presync (missing ids, modified_time, schema) is built on the synchronous helpers in sync.py and
+# shares db_pair's upstream connection, so it runs in a worker thread, one table at a time.
+
+# connection pools and concurrency limits for one run
+class Servers:
+    def __init__(self, upstream, downstream):
+        self.upstream = upstream
+        self.downstream = downstream
+        self.dumps = asyncio.Semaphore(Constants.aio_concurrent_dumps)
+        self.loads = asyncio.Semaphore(Constants.aio_concurrent_loads)
+        self.presync = asyncio.Lock()
+
+    async def close(self):
+        for pool in [self.upstream, self.downstream]:
+            pool.close()
+            await pool.wait_closed()
+
+# settings holds session variables that every pooled connection starts with
+async def create_pool(mysql_args, size, settings):
+
+    if aiomysql is None:
+        raise ImportError("the asyncio engine needs aiomysql (pip install slicetool[async])")
+
+    kwargs = { 'user'         : mysql_args.user,
+               'password'     : mysql_args.password,
+               'db'           : mysql_args.database,
+               'autocommit'   : True,
+               'minsize'      : 1,
+               'maxsize'      : size,
+               'cursorclass'  : aiomysql.DictCursor,
+               'init_command' : 'SET ' + ', '.join('{}={}'.format(k, v) for k, v in settings.items()) }
+
+    if isinstance(mysql_args, LocalArgs):
+        kwargs['unix_socket'] = mysql_args.socket
+    else:
+        kwargs['host'] = mysql_args.host
+        if mysql_args.cipher:
+            # like pymysql with ssl={'cipher': ...}, encrypt but don't verify
+            context = ssl.create_default_context()
+            context.check_hostname = False
+            context.verify_mode = ssl.CERT_NONE
+            context.set_ciphers(mysql_args.cipher)
+            kwargs['ssl'] = context
+
+    return await aiomysql.create_pool(**kwargs)
+
+# like show_do_query, returns the result and the affected row count
+async def query(pool, sql, printer=Prindenter()):
+    printer(sql, level=QUERIES)
+    printer.metrics.count(queries=1)
+
+    started = time.time()
+    async with pool.acquire() as connection:
+        async with connection.cursor() as cursor:
+            await cursor.execute(sql)
+            result = await cursor.fetchall()
+            rowcount = cursor.rowcount
+    printer.event('query', query=sql, seconds=time.time() - started)
+
+    return result, rowcount
+
+# like cli.run_in_bash, raises CalledProcessError if the command fails
+async def run_in_bash(command, printer=Prindenter()):
+    printer(command, level=QUERIES)
+
+    started = time.time()
+    process = await asyncio.create_subprocess_exec('bash', '-c', command,
+                                                   stdout=asyncio.subprocess.PIPE,
+                                                   stderr=asyncio.subprocess.PIPE)
+    out, err = await process.communicate()
+    printer.event('command', command=command, seconds=time.time() - started)
+
+    if process.returncode:
+        raise CalledProcessError(process.returncode, command, out, err)
+    printer(lambda : out.decode(), level=RESULTS)
+
+# fingerprint one batch on both servers at once, return what differs as an IntervalSet
+async def fingerprint_batch(servers, table, condition, granularity, printer=Prindenter()):
+
+    if granularity <= 1:
+        sql = lambda side : Table.md5_rows_sql(side, condition)
+        address, digest = 'id', 'fingerprint'
+    else:
+        sql = lambda side : Table.md5_row_ranges_sql(side, condition, granularity)
+        address, digest = 'range_begin', 'range_fingerprint'
+
+    (upstream, _), (downstream, _) = await asyncio.gather(query(servers.upstream, sql(table.upstream), printer=printer),
+                                                          query(servers.downstream, sql(table.downstream), printer=printer))
+
+    if granularity <= 1:
+        printer.metrics.count(rows_scanned=len(upstream) + len(downstream))
+    else:
+        printer.metrics.count(rows_scanned=sum(row['range_rows'] for row in upstream) + sum(row['range_rows'] for row in downstream))
+    printer.metrics.count(fingerprints_compared=len(upstream) + len(downstream))
+
+    found = Ids.IntervalSet()
+    for _, start in Db.differing(Table.fingerprints(upstream, address, digest),
+                                 Table.fingerprints(downstream, address, digest)):
+        found.add(start, start + max(granularity, 1) - 1)
+    return found
+
+# the async counterpart of Db.find_diffs
+async def find_diffs(servers, table, scopes, granularity, condition=None, printer=Prindenter()):
+
+    conditions = scopes.predicates(table.id_col, Constants.batch_fingerprints)
+    if condition:
+        conditions = [ f"{condition} AND ({x})" for x in conditions ]
+
+    printer(f"[{table.name}: fingerprinting {len(scopes)} scopes at size {granularity} in {len(conditions)} concurrent batches]")
+    found = Ids.IntervalSet()
+    for batch in await asyncio.gather(*[ fingerprint_batch(servers, table, x, granularity, printer=printer)
+                                         for x in conditions ]):
+        found = found | batch
+
+    # a range at the edge of a scope can stick out past it
+    return found & scopes
+
+# the async counterpart of Sync.transfer: dump, delete and load one batch
+async def transfer(servers, cli_args, table_name, number, condition, printer=Prindenter()):
+
+    outfile = f"{table_name}.aio{number}.sql"
+
+    async with servers.dumps:
+        await run_in_bash(mysqldump_data_command(cli_args.upstream, table_name, condition, outfile), printer=printer)
+    printer.metrics.count(bytes_written=os.path.getsize(outfile), rows_transferred=count_dumped_rows(outfile))
+
+    _, deleted = await query(servers.downstream, f'delete from {table_name} where {condition};', printer=printer)
+    printer.metrics.count(rows_deleted=max(deleted, 0))
+
+    async with servers.loads:
+        await run_in_bash(mysqlload_command(cli_args.downstream, outfile, printer=printer), printer=printer)
+    os.remove(outfile)
+
+# the async counterpart of Sync.general: same presync, same zoom levels, but each level's batches run concurrently
+# (the schema-reset retry and the --diff-engine/same-server paths are only in Sync.general)
+async def general(table_name, zoom_levels, db_pair, cli_args, servers, id_col='id', batch_rows=Constants.batch_rows,
+                  condition=None, printer=Prindenter()):
+
+    loop = asyncio.get_event_loop()
+
+    async with servers.presync:
+        table = await loop.run_in_executor(None, lambda : Sync.pre_general(table_name, db_pair, cli_args, id_col, batch_rows,
+                                                                            condition=condition, printer=printer))
+    if not table.needs_work:
+        printer(f"[{table_name}: presync was sufficient]")
+        return
+
+    scopes = Ids.IntervalSet([ Ids.Interval(0, table.upstream.max_id) ])
+    for granularity in sorted(set(zoom_levels), reverse=True):
+        with printer.metrics.phase(f'fingerprint@{granularity}'):
+            scopes = await find_diffs(servers, table, scopes, granularity, condition=condition, printer=printer)
+
+        if not scopes:
+            printer(f"[{table_name}: found no ranges with diffs]")
+            printer.append_summary("{} : IDENTICAL? (TABLE CHECKSUM failed but a custom MD5 scan found no diffs)".format(table_name))
+            return
+
+    conditions = scopes.predicates(table.id_col, Constants.batch_fingerprints)
+    printer(f"[{table_name}: transferring {scopes.count()} ids in {len(conditions)} concurrent batches]")
+    with printer.metrics.phase('transfer'):
+        await asyncio.gather(*[ transfer(servers, cli_args, table_name, number, x, printer=printer)
+                                for number, x in enumerate(conditions) ])
+
+    def check():
+        with Connection(db_pair.downstream.args) as downstream_connection:
+            with downstream_connection.cursor() as downstream_cursor:
+                with db_pair.upstream.connection.cursor() as upstream_cursor:
+                    table.is_synced_warn(upstream_cursor, downstream_cursor, message='(after async general sync)', printer=printer)
+                    table.try_sync_schema(upstream_cursor, downstream_cursor, throw=True, printer=printer)
+
+    async with servers.presync:
+        await loop.run_in_executor(None, check)
+
+# sync each of tables (names -> zoom levels) in its own coroutine
+async def sync_tables(tables, db_pair, cli_args, printer=Prindenter()):
+
+    # every pooled connection gets the group_concat_max_len we found earlier, downstream ones also get --bulk-load
+    upstream_settings = OrderedDict([ ('group_concat_max_len', db_pair.upstream.concat.bytes) ])
+    downstream_settings = OrderedDict([ ('group_concat_max_len', db_pair.downstream.concat.bytes) ])
+    downstream_settings.update(bulk_settings(cli_args.downstream, printer=printer))
+
+    servers = Servers(await create_pool(cli_args.upstream, Constants.aio_upstream_connections, upstream_settings),
+                      await create_pool(cli_args.downstream, Constants.aio_downstream_connections, downstream_settings))
+
+    # each table prints and counts separately, the Prindenter's indent and metrics aren't shared safely
+    printers = OrderedDict((name, Prindenter(indent=printer.indent, file=printer.file,
+                                             verbosity=printer.verbosity, events=printer.events))
+                           for name in tables.keys())
+    try:
+        results = await asyncio.gather(*[ general(name, zoom_levels, db_pair, cli_args, servers, printer=printers[name])
+                                          for name, zoom_levels in tables.items() ],
+                                       return_exceptions=True)
+    finally:
+        await servers.close()
+
+    for name, table_printer in printers.items():
+        with printer.metrics.table(name):
+            printer.metrics.merge(table_printer.metrics)
+        printer.summary += table_printer.summary
+
+    for result in results:
+        if isinstance(result, BaseException):
+            raise result
+
+# an alternative to slice.main for slices made only of 'general' syncs
+# get_tables returns an OrderedDict of table names -> zoom levels
+def main(cli_args, get_tables, slice_name):
+
+    printer = make_printer(cli_args)
+
+    if cli_args.changeset or cli_args.snapshot or cli_args.auto_strategy or cli_args.partitions or cli_args.cheap_hashes \
+            or cli_args.apply != 'reload':
+        raise ValueError("--changeset, --snapshot, --auto-strategy, --partitions, --cheap-hashes and --apply "
+                         "aren't supported by the asyncio engine, use slice.main")
+    if len(cli_args.downstreams) > 1 or cli_args.diff_engine != 'md5' or cli_args.column_deltas:
+        raise ValueError("--extra-downstream-database, --diff-engine stream and --column-deltas "
+                         "aren't supported by the asyncio engine, use slice.main")
+
+    printer('Syncing a {} slice from {}.{} to {}.{} (asyncio)'.format(
+        slice_name, cli_args.upstream.host, cli_args.upstream.database,
+                    cli_args.downstream.host, cli_args.downstream.database))
+
+    printer.metrics.labels['slice'] = slice_name
+    printer.metrics.labels['upstream'] = f'{cli_args.upstream.host}/{cli_args.upstream.database}'
+    printer.metrics.labels['downstream'] = f'{cli_args.downstream.host}/{cli_args.downstream.database}'
+
+    printer("[Database configuration check]")
+    with Connection(cli_args.upstream) as upstream_connection, Indent(printer):
+
+        db_pair = Db.connect_twin(cli_args, upstream_connection, printer=printer)
+
+        # --plan only reads statistics, the same way Sync.general would
+        if cli_args.plan:
+            printer("[Database sync plan]")
+            with Indent(printer):
+                for name, zoom_levels in get_tables().items():
+                    Plan.general(name, zoom_levels, db_pair, cli_args, printer=printer)
+        else:
+            printer("[Database sync]")
+            with Indent(printer):
+                loop = asyncio.get_event_loop()
+                loop.run_until_complete(sync_tables(get_tables(), db_pair, cli_args, printer=printer))
+
+    printer('Done')
+    printer.print_summary()
+
+    if cli_args.metrics_json:
+        printer.metrics.write_json(cli_args.metrics_json)
+    if cli_args.metrics_prom:
+        printer.metrics.write_prometheus(cli_args.metrics_prom)
+
+# used as entrypoint in setup.py
+def test():
+    import slicetool.test as Test
+    cli_args = parse_pull_args('update a downstream (stale) test database with upstream freshness, concurrently')
+    main(cli_args, Test.general_tables, "test slice of things_upstream")
+
+# called when this script is run directly
+if __name__ == '__main__':
+    test()
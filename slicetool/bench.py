@@ -0,0 +1,365 @@
+#! /usr/bin/env python3
+import os
+import sys
+import json
+import time
+import random
+import hashlib
+import argparse
+import datetime
+import tempfile
+import subprocess
+from collections import OrderedDict
+from slicetool.cli import pull_arg_parser, aggregate_updown_mysql, Prindenter, Indent, show_do_query, QUIET
+from slicetool.mysql import Connection, LocalArgs
+import slicetool.db as Db
+import slicetool.sync as Sync
+import slicetool.metrics as Metrics
+
+# Benchmarks against a local mysql server
+# =======================================
+
+# build an upstream/downstream pair of tables that differ in a known way, sync them, and record what it cost
+
+table_name = 'bench'
+
+# how the upstream table moves away from the downstream one
+patterns = [ 'clustered',     # a few contiguous runs of rows are modified
+             'uniform',       # modified rows are scattered across the table
+             'appends',       # new rows beyond max(id)
+             'deletes',       # rows removed from within the id range
+             'schema_drift' ] # a column is added, and some rows get a value for it
+
+# how we sync them
+modes = [ 'general',   # Sync.general with the given zoom levels
+          'lite',      # the same, with --lite
+          'composite'] # Sync.composite_key_sync keyed on group_id, id
+
+# rows are this many ids apart in the same group
+group_size = 100
+
+def parse_bench_args(desc=None):
+
+    parser = argparse.ArgumentParser(description=desc,
+                                     formatter_class=argparse.ArgumentDefaultsHelpFormatter)
+
+    parser.add_argument('--user',                 default='root')
+    parser.add_argument('--password',             default='test')
+    parser.add_argument('--upstream-database',    default='slicetool_bench_up')
+    parser.add_argument('--downstream-database',  default='slicetool_bench_down')
+
+    parser.add_argument('--rows',                 default=100000, type=int, help="rows in the upstream table")
+    parser.add_argument('--row-width',            default=200, type=int, help="bytes of payload per row")
+    parser.add_argument('--sparsity',             default=0.0, type=float, help="fraction of the id range with no row")
+    parser.add_argument('--divergence',           default=0.01, type=float, help="fraction of rows that differ")
+    parser.add_argument('--pattern',              action='append', choices=patterns, help="default: all of them")
+    parser.add_argument('--mode',                 action='append', choices=modes, help="default: all of them")
+    parser.add_argument('--zoom',                 default='1000,50,1', help="zoom levels for general and lite modes")
+    parser.add_argument('--seed',                 default=0, type=int)
+
+    parser.add_argument('--label',                default='', help="stored with each result, to tell runs apart")
+    parser.add_argument('--results',              default='bench_results.jsonl', help="results are appended here")
+    parser.add_argument('--workdir',              default=None, help="where dump files go (default: a temporary directory)")
+    parser.add_argument('--verbosity',            default=QUIET, type=int)
+    parser.add_argument('--compare',              action='store_true', help="summarize the results file instead of running")
+    parser.add_argument('--startup',              action='store_true', help="time how long each command takes to start (no mysql needed)")
+    parser.add_argument('--startup-runs',         default=10, type=int, help="with --startup, take the median of this many runs")
+
+    args = parser.parse_args()
+    args.pattern = args.pattern or patterns
+    args.mode = args.mode or modes
+    args.zoom = [ int(x) for x in args.zoom.split(',') ]
+    args.results = os.path.abspath(args.results)
+    return args
+
+# which version of slicetool is being measured?
+def version():
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+# cpu time used by the (local) mysql server so far, or None if we can't see it
+def server_cpu_seconds(cursor, printer=Prindenter()):
+    try:
+        pid_file = show_do_query(cursor, "SELECT @@pid_file AS pid_file;", printer=printer)[0]['pid_file']
+        with open(pid_file) as f:
+            pid = int(f.read().strip())
+        with open(f'/proc/{pid}/stat') as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+        # utime and stime, see `man proc`
+        return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError):
+        return None
+
+def payload(id, width, salt=''):
+    seed = hashlib.md5(f'{salt}{id}'.encode()).hexdigest()
+    return (seed * (width // len(seed) + 1))[:width]
+
+# Building Scenarios
+# ==================
+
+def create_databases(cursor, args, printer=Prindenter()):
+    for database in [args.upstream_database, args.downstream_database]:
+        show_do_query(cursor, f'DROP DATABASE IF EXISTS {database};', printer=printer)
+        show_do_query(cursor, f'CREATE DATABASE {database};', printer=printer)
+
+def populate(cursor, args, rng, printer=Prindenter()):
+
+    upstream = f'{args.upstream_database}.{table_name}'
+    downstream = f'{args.downstream_database}.{table_name}'
+
+    show_do_query(cursor,
+            f"""
+            CREATE TABLE {upstream} (
+                id INT NOT NULL PRIMARY KEY,
+                group_id INT NOT NULL,
+                modified_time DATETIME NOT NULL,
+                payload VARCHAR({args.row_width}) NOT NULL
+            );
+            """, printer=printer)
+
+    insert = f'INSERT INTO {upstream} VALUES (%s, %s, %s, %s)'
+    batch = []
+    id = 0
+    for _ in range(args.rows):
+        id += 1
+        while rng.random() < args.sparsity:
+            id += 1
+        batch.append((id, id // group_size, '2020-01-01 00:00:00', payload(id, args.row_width)))
+        if len(batch) >= 5000:
+            cursor.executemany(insert, batch)
+            batch = []
+    if batch:
+        cursor.executemany(insert, batch)
+
+    # downstream starts out identical, then upstream moves on
+    show_do_query(cursor, f'CREATE TABLE {downstream} LIKE {upstream};', printer=printer)
+    show_do_query(cursor, f'INSERT INTO {downstream} SELECT * FROM {upstream};', printer=printer)
+
+def diverge(cursor, args, pattern, rng, printer=Prindenter()):
+
+    upstream = f'{args.upstream_database}.{table_name}'
+    ids = [ x['id'] for x in show_do_query(cursor, f'SELECT id FROM {upstream} ORDER BY id;', printer=printer) ]
+    changes = max(1, int(len(ids) * args.divergence))
+
+    if pattern == 'clustered':
+        # ten runs of consecutive rows
+        chosen = []
+        run = max(1, changes // 10)
+        for _ in range(10):
+            start = rng.randrange(0, max(1, len(ids) - run))
+            chosen += ids[start:start + run]
+    elif pattern in ['uniform', 'deletes', 'schema_drift']:
+        chosen = rng.sample(ids, min(changes, len(ids)))
+    else:
+        chosen = []
+
+    if pattern == 'schema_drift':
+        show_do_query(cursor, f'ALTER TABLE {upstream} ADD COLUMN extra INT NOT NULL DEFAULT 0;', printer=printer)
+
+    if pattern == 'appends':
+        last = ids[-1] if ids else 0
+        rows = [ (id, id // group_size, '2021-01-01 00:00:00', payload(id, args.row_width))
+                 for id in range(last + 1, last + 1 + changes) ]
+        cursor.executemany(f'INSERT INTO {upstream} (id, group_id, modified_time, payload) VALUES (%s, %s, %s, %s)', rows)
+
+    elif pattern == 'deletes':
+        cursor.executemany(f'DELETE FROM {upstream} WHERE id = %s', [ (x,) for x in chosen ])
+
+    elif pattern == 'schema_drift':
+        cursor.executemany(f"UPDATE {upstream} SET extra = 1, modified_time = '2021-01-01 00:00:00' WHERE id = %s",
+                           [ (x,) for x in chosen ])
+    else:
+        cursor.executemany(f"UPDATE {upstream} SET payload = %s, modified_time = '2021-01-01 00:00:00' WHERE id = %s",
+                           [ (payload(x, args.row_width, salt='changed'), x) for x in chosen ])
+
+    return len(chosen) or changes
+
+# Running Them
+# ============
+
+def sync_args(args, mode):
+    argv = [ '--upstream-user', args.user, '--upstream-password', args.password,
+             '--upstream-host', 'localhost', '--upstream-database', args.upstream_database,
+             '--no-upstream-cipher',
+             '--downstream-user', args.user, '--downstream-password', args.password,
+             '--downstream-host', 'localhost', '--downstream-database', args.downstream_database ]
+    if mode == 'lite':
+        argv.append('--lite')
+    return aggregate_updown_mysql(pull_arg_parser().parse_args(argv))
+
+def run_mode(args, mode, admin_cursor, printer=Prindenter()):
+
+    cli_args = sync_args(args, mode)
+
+    cpu_before = server_cpu_seconds(admin_cursor, printer=printer)
+    started = time.time()
+
+    with Connection(cli_args.upstream) as upstream_connection:
+        db_pair = Db.connect_twin(cli_args, upstream_connection, printer=printer)
+        with printer.metrics.table(table_name):
+            if mode == 'composite':
+                Sync.composite_key_sync(table_name, db_pair, cli_args, ['group_id', 'id'], printer=printer)
+            else:
+                Sync.general(table_name, list(args.zoom), db_pair, cli_args, printer=printer)
+
+    seconds = time.time() - started
+    cpu_after = server_cpu_seconds(admin_cursor, printer=printer)
+
+    checksums = [ show_do_query(admin_cursor, f'CHECKSUM TABLE {database}.{table_name};', printer=printer)[0]['Checksum']
+                  for database in [args.upstream_database, args.downstream_database] ]
+
+    measured = OrderedDict([ ('seconds', seconds),
+                             ('server_cpu_seconds', cpu_after - cpu_before if cpu_before is not None and cpu_after is not None else None),
+                             ('identical', checksums[0] == checksums[1]) ])
+    for counter in Metrics.counters:
+        if counter != 'seconds':
+            measured[counter] = sum(x[counter] for x in printer.metrics.phases.values())
+    return measured
+
+def bench(args, printer):
+
+    admin_args = LocalArgs(user=args.user, password=args.password, host='localhost', database='mysql', socket=None, cipher=None)
+    commit = version()
+
+    with Connection(admin_args) as admin_connection, admin_connection.cursor() as admin_cursor:
+        for pattern in args.pattern:
+            for mode in args.mode:
+
+                scenario = OrderedDict([ ('pattern', pattern), ('rows', args.rows), ('row_width', args.row_width),
+                                         ('sparsity', args.sparsity), ('divergence', args.divergence), ('seed', args.seed) ])
+
+                printer(f'[{pattern} / {mode}]')
+                with Indent(printer):
+
+                    # same seed, same tables, every time
+                    rng = random.Random(args.seed)
+                    sync_printer = Prindenter(indent=printer.indent + 4, verbosity=args.verbosity)
+
+                    create_databases(admin_cursor, args, printer=sync_printer)
+                    populate(admin_cursor, args, rng, printer=sync_printer)
+                    changed = diverge(admin_cursor, args, pattern, rng, printer=sync_printer)
+
+                    # only count the sync itself
+                    sync_printer.metrics = Metrics.Metrics()
+                    measured = run_mode(args, mode, admin_cursor, printer=sync_printer)
+
+                    result = OrderedDict([ ('time', str(datetime.datetime.now())),
+                                           ('version', commit),
+                                           ('label', args.label),
+                                           ('scenario', scenario),
+                                           ('rows_changed', changed),
+                                           ('mode', mode),
+                                           ('zoom', args.zoom if mode != 'composite' else None) ])
+                    result.update(measured)
+
+                    printer(json.dumps(measured))
+                    with open(args.results, 'a') as f:
+                        f.write(json.dumps(result) + '\n')
+
+                    if not measured['identical']:
+                        printer.append_summary(f"{pattern} / {mode} : tables still differ after sync")
+
+# commands whose startup --startup measures, and the functions behind them (see setup.py)
+startup_commands = OrderedDict([ ('pull_test',   ('slicetool.slice',  'test')),
+                                 ('pull_schema', ('slicetool.schema', 'pull')),
+                                 ('diff_schema', ('slicetool.schema', 'diff')),
+                                 ('strip_fk',    ('slicetool.fk',     'strip')) ])
+
+# time `command --help` in a fresh interpreter: imports, building the argument parser and its defaults
+def startup(args, printer):
+    commit = version()
+
+    for command, (module, function) in startup_commands.items():
+        code = f'import sys; sys.argv = ["{command}", "--help"]; from {module} import {function}; {function}()'
+        seconds = []
+        for _ in range(args.startup_runs):
+            started = time.time()
+            subprocess.run([sys.executable, '-c', code], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            seconds.append(time.time() - started)
+        median = sorted(seconds)[len(seconds) // 2]
+
+        printer(f'{command:<12} {median:.3f}s')
+        result = OrderedDict([ ('time', str(datetime.datetime.now())),
+                               ('version', commit),
+                               ('label', args.label),
+                               ('mode', 'startup'),
+                               ('command', command),
+                               ('runs', args.startup_runs),
+                               ('seconds', median) ])
+        with open(args.results, 'a') as f:
+            f.write(json.dumps(result) + '\n')
+
+# show how each scenario's numbers changed from one version to the next
+def compare(args, printer):
+
+    runs = OrderedDict()
+    startups = OrderedDict()
+    with open(args.results) as f:
+        for line in f:
+            result = json.loads(line)
+            if result['mode'] == 'startup':
+                startups.setdefault(result['command'], []).append(result)
+                continue
+            key = json.dumps([result['scenario'], result['mode'], result['zoom']])
+            runs.setdefault(key, []).append(result)
+
+    for command, results in startups.items():
+        printer(f"[startup of {command}]")
+        with Indent(printer):
+            baseline = results[0]
+            for result in results:
+                change = (result['seconds'] - baseline['seconds']) / baseline['seconds'] * 100 if baseline['seconds'] else 0
+                printer(f"{result['time'][:19]}  {result['version']:<20} {result['label']:<12} "
+                        f"{result['seconds']:9.3f}s ({change:+6.1f}%)")
+
+    for key, results in runs.items():
+        scenario, mode, zoom = json.loads(key)
+        printer(f"[{scenario['pattern']} / {mode}, {scenario['rows']} rows x {scenario['row_width']} bytes, zoom {zoom}]")
+        with Indent(printer):
+            baseline = results[0]
+            for result in results:
+                change = (result['seconds'] - baseline['seconds']) / baseline['seconds'] * 100 if baseline['seconds'] else 0
+                printer(f"{result['time'][:19]}  {result['version']:<20} {result['label']:<12} "
+                        f"{result['seconds']:9.2f}s ({change:+6.1f}%)  "
+                        f"cpu: {result['server_cpu_seconds'] if result['server_cpu_seconds'] is not None else '?'}  "
+                        f"queries: {result['queries']}  bytes: {result['bytes_written']}  "
+                        f"{'ok' if result['identical'] else 'DIFFERS'}")
+
+def main(args):
+    printer = Prindenter(indent=0)
+
+    if args.compare:
+        compare(args, printer)
+        return
+
+    if args.startup:
+        printer('Timing command startup')
+        with Indent(printer):
+            startup(args, printer)
+        printer(f'Done, results appended to {args.results}')
+        return
+
+    printer(f'Benchmarking {", ".join(args.mode)} against {", ".join(args.pattern)} divergence')
+
+    # keep dump files out of the way
+    workdir = args.workdir or tempfile.mkdtemp(prefix='slicetool_bench_')
+    os.makedirs(workdir, exist_ok=True)
+    os.chdir(workdir)
+
+    with Indent(printer):
+        bench(args, printer)
+
+    printer(f'Done, results appended to {args.results}')
+    printer.print_summary()
+
+# used as entrypoint in setup.py
+def run():
+    main(parse_bench_args('Generate diverged table pairs on a local mysql server, sync them, and record the cost'))
+
+# called when this script is run directly
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,143 @@
+#! /usr/bin/env python3
+import os
+import sys
+import json
+import zipfile
+from collections import OrderedDict
+from slicetool.cli import single_db_arg_parser, aggregate_mysql, make_printer, Prindenter, Indent, \
+                          mysqlload, show_do_query, bulk_session, count_dumped_rows, shorten
+from slicetool.mysql import Connection
+import slicetool.table as Table
+
+# Changesets
+# ==========
+
+# With --changeset, a sync works out its delta against the downstream as usual, but rather than applying it,
+# it writes it to a file: for each table, the schema fingerprint the delta was computed against and, in order,
+# the deletes and dump files that would have been applied.  replay_changeset applies that file to any
+# downstream whose tables still have those schemas, which needn't be reachable from wherever upstream is.
+
+# a zip file (deflated) holding manifest.json and the dump files it refers to
+manifest_name = 'manifest.json'
+changeset_version = 1
+
+class Writer:
+    def __init__(self, path):
+        self.path = path
+        self.archive = zipfile.ZipFile(path, 'w', compression=zipfile.ZIP_DEFLATED)
+        self.tables = OrderedDict()
+
+    def _steps(self, table_name):
+        return self.tables.setdefault(table_name, OrderedDict([ ('schema', None), ('steps', []) ]))['steps']
+
+    # the downstream schema that the steps for this table assume
+    # the downstream is left alone, schema included, so if upstream's differs the table can't be recorded (returns False)
+    def schema(self, upstream_cursor, downstream_cursor, table_name, printer=Prindenter()):
+        key = Table.schema_pair_key(upstream_cursor, downstream_cursor, table_name)
+        fingerprints = { 'upstream' : Table.schema_fingerprint(upstream_cursor, table_name, printer=printer),
+                         'downstream' : Table.schema_fingerprint(downstream_cursor, table_name, printer=printer) }
+
+        if fingerprints['upstream'] != fingerprints['downstream'] and Table.read_schema_cache().get(key) != fingerprints:
+            message = f"{table_name} : NOT RECORDED (its schema differs upstream, changesets don't carry schema changes)"
+            printer.append_summary(message)
+            printer(message)
+            return False
+
+        self._steps(table_name)
+        self.tables[table_name]['schema'] = fingerprints['downstream']
+        return True
+
+    def delete(self, table_name, condition, printer=Prindenter()):
+        printer(f"[Recording delete from {table_name} where {shorten(condition, length=50)}]")
+        self._steps(table_name).append({ 'delete' : condition })
+
+    def load(self, table_name, dumpfile, printer=Prindenter()):
+        steps = self._steps(table_name)
+        member = f"{table_name}/{len(steps)}.sql"
+        printer(f"[Recording {dumpfile} as {self.path}:{member}]")
+        with printer.metrics.phase('changeset'):
+            self.archive.write(dumpfile, member)
+        steps.append({ 'load' : member })
+
+    def close(self):
+        manifest = OrderedDict([ ('version', changeset_version), ('tables', self.tables) ])
+        self.archive.writestr(manifest_name, json.dumps(manifest, indent=2))
+        self.archive.close()
+
+def read_manifest(archive):
+    manifest = json.loads(archive.read(manifest_name).decode())
+    if manifest['version'] != changeset_version:
+        raise ValueError(f"Changeset version {manifest['version']} can't be replayed by this slicetool (expects {changeset_version})")
+    return manifest
+
+# which tables in the manifest have a different schema downstream?
+def schema_mismatches(cursor, manifest, printer=Prindenter()):
+    mismatches = []
+    for table_name, table in manifest['tables'].items():
+        if table['steps'] and Table.schema_fingerprint(cursor, table_name, printer=printer) != table['schema']:
+            mismatches.append(table_name)
+    return mismatches
+
+# apply a changeset to mysql_args.database, or apply nothing if any of its tables' schemas differ
+def replay(path, mysql_args, printer=Prindenter()):
+
+    with zipfile.ZipFile(path) as archive:
+        manifest = read_manifest(archive)
+
+        printer(f"[Checking {mysql_args.database} against the schemas in {path}]")
+        with Indent(printer), Connection(mysql_args) as connection, connection.cursor() as cursor:
+            mismatches = schema_mismatches(cursor, manifest, printer=printer)
+
+        if mismatches:
+            for table_name in mismatches:
+                printer.append_summary(f"{table_name} : NOT REPLAYED (schema differs from the one the changeset was computed against)")
+            return False
+
+        for table_name, table in manifest['tables'].items():
+            printer(f"[Replaying {len(table['steps'])} steps for {table_name}]")
+            with Indent(printer), printer.metrics.table(table_name):
+                loaded = 0
+                for step in table['steps']:
+
+                    if 'delete' in step:
+                        with Connection(mysql_args) as connection, connection.cursor() as cursor:
+                            with printer.metrics.phase('delete'), bulk_session(cursor, mysql_args, printer=printer):
+                                show_do_query(cursor, f"delete from {table_name} where {step['delete']};", printer=printer)
+                                printer.metrics.count(rows_deleted=max(cursor.rowcount, 0))
+                    else:
+                        infile = f"{table_name}.replay.sql"
+                        with open(infile, 'wb') as f:
+                            f.write(archive.read(step['load']))
+                        rows = count_dumped_rows(infile)
+                        printer.metrics.count(rows_transferred=rows)
+                        loaded += rows
+                        mysqlload(mysql_args, infile, printer=printer)
+                        os.remove(infile)
+
+            printer.append_summary(f"{table_name} : REPLAYED ({len(table['steps'])} steps, {loaded} rows loaded)")
+
+    return True
+
+# used as entrypoint in setup.py
+def replay_changeset():
+
+    parser = single_db_arg_parser('Apply a changeset written by a sync with --changeset to this database')
+    parser.add_argument('changeset', metavar='FILE')
+    if len(sys.argv) < 2 :
+        parser.print_help(sys.stderr)
+        sys.exit(1)
+    args = parser.parse_args()
+
+    # replay targets are scratch copies, so write them the fast way (see --bulk-load)
+    mysql_args = aggregate_mysql(args, prefix='')
+    mysql_args.bulk_load = True
+
+    printer = make_printer(args)
+    replayed = replay(args.changeset, mysql_args, printer=printer)
+    printer.print_summary()
+    if not replayed:
+        sys.exit(1)
+
+# called when this script is run directly
+if __name__ == '__main__':
+    replay_changeset()
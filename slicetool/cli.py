@@ -4,18 +4,29 @@ import argparse
 import subprocess
 import os
 import re
+import json
+import time
 import datetime
+from copy import copy
+from contextlib import contextmanager
+from functools import lru_cache
 from pprint import pformat
-from sh import bash, awk, netstat, mysql
-from slicetool.mysql import LocalArgs, RemoteArgs
+import pymysql
+from slicetool.mysql import LocalArgs, RemoteArgs, Connection
+from slicetool.metrics import Metrics
+import slicetool.constants as Constants
 
 # Cli Parsing Helpers
 # ===================
 
 # local socket will be used if hostname='localhost'
-# examine local system to find it
+# examine local system to find it (only when a localhost connection doesn't name one, and only once)
+@lru_cache(maxsize=None)
 def get_local_socket():
 
+    # sh is only needed once we're actually doing something, don't make every startup pay for it
+    from sh import awk, netstat
+
     # try to determine the mysql socket path
     local_socket = ""
     if "linux" in sys.platform:
@@ -40,6 +51,8 @@ def aggregate_mysql(args, prefix='upstream_'): # or downstream_
                                 'cipher'   : getattr(args, prefix + 'cipher') }
 
     if argdict['host'] == 'localhost':
+        if not argdict['socket']:
+            argdict['socket'] = get_local_socket()
         return LocalArgs(**upstream_args)
     else:
         return RemoteArgs(**upstream_args)
@@ -53,12 +66,29 @@ def aggregate_updown_mysql(args):
         args.upstream.cipher = None
 
     args.downstream = aggregate_mysql(args, 'downstream_')
+    args.downstream.bulk_load = args.bulk_load
+
+    # more databases on the downstream server, to be kept in sync from the same upstream pass
+    args.downstreams = [ args.downstream ]
+    for database in args.extra_downstream_database:
+        extra = copy(args.downstream)
+        extra.database = database
+        args.downstreams.append(extra)
     return args
 
 # Parsing Command Line Aguments
 # =============================
 
-def parse_pull_args(desc=None):
+# arguments that control what the Prindenter prints (shared by all commands)
+def add_output_args(parser):
+    parser.add_argument('--verbosity',            default=RESULTS, type=int, choices=[QUIET, STEPS, QUERIES, RESULTS],
+                                                  help="{}: summary only, {}: progress, {}: also show sql and commands, "
+                                                       "{}: also show (truncated) results".format(QUIET, STEPS, QUERIES, RESULTS))
+    parser.add_argument('--events',               default=None, metavar='FILE',
+                                                  help="append a machine-readable JSON-lines event stream to this file")
+
+# the parser behind parse_pull_args, also used to build arguments in code (see bench.py)
+def pull_arg_parser(desc=None):
 
     parser = argparse.ArgumentParser(description=desc,
                                      formatter_class=argparse.ArgumentDefaultsHelpFormatter)
@@ -67,7 +97,7 @@ def parse_pull_args(desc=None):
     parser.add_argument('--upstream-password')
     parser.add_argument('--upstream-host',        default='db-usprod-shard0.corp.clover.com')
     parser.add_argument('--upstream-database',    default='meta')
-    parser.add_argument('--upstream-socket',      default=get_local_socket())
+    parser.add_argument('--upstream-socket',      default=None, help='for localhost, found with netstat if omitted')
     parser.add_argument('--upstream-cipher',      default='DHE-RSA-AES256-SHA',
                                                   help="to list available ciphers run: `openssl ciphers`")
     parser.add_argument('--no-upstream-cipher',   action='store_true')
@@ -76,11 +106,48 @@ def parse_pull_args(desc=None):
     parser.add_argument('--downstream-password',  default='test')
     parser.add_argument('--downstream-host',      default='localhost')
     parser.add_argument('--downstream-database',  default='meta')
-    parser.add_argument('--downstream-socket',    default=get_local_socket())
+    parser.add_argument('--downstream-socket',    default=None, help='for localhost, found with netstat if omitted')
     parser.add_argument('--downstream-cipher',    default=None,
                                                   help="omit for no cipher")
 
+    parser.add_argument('--extra-downstream-database', default=[], action='append', metavar='DATABASE',
+                                                  help="also sync this database on the downstream server (repeatable), "
+                                                       "upstream fingerprints and dumps are shared between targets")
+
     parser.add_argument('--lite',                 action='store_true', help='sync based on id and modified_time only (faster, but less reliable)')
+    parser.add_argument('--bulk-load',            action='store_true', help='write downstream with unique/foreign key checks and binary logging off, in large transactions (safe for FK-less scratch databases)')
+    parser.add_argument('--defer-indexes',        action='store_true', help='when filling an empty downstream table, drop its secondary indexes first and rebuild them in one ALTER afterwards')
+    parser.add_argument('--parallel-seed',        action='store_true', help='fill empty downstream tables by dumping and loading several id ranges at once, from one upstream snapshot')
+    parser.add_argument('--seed-streams',         default=Constants.seed_upstream_streams, type=int, help='with --parallel-seed, dump this many ranges at once')
+    parser.add_argument('--load-streams',         default=Constants.seed_downstream_streams, type=int, help='with --parallel-seed, load this many ranges at once')
+    parser.add_argument('--diff-engine',          default='md5', choices=['md5', 'stream'],
+                                                  help="md5: servers fingerprint rows, stream: rows are streamed here and hashed locally "
+                                                       "(less server cpu, more network), slice definitions can override this per table")
+    parser.add_argument('--apply',                default='reload', choices=['reload', 'replace', 'upsert'],
+                                                  help="how changed rows are written downstream. reload: delete them, then insert upstream's, "
+                                                       "replace: REPLACE them, upsert: INSERT ... ON DUPLICATE KEY UPDATE them "
+                                                       "(with replace and upsert, only keys that are gone upstream are deleted)")
+    parser.add_argument('--auto-strategy',        action='store_true', help='before zooming into a table, fingerprint a random sample of it and reload the table instead if most of it differs')
+    parser.add_argument('--presence-diff',        action='store_true', help='before fingerprinting row content, compare which ids each side has (from the primary key only), and transfer/delete rows that are missing/extra anywhere in the table')
+    parser.add_argument('--partitions',           action='store_true', help='fingerprint partitioned tables one partition at a time (several at once) and leave the partitions that match out of the scan')
+    parser.add_argument('--cheap-hashes',         action='store_true', help='fingerprint large TEXT/BLOB columns by their length and a prefix (see constants.py), rows are rescanned in full if the final checksum still differs')
+    parser.add_argument('--column-deltas',        action='store_true', help='once general() is down to single rows, fingerprint their columns too, and UPDATE just the columns that differ in rows both sides have (rather than reloading wide rows)')
+    parser.add_argument('--snapshot',             action='store_true', help='read each table upstream (fingerprints, dumps and the final checksum) from one consistent snapshot, so writes landing mid-sync aren\'t mistaken for failures')
+    parser.add_argument('--changeset',            default=None, metavar='FILE',
+                                                  help='write the delta to this changeset file instead of applying it (the downstream is the baseline, its rows are left alone), see replay_changeset')
+    parser.add_argument('--plan',                 action='store_true', help='estimate the cost of the sync from table statistics, then stop (nothing is fingerprinted or transferred)')
+
+    parser.add_argument('--metrics-json',         default=None, metavar='FILE',
+                                                  help="write per-table, per-phase timings and counts here at the end of the run")
+    parser.add_argument('--metrics-prom',         default=None, metavar='FILE',
+                                                  help="write the same, formatted for prometheus' textfile collector")
+
+    add_output_args(parser)
+    return parser
+
+def parse_pull_args(desc=None):
+
+    parser = pull_arg_parser(desc)
 
     if len(sys.argv) < 2 :
         parser.print_help(sys.stderr)
@@ -88,7 +155,8 @@ def parse_pull_args(desc=None):
     else:
         return aggregate_updown_mysql(parser.parse_args())
 
-def parse_single_db_args(desc=None):
+# the parser behind parse_single_db_args, commands with arguments of their own add them to it (see changeset.py)
+def single_db_arg_parser(desc=None):
 
     parser = argparse.ArgumentParser(description=desc,
                                      formatter_class=argparse.ArgumentDefaultsHelpFormatter)
@@ -97,51 +165,104 @@ def parse_single_db_args(desc=None):
     parser.add_argument('--password',  default='test')
     parser.add_argument('--host',      default='localhost')
     parser.add_argument('--database',  default='meta')
-    parser.add_argument('--socket',    default=get_local_socket())
+    parser.add_argument('--socket',    default=None, help='for localhost, found with netstat if omitted')
     parser.add_argument('--cipher',    default=None)
 
+    add_output_args(parser)
+    return parser
+
+def parse_single_db_args(desc=None):
+
+    parser = single_db_arg_parser(desc)
+
     if len(sys.argv) < 2 :
         parser.print_help(sys.stderr)
         sys.exit(1)
     else:
-        return aggregate_mysql(parser.parse_args())
+        args = parser.parse_args()
+        mysql_args = aggregate_mysql(args, prefix='')
+
+        # keep output settings for make_printer
+        mysql_args.verbosity = args.verbosity
+        mysql_args.events = args.events
+        return mysql_args
 
 # Printing Messages to the Caller
 # ===============================
 
+# how much a Prindenter says, each level includes the ones before it
+QUIET = 0   # end-of-run summary only
+STEPS = 1   # progress through the sync
+QUERIES = 2 # plus the sql and shell commands that were run
+RESULTS = 3 # plus (truncated) query results and command output
+
 # print status to stderr so that only the requested value is written to stdout
 # (the better for consumption by a caller in code)
 # default to a four-space indent
+#
+# messages may be callables, they're only called (and their output formatted) if the message
+# will actually be printed at the current verbosity
 class Prindenter:
-    def __init__(self, indent=4, file=sys.stderr):
+    def __init__(self, indent=4, file=sys.stderr, verbosity=RESULTS, events=None):
         self.summary = []
         self.indent = indent
         self.at_line_begin = True
         self.file = file
+        self.verbosity = verbosity
+        self.events = events # a file to write JSON-lines events to, or None
+        self.metrics = Metrics()
+        self.summary_prefix = '' # which downstream the summary is about, when there are several
+
+    # will a message at this level be printed?
+    def wants(self, level):
+        return level <= self.verbosity
+
+    # for machine consumption: one JSON object per line
+    def event(self, kind, **fields):
+        if self.events:
+            fields['event'] = kind
+            fields['time'] = time.time()
+            self.events.write(json.dumps(fields, default=str) + '\n')
 
     # for storing end-of-run report
     def append_summary(self, msg):
+        msg = self.summary_prefix + msg
         self.summary.append("[{}] {}".format(str(datetime.datetime.now()), msg))
+        self.event('summary', message=msg)
 
     # for printing: end-of-run report
     def print_summary(self):
         for msg in self.summary:
-            self(msg)
+            self(msg, level=QUIET)
+
+    def __call__(self, msg, end='\n', level=STEPS):
 
-    def __call__(self, msg, end='\n'):
+        if not self.wants(level):
+            return
+
+        if callable(msg):
+            msg = msg()
 
         if self.at_line_begin:
             this_indent = self.indent
         else:
             this_indent =  0
 
-        if end is '':
+        if end == '':
             self.at_line_begin = False
         else:
             self.at_line_begin = True
 
         print(textwrap.indent(msg.__str__(), ' ' * this_indent), file=self.file, end=end)
 
+# build the top-level printer for a command, as configured by add_output_args
+def make_printer(cli_args):
+    if cli_args.events:
+        events = open(cli_args.events, 'a', buffering=1)
+    else:
+        events = None
+    return Prindenter(indent=0, verbosity=cli_args.verbosity, events=events)
+
 # Increments the intent depth for a Prindenter
 class Indent:
     def __init__(self, printer):
@@ -157,33 +278,33 @@ class Indent:
 # Executing External Commands
 # ===========================
 
+def bash_c(command):
+    from sh import bash
+    return bash(['-c', command])
+
 # print a bash command and its result
 def run_in_bash(command,
-                run=lambda cmd : bash(['-c', cmd]),
+                run=bash_c,
                 printer=Prindenter()):
 
     with Indent(printer):
-        printer('[Command]')
+        printer('[Command]', level=QUERIES)
         with Indent(printer):
-            printer(command)
+            printer(command, level=QUERIES)
             #printer(shorten(command))
-        printer('[Output]')
+        printer('[Output]', level=RESULTS)
         with Indent(printer):
             # execute and print output
+            started = time.time()
             result = run(command)
+            printer.event('command', command=command, seconds=time.time() - started)
             #printer(shorten(repr(result)))
-            printer(repr(result))
+            printer(lambda : repr(result), level=RESULTS)
     return result
 
-def mysqldump_data(mysql_args, table_name, condition, append=False, printer=Prindenter()):
-
-    outfile = table_name + '.sql'
-    printer('[Dumping {} from {}.{} where {} into {}/{}]'.format(table_name,
-                                                                 mysql_args.host,
-                                                                 mysql_args.database,
-                                                                 shorten(condition, length=20),
-                                                                 os.getcwd(),
-                                                                 outfile))
+# the mysqldump command that writes rows of table_name where condition to outfile
+# with apply='replace' the rows are written as REPLACE statements (see --apply), mysqldump can't write upserts (see dump_rows)
+def mysqldump_data_command(mysql_args, table_name, condition, outfile, append=False, apply='reload'):
 
     # build command string
     format_args = { 'table'     : table_name,
@@ -198,27 +319,107 @@ def mysqldump_data(mysql_args, table_name, condition, append=False, printer=Prin
         redirect = '>'
 
     format_args.update(mysql_args.__dict__) # use vars from slicetool.mysql.(Local|Remote)Args
-    command = ' '.join(['mysqldump',
-                        '--compress',
-                        '-h{host}' if format_args['host'] != 'localhost' else '',
-                        '-u{user}',
-                        '-p\'{password}\'' if format_args['password'] else '',
-                        '--ssl-cipher={cipher}' if format_args['cipher'] else '',
-                        '{database}',
-                        '{table}',
-                        '--no-create-info',
-                        '--lock-tables=false',
-                        '--set-gtid-purged=OFF',
-                        '--where=\'{condition}\'',
-                        redirect, '{file}',
-                       ]
-                      ).format(**format_args)
+    return ' '.join(['mysqldump',
+                     '--compress',
+                     '-h{host}' if format_args['host'] != 'localhost' else '',
+                     '-u{user}',
+                     '-p\'{password}\'' if format_args['password'] else '',
+                     '--ssl-cipher={cipher}' if format_args['cipher'] else '',
+                     '{database}',
+                     '{table}',
+                     '--no-create-info',
+                     '--lock-tables=false',
+                     '--set-gtid-purged=OFF',
+                     '--replace' if apply == 'replace' else '',
+                     '--where=\'{condition}\'',
+                     redirect, '{file}',
+                    ]
+                   ).format(**format_args)
+
+def mysqldump_data(mysql_args, table_name, condition, append=False, apply='reload', printer=Prindenter()):
 
-    return run_in_bash(command, printer=printer)
+    outfile = table_name + '.sql'
+    printer('[Dumping {} from {}.{} where {} into {}/{}]'.format(table_name,
+                                                                 mysql_args.host,
+                                                                 mysql_args.database,
+                                                                 shorten(condition, length=20),
+                                                                 os.getcwd(),
+                                                                 outfile))
+
+    command = mysqldump_data_command(mysql_args, table_name, condition, outfile, append=append, apply=apply)
+
+    with printer.metrics.phase('dump'):
+        size_before = os.path.getsize(outfile) if append and os.path.exists(outfile) else 0
+        result = run_in_bash(command, printer=printer)
+        printer.metrics.count(bytes_written=os.path.getsize(outfile) - size_before,
+                              rows_transferred=count_dumped_rows(outfile, offset=size_before))
+    return result
+
+# mysqldump writes extended inserts like: INSERT INTO `t` VALUES (1,'a'),(2,'b');  (or REPLACE INTO, with --apply replace)
+# so count statements and the separators between their rows (approximate: string data may contain '),(')
+dumped_row_markers = [ b'),(', b'INSERT INTO ', b'REPLACE INTO ' ]
+
+def count_dumped_rows(dumpfile, offset=0, chunk_size=1024 * 1024):
+    rows = 0
+    carry = b''
+    with open(dumpfile, 'rb') as f:
+        f.seek(offset)
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            window = carry + chunk
+            rows += sum(window.count(x) for x in dumped_row_markers)
+            rows -= sum(carry.count(x) for x in dumped_row_markers)
+            carry = window[-max(len(x) for x in dumped_row_markers):]
+    return rows
+
+# like mysqldump_data, but the rows come through a connection we already have
+# use this when the dump has to see what that connection's session sees (e.g. a snapshot)
+# apply picks the statements: INSERT ('reload'), REPLACE ('replace') or INSERT ... ON DUPLICATE KEY UPDATE ('upsert')
+def dump_rows(connection, table_name, condition, outfile=None, append=False, apply='reload', printer=Prindenter()):
+
+    outfile = outfile or table_name + '.sql'
+    printer('[Dumping {} from {} where {} into {}/{} through an existing session]'.format(table_name,
+                                                                                          connection.database,
+                                                                                          shorten(condition, length=20),
+                                                                                          os.getcwd(),
+                                                                                          outfile))
+
+    escape = connection.connection.escape
+    rows = 0
+
+    with printer.metrics.phase('dump'):
+        size_before = os.path.getsize(outfile) if append and os.path.exists(outfile) else 0
+
+        # stream the rows, rather than holding them all in memory
+        with connection.cursor(pymysql.cursors.SSCursor) as cursor, open(outfile, 'a' if append else 'w') as f:
+            cursor.execute(f'SELECT * FROM {table_name} WHERE {condition};')
+            columns = ','.join('`{}`'.format(x[0]) for x in cursor.description)
+            insert = '{} INTO `{}` ({}) VALUES\n'.format('REPLACE' if apply == 'replace' else 'INSERT', table_name, columns)
+            if apply == 'upsert':
+                end = '\nON DUPLICATE KEY UPDATE {};\n'.format(','.join('`{0}`=VALUES(`{0}`)'.format(x[0]) for x in cursor.description))
+            else:
+                end = ';\n'
+
+            f.write(f'SET NAMES {connection.connection.charset};\n')
+            while True:
+                batch = cursor.fetchmany(Constants.dump_rows_per_insert)
+                if not batch:
+                    break
+                # rows are separated like mysqldump separates them, so count_dumped_rows can count them
+                f.write(insert + ','.join(escape(tuple(row)) for row in batch) + end)
+                rows += len(batch)
+
+        printer.metrics.count(bytes_written=os.path.getsize(outfile) - size_before, rows_transferred=rows)
+
+    with Indent(printer):
+        printer(f'{rows} rows')
+    return rows
 
 # split a dump in pieces to avoid connection timeout issues
 def mysqldump_data_batches(mysql_args, table_name, batch_size, max_id,
-                                  min_id=0, id_col='id', condition=None, printer=Prindenter()):
+                                  min_id=0, id_col='id', condition=None, apply='reload', printer=Prindenter()):
 
     boundaries = list(range(min_id, max_id, batch_size))
     intervals = [ (x, x + batch_size - 1) for x in boundaries ]
@@ -242,12 +443,14 @@ def mysqldump_data_batches(mysql_args, table_name, batch_size, max_id,
                 mysqldump_data(mysql_args,
                                table_name,
                                restricted_condition,
+                               apply=apply,
                                printer=printer)
             else:
                 mysqldump_data(mysql_args,
                                       table_name,
                                       restricted_condition,
                                       append=True,
+                                      apply=apply,
                                       printer=printer)
 
 def mysqldump_schema_nofk(mysql_args, outfile, restrict_to_table=None, printer=Prindenter()):
@@ -303,21 +506,81 @@ def mysqlload(mysql_args, table_or_file_name, printer=Prindenter()):
                                                  '{}/{}'.format(os.getcwd(), infile),
                                                  mysql_args.database))
 
+    command = mysqlload_command(mysql_args, infile, printer=printer)
+
+    with printer.metrics.phase('load'):
+        return run_in_bash(command,
+                           printer=printer)
+
+# the mysql command that sources infile into mysql_args.database
+def mysqlload_command(mysql_args, infile, printer=Prindenter()):
+
+    # with the bulk-load profile, the whole file is one transaction in a session without the checks
+    # (the session ends with the client, so there's nothing to restore afterwards)
+    settings = bulk_settings(mysql_args, printer=printer)
+    if settings:
+        statements = [ 'SET SESSION {}={}'.format(k, v) for k, v in settings.items() ]
+        script = '; '.join(statements + ['SET autocommit=0', 'source {}'.format(infile), 'COMMIT;'])
+    else:
+        script = 'source {};'.format(infile)
+
     # build command string
-    format_args =  { 'file' : infile }
+    format_args =  { 'script' : script }
     format_args.update(mysql_args.__dict__) # use key-names from argparse
-    command = ' '.join(['mysql',
-                        '-h{host}' if format_args['host'] != 'localhost' else '',
-                        '-u{user}',
-                        '-p\'{password}\'' if format_args['password'] else '',
-                        '--ssl-cipher={cipher}' if format_args['cipher'] else '',
-                        '-D{database}',
-                        '-e\'source {file};\'',
-                       ]
-                      ).format(**format_args)
-
-    return run_in_bash(command,
-                       printer=printer)
+    return ' '.join(['mysql',
+                     '-h{host}' if format_args['host'] != 'localhost' else '',
+                     '-u{user}',
+                     '-p\'{password}\'' if format_args['password'] else '',
+                     '--ssl-cipher={cipher}' if format_args['cipher'] else '',
+                     '-D{database}',
+                     '-e\'{script}\'',
+                    ]
+                   ).format(**format_args)
+
+# Bulk-Load Sessions
+# ==================
+
+# which of Constants.bulk_load_session can this user actually set on this server?
+# (sql_log_bin, for instance, needs SUPER) find out once and remember
+def bulk_settings(mysql_args, printer=Prindenter()):
+
+    if not getattr(mysql_args, 'bulk_load', False):
+        return {}
+
+    if getattr(mysql_args, 'bulk_settings', None) is None:
+        printer('[Checking which bulk-load session settings {} allows]'.format(mysql_args.host))
+        with Indent(printer):
+            settings = {}
+            with Connection(mysql_args) as connection, connection.cursor() as cursor:
+                for name, value in Constants.bulk_load_session.items():
+                    try:
+                        show_do_query(cursor, 'SET SESSION {}={};'.format(name, value), printer=printer)
+                        settings[name] = value
+                    except pymysql.err.MySQLError as err:
+                        printer('{} will be left alone: {}'.format(name, err.args[1]))
+            mysql_args.bulk_settings = settings
+
+    return mysql_args.bulk_settings
+
+# apply the bulk-load profile to a session for the duration of a with block, then put things back
+@contextmanager
+def bulk_session(cursor, mysql_args, printer=Prindenter()):
+
+    settings = bulk_settings(mysql_args, printer=printer)
+    if not settings:
+        yield
+        return
+
+    names = list(settings.keys())
+    previous = show_do_query(cursor,
+                             'SELECT {};'.format(', '.join('@@SESSION.{0} AS {0}'.format(x) for x in names)),
+                             printer=printer)[0]
+
+    show_do_query(cursor, 'SET SESSION {};'.format(', '.join('{}={}'.format(k, v) for k, v in settings.items())), printer=printer)
+    try:
+        yield
+    finally:
+        show_do_query(cursor, 'SET SESSION {};'.format(', '.join('{}={}'.format(x, previous[x]) for x in names)), printer=printer)
 
 # constrain displayed output to a window of this size
 max_line = 150
@@ -337,6 +600,9 @@ def pretty_shorten(data, length=max_rows, width=max_line):
     output = ''
 
     if type(data) != str:
+        # each item takes at least a line, so don't bother formatting more items than can be shown
+        if type(data) in [list, tuple] and len(data) > length + 2:
+            data = data[:length + 2]
         pretty_string = pformat(data, indent=2)
     else:
         pretty_string = data
@@ -350,13 +616,14 @@ def pretty_shorten(data, length=max_rows, width=max_line):
     return output
 
 # pretty printer for query execution
+# (the sql and its results are only formatted if the printer's verbosity calls for them)
 def show_do_query(cursor,
         query,
         do=lambda cursor, query: cursor.execute(query),
         get=lambda cursor: cursor.fetchall(),
         printer=Prindenter()):
 
-    printer('[MySQL @ {}, database: {}]'.format(cursor.connection.host, cursor.connection.db))
+    printer('[MySQL @ {}, database: {}]'.format(cursor.connection.host, cursor.connection.db), level=QUERIES)
     with Indent(printer):
 
         if type(query) == list:
@@ -364,15 +631,26 @@ def show_do_query(cursor,
         else:
             queries = [query]
 
-        printer('[Queries]')
+        started = time.time()
+        printer.metrics.count(queries=len(queries))
+
+        printer('[Queries]', level=QUERIES)
         with Indent(printer):
             for q in queries:
-                    printer(pretty_shorten(textwrap.dedent(q), width=5000))
+                    printer(lambda : pretty_shorten(textwrap.dedent(q), width=5000), level=QUERIES)
                     do(cursor, q)
 
-        printer('[Result]')
+        printer('[Result]', level=RESULTS)
         with Indent(printer):
             result = get(cursor)
-            printer(pretty_shorten(result))
+            printer(lambda : pretty_shorten(result), level=RESULTS)
+
+        if printer.events:
+            printer.event('query',
+                          host=cursor.connection.host,
+                          database=cursor.connection.db,
+                          sql=[ textwrap.dedent(q).strip() for q in queries ],
+                          rows=len(result) if result is not None else None,
+                          seconds=time.time() - started)
 
     return result
@@ -1,3 +1,5 @@
+from collections import OrderedDict
+
 # On a server I know, remote connections get axed if they take too long
 # pull this many rows per connection to fly under the radar
 batch_rows = 100000
@@ -8,3 +10,67 @@ batch_conditions = 1000
 
 # server-side fingerprinting can be cpu intensive, smaller batches mean we give it time to breath in between
 batch_fingerprints= 1000
+
+# schema fingerprints of table pairs that have already been reconciled, so that later runs can skip
+# the column-by-column comparison (written to the working directory, alongside the dump files)
+schema_fingerprint_cache = 'schema_fingerprints.json'
+
+# rough throughput figures that --plan uses to turn row and byte counts into durations
+# (bench_slice can tell you what they are for your servers)
+plan_rows_hashed_per_second = 500000
+plan_bytes_transferred_per_second = 10 * 1024 * 1024
+
+# with --auto-strategy, this many randomly placed ranges of sample_range_ids ids are fingerprinted in pieces of
+# sample_granularity ids, to estimate how much of a table differs before choosing between zoom diffs and a reload
+sample_ranges = 20
+sample_range_ids = 1000
+sample_granularity = 10
+
+# with --presence-diff, ids are first summarized (count, min, max, xor) in ranges of this many
+presence_granularity = 10000
+
+# with --partitions, fingerprint this many partitions at a time (on each side, each on its own connection)
+partition_streams = 4
+
+# when slicetool writes its own dump files (rather than calling mysqldump) put this many rows in each INSERT
+dump_rows_per_insert = 1000
+
+# when seeding an empty table in parallel, cap concurrent dumps (upstream) and loads (downstream) at these
+seed_upstream_streams = 4
+seed_downstream_streams = 4
+
+# with --bulk-load, downstream writes happen in a session with these settings
+# (only safe because slicetool's downstream databases don't have foreign keys, see README)
+bulk_load_session = OrderedDict([ ('unique_checks', 0),
+                                  ('foreign_key_checks', 0),
+                                  ('sql_log_bin', 0) ])
+
+# with --cheap-hashes, columns of these types are fingerprinted by a cheap signature instead of their contents
+# (see Table.examine_columns for the strategies, slice definitions can also pick them per column)
+cheap_hash_types = { 'mediumtext' : 'length_prefix',
+                     'longtext'   : 'length_prefix',
+                     'mediumblob' : 'length_prefix',
+                     'longblob'   : 'length_prefix' }
+
+# the length_prefix strategy hashes a column's length and this many of its leading characters (bytes, for blobs)
+hash_prefix_length = 256
+
+# with --column-deltas, columns of these types are fingerprinted (and updated) on their own, the rest together
+column_delta_wide_types = [ 'tinytext', 'text', 'mediumtext', 'longtext',
+                            'tinyblob', 'blob', 'mediumblob', 'longblob', 'json' ]
+
+# with --defer-indexes, secondary index definitions are kept here (in the working directory) while they're dropped
+deferred_index_file = 'deferred_indexes_{}.json'
+
+# the 'stream' diff engine reads rows in chunks this big and hashes them in a process pool
+# (None means one process per cpu) with at most stream_window chunks per side waiting to be hashed
+stream_chunk_rows = 10000
+stream_hash_processes = None
+stream_window = 8
+
+# the asyncio engine (aio.py) keeps this many connections open to each server,
+# and runs at most this many mysqldump and mysql processes at once
+aio_upstream_connections = 4
+aio_downstream_connections = 4
+aio_concurrent_dumps = 4
+aio_concurrent_loads = 4
@@ -1,7 +1,9 @@
+import pymysql
 from math import floor
 from collections import namedtuple
-from sortedcontainers import SortedDict
-from slicetool.cli import Prindenter, Indent, show_do_query, pretty_shorten
+from contextlib import contextmanager
+from slicetool.cli import Prindenter, Indent, show_do_query, pretty_shorten, QUERIES
+from slicetool.mysql import Connection
 import slicetool.table as Table
 import slicetool.ids as Ids
 import slicetool.constants as Constants
@@ -33,6 +35,97 @@ class Twin:
             set_group_concat(upstream_cursor, self.upstream.concat.bytes, printer=printer)
             set_group_concat(downstream_cursor, self.downstream.concat.bytes, printer=printer)
 
+# collect database-level info into a Twin
+# sync functions use its upstream connection, and open downstream connections as needed
+def connect_twin(cli_args, upstream_connection, printer=Prindenter()):
+
+    with Connection(cli_args.downstream) as downstream_connection, printer.metrics.phase('introspection'):
+        with downstream_connection.cursor() as downstream_cursor:
+            with upstream_connection.cursor() as upstream_cursor:
+                db_pair = Twin(upstream_cursor, downstream_cursor, printer=printer)
+
+                # if both databases are on one server, diffs and transfers can happen there (see Table.diff_on_server)
+                db_pair.same_server = same_server(upstream_cursor, downstream_cursor, printer=printer)
+
+    db_pair.downstream.args = cli_args.downstream
+
+    db_pair.upstream.args = cli_args.upstream
+    db_pair.upstream.connection = upstream_connection
+
+    # when several downstreams share this upstream, results worth reusing go here (see slice.main)
+    db_pair.upstream.shared = None
+
+    # with --changeset, downstream writes are recorded here instead (see slice.main)
+    db_pair.changeset = None
+
+    # true while the upstream connection reads from a consistent snapshot (see upstream_snapshot)
+    db_pair.upstream.snapshot = False
+
+    return db_pair
+
+# everything read through the upstream connection in this block comes from one REPEATABLE READ snapshot
+# so a table's fingerprints, dumps and final checksum all agree with each other, whatever is written meanwhile
+@contextmanager
+def upstream_snapshot(db_pair, table_name, printer=Prindenter()):
+
+    printer(f"[Reading {table_name} from one upstream snapshot]")
+    with Indent(printer), db_pair.upstream.connection.cursor() as cursor:
+        show_do_query(cursor, 'SET SESSION TRANSACTION ISOLATION LEVEL REPEATABLE READ;', printer=printer)
+        show_do_query(cursor, 'START TRANSACTION WITH CONSISTENT SNAPSHOT;', printer=printer)
+    db_pair.upstream.snapshot = True
+    try:
+        yield
+    finally:
+        db_pair.upstream.snapshot = False
+        with db_pair.upstream.connection.cursor() as cursor:
+            show_do_query(cursor, 'COMMIT;', printer=printer)
+
+# stream a column of ids into an IntervalSet (ORDER BY it, so that runs are built cheaply)
+def select_ids(connection, sql, printer=Prindenter()):
+    printer(sql, level=QUERIES)
+    printer.metrics.count(queries=1)
+
+    ids = Ids.IntervalSet()
+    with connection.cursor(pymysql.cursors.SSCursor) as cursor:
+        cursor.execute(sql)
+        for (id,) in cursor:
+            if id is not None:
+                ids.add(id, id)
+    return ids
+
+# something that's the same for every connection to a server, and different between servers
+def server_identity(cursor, printer=Prindenter()):
+    try:
+        return show_do_query(cursor, "select @@server_uuid as id;", printer=printer)[0]['id']
+    except pymysql.err.MySQLError:
+        # older than 5.6
+        result = show_do_query(cursor, "select @@hostname as host, @@port as port;", printer=printer)[0]
+        return f"{result['host']}:{result['port']}"
+
+# are these the same server, and can the downstream user read the upstream database?
+def same_server(upstream_cursor, downstream_cursor, printer=Prindenter()):
+
+    printer("[Are upstream and downstream on the same server?]")
+    with Indent(printer):
+        if server_identity(upstream_cursor, printer=printer) != server_identity(downstream_cursor, printer=printer):
+            printer("No, fingerprints will be compared and rows transferred client-side")
+            return False
+
+        # information_schema only lists databases we have some privilege on
+        visible = show_do_query(downstream_cursor,
+                                f"""
+                                SELECT COUNT(*) as visible FROM information_schema.schemata
+                                WHERE schema_name = '{upstream_cursor.connection.db}';
+                                """,
+                                printer=printer)[0]['visible']
+        if not visible:
+            printer(f"Yes, but the downstream user can't see {upstream_cursor.connection.db}, "
+                    "fingerprints will be compared and rows transferred client-side")
+            return False
+
+        printer("Yes, diffs and transfers will happen on the server")
+        return True
+
 # granular scanning relies on group_concat, which silently truncates the output once it reaches
 # group_concat_max_len bytes long.
 # Interrogate the target server to see how many rows we can get away with.
@@ -74,7 +167,9 @@ def set_group_concat(cursor, value, printer=Prindenter()):
 # use granularity = 1 to return a generator for rows-with-diffs in the specified scope
 # use granularity > 1 to return a generator for row-rangess-with-diffs in the specified scope
 #def find_diffs(upstream_cursor, downstream_cursor, table, scope, granularity, printer=Prindenter()):
-def find_diffs(upstream_cursor, downstream_cursor, table, scopes, granularity, condition=None, printer=Prindenter()):
+# with same_server, fingerprints are compared on the server and only the diffs come back (see Table.diff_on_server)
+def find_diffs(upstream_cursor, downstream_cursor, table, scopes, granularity, condition=None, shared=None,
+               same_server=False, printer=Prindenter()):
 
     # what are we scanning?
     if granularity <= 1:
@@ -107,54 +202,117 @@ def find_diffs(upstream_cursor, downstream_cursor, table, scopes, granularity, c
 
     num_batches = len(batched_conditions)
 
-    # display diff-density visually
-    def visualize(found_change):
-
-        if found_change is not None:
-            printer('!', end='')
-        else:
-            printer('.', end='')
-
-        if visualize.col < 100:
-            visualize.col += 1
-        else:
-            visualize.col = 0
-            printer('') # carriage returns every 100
+    # display diff-density visually: one character per 1% of the batch, '!' where there were diffs
+    def visualize(positions, total):
+        width = min(total, 100)
+        line = bytearray(b'.' * width)
+        for position in positions:
+            line[position * width // total] = ord('!')
+        printer(line.decode())
 
     total_shortened_condition = pretty_shorten(total_condition)[:-1]
 
     printer("[Generating {thing} fingerprint of size {granularity} where {total_shortened_condition}]".format(**vars()))
     for ct, conditions in enumerate(batched_conditions):
-        with Indent(printer):
+
+        # collect the batch's diffs, and only yield them once its phase is over
+        # (otherwise whatever the caller does in between would be counted against fingerprinting)
+        addresses = []
+        with Indent(printer), printer.metrics.phase(f'fingerprint@{granularity}'):
             printer("")
             printer(f"[ Batch {ct + 1} of {num_batches} ]")
 
-            downstream_fingerprints = SortedDict()
-            upstream_fingerprints = SortedDict()
-
-            downstream_fingerprints.update(scan(downstream_cursor, table.downstream, conditions, granularity, printer=printer))
-            upstream_fingerprints.update(scan(upstream_cursor, table.upstream, conditions, granularity, printer=printer))
-
-            scanned = list(set(downstream_fingerprints.keys()).union(upstream_fingerprints.keys()))
-            scanned.sort()
-
-            scanned_num = len(scanned)
-            printer("[Examining {scanned_num} {thing} fingerprints]".format(**vars()))
-            with Indent(printer):
-
-                # reset visualizer
-                visualize.col=0
-
-                # yield only things (range or row) with diff
-                for address in scanned:
-                    found_change = None
-                    try:
-                        downstream_fingerprint = downstream_fingerprints[address]
-                        upstream_fingerprint = upstream_fingerprints[address]
-                        if downstream_fingerprint != upstream_fingerprint:
-                            found_change = address
-                    except KeyError:
-                        found_change = address
-                    visualize(found_change)
-                    if found_change is not None:
-                        yield found_change
+            if same_server:
+                addresses = list(Table.diff_on_server(downstream_cursor, table,
+                                                      upstream_cursor.connection.db, downstream_cursor.connection.db,
+                                                      conditions, granularity, printer=printer))
+            else:
+                downstream_fingerprints = scan(downstream_cursor, table.downstream, conditions, granularity, printer=printer)
+                upstream_fingerprints = Table.shared_upstream(shared, ('fingerprints', table.name, conditions, granularity, tuple(table.upstream.columns)),
+                                                              lambda : scan(upstream_cursor, table.upstream, conditions, granularity, printer=printer),
+                                                              printer=printer)
+
+                scanned_num = len(upstream_fingerprints.addresses) + len(downstream_fingerprints.addresses)
+                printer.metrics.count(fingerprints_compared=scanned_num)
+                printer("[Examining {scanned_num} {thing} fingerprints]".format(**vars()))
+                with Indent(printer):
+
+                    # keep only things (range or row) with diff
+                    found = list(differing(upstream_fingerprints, downstream_fingerprints))
+                    if scanned_num:
+                        visualize([ position for position, _ in found ], scanned_num)
+
+                    for _, address in found:
+                        if granularity <= 1:
+                            addresses.append(address)
+                        else:
+                            addresses.append(Ids.Interval(address, address + granularity - 1))
+
+        for address in addresses:
+            yield address
+
+# Comparing Fingerprints
+# ======================
+
+# Both sides' fingerprints come back sorted by address (see Table.fingerprints).  Rather than comparing them one
+# at a time, compare whole slices (array and memoryview comparisons happen in C), and only narrow down the
+# slices that disagree.  When diffs are sparse, most of the work is a handful of large comparisons.
+
+digest_bytes = 16
+
+# how many addresses, starting at a[i] and b[j], are the same on both sides?
+def aligned_run(a, i, b, j):
+    limit = min(len(a) - i, len(b) - j)
+    run = 0
+    step = 1
+    while run < limit:
+        step = min(step, limit - run)
+        if a[i + run : i + run + step] == b[j + run : j + run + step]:
+            run += step
+            step *= 2
+        elif step == 1:
+            break
+        else:
+            step //= 2
+    return run
+
+# offsets (in order) of the digests that differ among the `count` digests starting at index i and j
+def differing_digests(up, i, down, j, count):
+    todo = [(0, count)]
+    while todo:
+        start, length = todo.pop()
+        if up[(i + start) * digest_bytes : (i + start + length) * digest_bytes] == \
+           down[(j + start) * digest_bytes : (j + start + length) * digest_bytes]:
+            continue
+        if length == 1:
+            yield start
+            continue
+        half = length // 2
+        todo.append((start + half, length - half))
+        todo.append((start, half))
+
+# sorted merge of two Table.Fingerprints, yields (position, address) for addresses that are
+# missing on one side or whose digests differ (position is how far along the merge we are, for visualize)
+def differing(upstream, downstream):
+    a, b = upstream.addresses, downstream.addresses
+    up, down = memoryview(upstream.digests), memoryview(downstream.digests)
+
+    i = j = 0
+    while i < len(a) and j < len(b):
+        if a[i] < b[j]:
+            yield i + j, a[i]
+            i += 1
+        elif b[j] < a[i]:
+            yield i + j, b[j]
+            j += 1
+        else:
+            run = aligned_run(a, i, b, j)
+            for offset in differing_digests(up, i, down, j, run):
+                yield i + j + 2 * offset, a[i + offset]
+            i += run
+            j += run
+
+    for k in range(i, len(a)):
+        yield k + j, a[k]
+    for k in range(j, len(b)):
+        yield i + k, b[k]
@@ -1,7 +1,6 @@
 #! /usr/bin/env pythone
-from slicetool.cli import parse_single_db_args, Prindenter, Indent, show_do_query
+from slicetool.cli import parse_single_db_args, make_printer, Prindenter, Indent, show_do_query
 from slicetool.mysql import Connection
-from slicetool.sync import TwinTable
 
 def strip_fk(mysql_args, printer=Prindenter()):
     target_db = cli_args.database
@@ -25,7 +24,7 @@ def strip_fk(mysql_args, printer=Prindenter()):
                     result = show_do_query(cursor, drop_constraint, printer=printer)
 
 def main(args):
-    printer = Prindenter(indent=0)
+    printer = make_printer(args)
 
     printer('Dropping foreign keys from database: {}'.format(args.database))
     strip_fk(args, printer=printer)
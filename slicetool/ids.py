@@ -1,3 +1,5 @@
+from array import array
+from bisect import bisect_left, bisect_right
 from collections import namedtuple
 
 Interval = namedtuple("Interval", "start end")
@@ -6,3 +8,109 @@ Interval = namedtuple("Interval", "start end")
 # such that when they are concatentated, you get the original list back
 def partition(num, data):
     return [data[x:x+num] for x in range(0, len(data), num)]
+
+# A set of ids, stored as sorted runs of consecutive ids (start and end inclusive, like Interval)
+# Overlapping and adjacent runs are merged as they're added, so clustered ids cost one run rather than one
+# entry apiece.  Iterating yields Intervals, so it can stand in for a list of scopes.
+class IntervalSet:
+
+    # things can be ids (ints) or Intervals, in any order
+    def __init__(self, things=()):
+        self.starts = array('q')
+        self.ends = array('q')
+
+        for thing in things:
+            if isinstance(thing, tuple):
+                self.add(thing[0], thing[1])
+            else:
+                self.add(thing, thing)
+
+    def add(self, start, end):
+
+        # the common case: things arrive in order, so append a run or extend the last one
+        if not self.starts or start > self.ends[-1] + 1:
+            self.starts.append(start)
+            self.ends.append(end)
+            return
+        if start >= self.starts[-1]:
+            self.ends[-1] = max(self.ends[-1], end)
+            return
+
+        # otherwise, replace whichever runs this one touches with their union
+        first = bisect_left(self.ends, start - 1)
+        last = bisect_right(self.starts, end + 1)
+        if first < last:
+            start = min(start, self.starts[first])
+            end = max(end, self.ends[last - 1])
+        self.starts[first:last] = array('q', [start])
+        self.ends[first:last] = array('q', [end])
+
+    # number of runs
+    def __len__(self):
+        return len(self.starts)
+
+    def __iter__(self):
+        return (Interval(start, end) for start, end in zip(self.starts, self.ends))
+
+    def __repr__(self):
+        return 'IntervalSet({})'.format(list(self))
+
+    def __eq__(self, other):
+        return self.starts == other.starts and self.ends == other.ends
+
+    def __contains__(self, id):
+        i = bisect_right(self.starts, id) - 1
+        return i >= 0 and id <= self.ends[i]
+
+    # number of ids
+    def count(self):
+        return sum(self.ends) - sum(self.starts) + len(self.starts)
+
+    def __or__(self, other):
+        union = IntervalSet()
+        for run in sorted(list(self) + list(other)):
+            union.add(*run)
+        return union
+
+    def __and__(self, other):
+        intersection = IntervalSet()
+        i = j = 0
+        while i < len(self.starts) and j < len(other.starts):
+            start = max(self.starts[i], other.starts[j])
+            end = min(self.ends[i], other.ends[j])
+            if start <= end:
+                intersection.add(start, end)
+            if self.ends[i] < other.ends[j]:
+                i += 1
+            else:
+                j += 1
+        return intersection
+
+    def __sub__(self, other):
+        difference = IntervalSet()
+        j = 0
+        for start, end in self:
+            # skip runs of other that end before this one starts
+            while j < len(other.starts) and other.ends[j] < start:
+                j += 1
+            k = j
+            while k < len(other.starts) and other.starts[k] <= end:
+                if other.starts[k] > start:
+                    difference.add(start, other.starts[k] - 1)
+                start = max(start, other.ends[k] + 1)
+                k += 1
+            if start <= end:
+                difference.add(start, end)
+        return difference
+
+    # sql conditions on `column` that select these ids, at most `terms` runs each
+    # single ids are gathered into IN lists, longer runs become BETWEENs
+    def predicates(self, column, terms):
+        conditions = []
+        for runs in partition(terms, list(self)):
+            singles = [ str(x.start) for x in runs if x.start == x.end ]
+            ranges = [ f"{column} BETWEEN {x.start} AND {x.end}" for x in runs if x.start != x.end ]
+            if singles:
+                ranges.append("{} in ({})".format(column, ",".join(singles)))
+            conditions.append(" OR ".join(ranges))
+        return conditions
@@ -0,0 +1,110 @@
+import os
+import json
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+# Per-table, per-phase instrumentation
+# ====================================
+
+# things we count for each (table, phase)
+# seconds are wall time and include time spent in nested phases
+counters = [ 'seconds',
+             'queries',
+             'rows_scanned',          # rows read by fingerprint queries
+             'fingerprints_compared', # row or range fingerprints examined for diffs
+             'rows_transferred',      # rows written to dump files
+             'rows_deleted',          # rows deleted downstream
+             'bytes_written' ]        # bytes written to dump files
+
+# a Prindenter carries one of these around, so anything that can print can also count
+class Metrics:
+    def __init__(self):
+        self.started = time.time()
+        self.labels = OrderedDict()
+        self.phases = OrderedDict()
+
+        # counts are attributed to the innermost (table, phase)
+        self.stack = [('', 'other')]
+
+    def _bucket(self, table, phase):
+        return self.phases.setdefault((table, phase), OrderedDict((x, 0) for x in counters))
+
+    # attribute anything that happens in this block to a table
+    @contextmanager
+    def table(self, table_name):
+        self.stack.append((table_name, 'other'))
+        try:
+            yield
+        finally:
+            self.stack.pop()
+
+    # attribute anything that happens in this block to a phase of the current table, and time it
+    @contextmanager
+    def phase(self, phase_name):
+        table_name = self.stack[-1][0]
+        self.stack.append((table_name, phase_name))
+        started = time.time()
+        try:
+            yield
+        finally:
+            self.stack.pop()
+            self._bucket(table_name, phase_name)['seconds'] += time.time() - started
+
+    # add to the counters of the current (table, phase)
+    def count(self, **amounts):
+        bucket = self._bucket(*self.stack[-1])
+        for name, amount in amounts.items():
+            bucket[name] += amount
+
+    # add counts collected elsewhere (e.g. by worker threads) to the current table, keeping their phases
+    def merge(self, other):
+        table_name = self.stack[-1][0]
+        for (_, phase_name), values in other.phases.items():
+            bucket = self._bucket(table_name, phase_name)
+            for name, amount in values.items():
+                bucket[name] += amount
+
+    def report(self):
+        tables = OrderedDict()
+        for (table_name, phase_name), values in self.phases.items():
+            tables.setdefault(table_name or '(none)', OrderedDict())[phase_name] = values
+
+        return OrderedDict([ ('labels', self.labels),
+                             ('started', self.started),
+                             ('seconds', time.time() - self.started),
+                             ('tables', tables) ])
+
+    def write_json(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+
+    # for node_exporter's textfile collector
+    def write_prometheus(self, path):
+
+        def labels(**extra):
+            pairs = list(self.labels.items()) + list(extra.items())
+            escaped = [ '{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n'))
+                        for k, v in pairs ]
+            return '{' + ','.join(escaped) + '}'
+
+        lines = [ '# HELP slicetool_run_seconds Wall time of the whole run',
+                  '# TYPE slicetool_run_seconds gauge',
+                  'slicetool_run_seconds{} {}'.format(labels(), time.time() - self.started),
+                  '# HELP slicetool_run_timestamp_seconds When the run started',
+                  '# TYPE slicetool_run_timestamp_seconds gauge',
+                  'slicetool_run_timestamp_seconds{} {}'.format(labels(), self.started) ]
+
+        for counter in counters:
+            lines.append(f'# HELP slicetool_phase_{counter} {counter.replace("_", " ")} per table and phase')
+            lines.append(f'# TYPE slicetool_phase_{counter} gauge')
+            for (table_name, phase_name), values in self.phases.items():
+                lines.append('slicetool_phase_{}{} {}'.format(counter,
+                                                              labels(table=table_name, phase=phase_name),
+                                                              values[counter]))
+
+        # write-then-rename so the collector never sees a partial file
+        tmp = path + '.tmp'
+        with open(tmp, 'w') as f:
+            f.write('\n'.join(lines) + '\n')
+        os.rename(tmp, path)
@@ -28,8 +28,9 @@ class ConnectionBase:
         self.database = args.database
 
     # get a cursor for this connection
-    def cursor(self):
-        cursor = self.connection.cursor()
+    # (pass cursorclass=pymysql.cursors.SSCursor to stream results instead of buffering them)
+    def cursor(self, cursorclass=None):
+        cursor = self.connection.cursor(cursorclass)
 
         try:
             # a server I know doesn't like to have the database name in the connection string
@@ -0,0 +1,116 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from slicetool.cli import Prindenter, Indent, show_do_query, QUIET
+from slicetool.mysql import Connection
+import slicetool.ids as Ids
+import slicetool.table as Table
+import slicetool.constants as Constants
+
+# Partitioned tables
+# ==================
+
+# general() starts by fingerprinting the whole table at its largest zoom level.  With --partitions, a table that's
+# partitioned the same way on both sides is first fingerprinted one partition at a time (`FROM t PARTITION (p)`,
+# several partitions at once, each on its own connection): a row count, the id range, and an xor of row digests.
+# Partitions that match are left out of the scan, and it starts from the id range of each partition that doesn't,
+# so for tables partitioned by id range, zoom scopes begin at partition boundaries.  Deeper levels and transfers
+# select by id, which mysql prunes to the right partitions on its own.
+
+# names of the table's partitions, in order (empty if it isn't partitioned)
+def partitions(cursor, table_name, printer=Prindenter()):
+
+    result = show_do_query(cursor,
+           f"""
+            SELECT DISTINCT PARTITION_NAME, PARTITION_ORDINAL_POSITION
+            FROM information_schema.partitions
+            WHERE table_schema = '{cursor.connection.db}'
+            AND table_name = '{table_name}'
+            AND PARTITION_NAME IS NOT NULL
+            ORDER BY PARTITION_ORDINAL_POSITION;
+            """,
+            printer=printer)
+
+    return [ row['PARTITION_NAME'] for row in result ]
+
+def fingerprint_sql(table, partition, condition=None):
+    converted_columns_str = ",".join(table.columns)
+    return f"""
+            SELECT COUNT(*) AS partition_rows,
+                   MIN({table.id_col}) AS range_min,
+                   MAX({table.id_col}) AS range_max,
+                   BIT_XOR(CAST(CONV(LEFT(MD5(CONCAT_WS('|', {converted_columns_str})), 16), 16, 10) AS UNSIGNED))
+                       AS partition_fingerprint
+            FROM {table.name} PARTITION ({partition})
+            WHERE {condition or 'TRUE'};
+            """
+
+def fingerprint(cursor, table, partition, condition=None, printer=Prindenter()):
+    row = show_do_query(cursor, fingerprint_sql(table, partition, condition), printer=printer)[0]
+    printer.metrics.count(rows_scanned=row['partition_rows'])
+    return (row['partition_rows'], row['range_min'], row['range_max'], int(row['partition_fingerprint'] or 0))
+
+# {partition name : fingerprint} for one side of a twin
+# with a connection, partitions are fingerprinted one at a time on it, otherwise several at a time on their own connections
+def fingerprints(table, names, mysql_args, connection=None, condition=None, printer=Prindenter()):
+
+    if connection:
+        with connection.cursor() as cursor:
+            return { name : fingerprint(cursor, table, name, condition=condition, printer=printer) for name in names }
+
+    # the Prindenter isn't thread safe, each worker gets its own quiet one so that its metrics can be collected afterwards
+    lock = threading.Lock()
+    worker_printers = []
+    def work(name):
+        with lock:
+            worker_printer = Prindenter(verbosity=QUIET)
+            worker_printers.append(worker_printer)
+        with Connection(mysql_args) as worker_connection, worker_connection.cursor() as cursor:
+            return fingerprint(cursor, table, name, condition=condition, printer=worker_printer)
+
+    with ThreadPoolExecutor(max_workers=Constants.partition_streams) as pool:
+        results = dict(zip(names, pool.map(work, names)))
+
+    for worker_printer in worker_printers:
+        printer.metrics.merge(worker_printer.metrics)
+    return results
+
+# the parts of scopes that are in partitions whose fingerprints differ
+# (scopes itself if the table isn't partitioned, or isn't partitioned the same way downstream)
+def differing(db_pair, cli_args, table, scopes, condition=None, printer=Prindenter()):
+
+    with db_pair.upstream.connection.cursor() as upstream_cursor:
+        names = partitions(upstream_cursor, table.name, printer=printer)
+    with Connection(db_pair.downstream.args) as downstream_connection, downstream_connection.cursor() as downstream_cursor:
+        downstream_names = partitions(downstream_cursor, table.name, printer=printer)
+
+    if not names:
+        printer(f"{table.name} isn't partitioned, scanning all of it")
+        return scopes
+    if names != downstream_names:
+        printer(f"{table.name} is partitioned differently downstream, scanning all of it")
+        return scopes
+
+    printer(f"[Fingerprinting {len(names)} partitions of {table.name}, {Constants.partition_streams} at a time]")
+    with Indent(printer), printer.metrics.phase('partitions'):
+
+        # a --snapshot is read through db_pair's upstream connection, which the workers can't share
+        snapshot = db_pair.upstream.connection if db_pair.upstream.snapshot else None
+        upstream = Table.shared_upstream(table.shared, ('partition fingerprints', table.name, condition, tuple(table.upstream.columns)),
+                                         lambda : fingerprints(table.upstream, names, cli_args.upstream, connection=snapshot,
+                                                               condition=condition, printer=printer),
+                                         printer=printer)
+        downstream = fingerprints(table.downstream, names, db_pair.downstream.args, condition=condition, printer=printer)
+
+        found = Ids.IntervalSet()
+        for name in names:
+            if upstream[name] == downstream[name]:
+                continue
+
+            # a differing row is within its partition's id range on one side or the other
+            ids = [ x for x in upstream[name][1:3] + downstream[name][1:3] if x is not None ]
+            found.add(min(ids), max(ids))
+            printer(f"{name} differs ({upstream[name][0]} rows upstream, {downstream[name][0]} downstream)")
+
+        printer(f"{len(names) - sum(upstream[x] != downstream[x] for x in names)} of {len(names)} partitions match, skipping them")
+
+    return found & scopes
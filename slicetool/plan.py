@@ -0,0 +1,172 @@
+from math import ceil
+from datetime import timedelta
+from collections import namedtuple
+from slicetool.cli import Prindenter, Indent, show_do_query
+from slicetool.mysql import Connection
+import slicetool.constants as Constants
+
+# Estimating the cost of a sync without doing it
+# ==============================================
+
+# used by --plan: nothing here fingerprints or transfers anything, the estimates come from
+# information_schema statistics, max(id) on both sides, and the slice definition's zoom levels
+
+TableStats = namedtuple("TableStats", "rows avg_row_length data_length max_id")
+
+def table_stats(cursor, table_name, id_col, printer=Prindenter()):
+
+    result = show_do_query(cursor,
+           f"""
+            SELECT TABLE_ROWS, AVG_ROW_LENGTH, DATA_LENGTH
+            FROM information_schema.tables
+            WHERE table_schema = '{cursor.connection.db}'
+            AND table_name = '{table_name}';
+            """,
+            printer=printer)
+
+    # not there yet (it will be created on the first sync)
+    if not result:
+        return TableStats(0, 0, 0, 0)
+
+    if id_col:
+        target = f'max({id_col})'
+        max_id = show_do_query(cursor, f'select {target} from {table_name};', printer=printer)[0][target] or 0
+    else:
+        max_id = 0
+
+    return TableStats(int(result[0]['TABLE_ROWS'] or 0),
+                      int(result[0]['AVG_ROW_LENGTH'] or 0),
+                      int(result[0]['DATA_LENGTH'] or 0),
+                      max_id)
+
+def both_stats(table_name, id_col, db_pair, printer=Prindenter()):
+    printer(f"[Reading statistics for {table_name}]")
+    with Indent(printer):
+        with db_pair.upstream.connection.cursor() as upstream_cursor:
+            upstream = table_stats(upstream_cursor, table_name, id_col, printer=printer)
+        with Connection(db_pair.downstream.args) as downstream_connection:
+            with downstream_connection.cursor() as downstream_cursor:
+                downstream = table_stats(downstream_cursor, table_name, id_col, printer=printer)
+    return upstream, downstream
+
+def megabytes(num_bytes):
+    return "{:.1f} MB".format(num_bytes / 1024**2)
+
+def seconds(rows_hashed, bytes_transferred):
+    return rows_hashed / Constants.plan_rows_hashed_per_second \
+         + bytes_transferred / Constants.plan_bytes_transferred_per_second
+
+def duration(rows_hashed, bytes_transferred):
+    return str(timedelta(seconds=round(seconds(rows_hashed, bytes_transferred))))
+
+# things that make a zoom list expensive or wrong, regardless of the data
+def zoom_warnings(zoom_levels, upstream, db_pair):
+    warnings = []
+    levels = sorted(set(zoom_levels), reverse=True)
+
+    if len(levels) != len(zoom_levels):
+        warnings.append(f"zoom levels {zoom_levels} contain duplicates")
+
+    for level in levels:
+        if upstream.max_id and level >= upstream.max_id:
+            warnings.append(f"zoom level {level} is at least max(id) ({upstream.max_id}), it only repeats the whole-table scan")
+
+        # a range of `level` ids can hold up to `level` rows, and their fingerprints must fit in one GROUP_CONCAT
+        if level > 1 and level > db_pair.concat.md5s:
+            warnings.append(f"zoom level {level} is larger than the {db_pair.concat.md5s} row fingerprints "
+                            "group_concat_max_len allows, range fingerprints will be truncated")
+
+    for larger, smaller in zip(levels, levels[1:]):
+        if larger / smaller < 2:
+            warnings.append(f"zoom levels {larger} and {smaller} are so close that the second pass can't narrow much")
+
+    if levels and levels[-1] > 1 and upstream.rows and upstream.max_id:
+        density = upstream.rows / upstream.max_id
+        warnings.append(f"finest zoom level is {levels[-1]}, each differing row will drag ~{ceil(levels[-1] * density)} rows along with it")
+
+    return warnings
+
+def report(table_name, estimates, warnings, printer=Prindenter()):
+
+    with Indent(printer):
+        for phase, (rows_hashed, queries, bytes_transferred) in estimates:
+            printer(f"{phase:<28} rows hashed: {rows_hashed:>12}   queries: {queries:>6}   "
+                    f"transfer: {megabytes(bytes_transferred):>10}")
+
+        rows_hashed = sum(x[1][0] for x in estimates)
+        queries = sum(x[1][1] for x in estimates)
+        bytes_transferred = sum(x[1][2] for x in estimates)
+
+        summary = (f"{table_name} : PLAN worst case {rows_hashed} rows hashed, {queries} queries, "
+                   f"{megabytes(bytes_transferred)} transferred, ~{duration(rows_hashed, bytes_transferred)}")
+        printer(summary)
+        printer.append_summary(summary)
+
+        for warning in warnings:
+            message = f"{table_name} : PLAN WARNING {warning}"
+            printer(message)
+            printer.append_summary(message)
+
+# what would Sync.general do to this table?
+def general(table_name, zoom_levels, db_pair, cli_args, id_col='id', batch_rows=Constants.batch_rows, printer=Prindenter()):
+
+    printer(f"[Planning 'general' sync of {table_name} with zoom levels {zoom_levels}]")
+    with Indent(printer):
+        upstream, downstream = both_stats(table_name, id_col, db_pair, printer=printer)
+
+    density = upstream.rows / upstream.max_id if upstream.max_id else 0
+    row_bytes = upstream.avg_row_length
+    estimates = []
+
+    # pull_missing_ids: every row past downstream's max(id), a dump per batch_rows ids
+    missing_ids = max(upstream.max_id - downstream.max_id, 0)
+    missing_rows = ceil(missing_ids * density)
+    estimates.append(("missing ids", (0, ceil(missing_ids / batch_rows) + 1, missing_rows * row_bytes)))
+
+    if cli_args.lite:
+        # modified_time depends on the data, we can't guess how much of it there is
+        estimates.append(("modified_time (unknown)", (0, 1, 0)))
+        report(table_name, estimates, zoom_warnings(zoom_levels, upstream, db_pair), printer=printer)
+        return
+
+    # interim CHECKSUM TABLE reads both sides
+    estimates.append(("checksum", (upstream.rows + downstream.rows, 2, 0)))
+
+    # worst case: every range at every zoom level differs, so each level hashes every row on both sides
+    # the number of queries depends on how many scopes the level above handed down
+    scopes = 1
+    for level in sorted(set(zoom_levels), reverse=True):
+        batches = ceil(scopes / Constants.batch_fingerprints)
+        estimates.append((f"fingerprint@{level}", (upstream.rows + downstream.rows, 2 * batches, 0)))
+        scopes = ceil(upstream.max_id / level) if level > 1 else upstream.rows
+
+    # ...and then every row is transferred, and the checksum repeated
+    transfer_batches = ceil(scopes / Constants.batch_fingerprints)
+    estimates.append(("transfer", (0, 3 * transfer_batches, upstream.rows * row_bytes)))
+    estimates.append(("final checksum", (2 * upstream.rows, 2, 0)))
+
+    report(table_name, estimates, zoom_warnings(zoom_levels, upstream, db_pair), printer=printer)
+
+# what would Sync.composite_key_sync do to this table?
+def composite_key_sync(table_name, db_pair, cli_args, keys, printer=Prindenter()):
+
+    printer(f"[Planning 'composite key' sync of {table_name} grouped by {keys[0]}]")
+    with Indent(printer):
+        upstream, downstream = both_stats(table_name, None, db_pair, printer=printer)
+
+    # group sizes and group fingerprints each read the whole table on both sides, bracketed by checksums
+    both = upstream.rows + downstream.rows
+    estimates = [ ("checksum", (both, 2, 0)),
+                  ("group sizes", (both, 2, 0)),
+                  ("group fingerprints", (both, 4, 0)),
+                  ("transfer", (0, 3, upstream.rows * upstream.avg_row_length)),
+                  ("final checksum", (both, 2, 0)) ]
+
+    report(table_name, estimates, [], printer=printer)
+
+# custom sync functions do whatever they do, we can't see inside them
+def custom(table_name, printer=Prindenter()):
+    message = f"{table_name} : PLAN not estimated (custom sync function)"
+    with Indent(printer):
+        printer(message)
+    printer.append_summary(message)
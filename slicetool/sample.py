@@ -0,0 +1,98 @@
+import random
+from collections import namedtuple, OrderedDict
+from slicetool.cli import Prindenter, Indent
+from slicetool.mysql import Connection
+import slicetool.db as Db
+import slicetool.ids as Ids
+import slicetool.table as Table
+import slicetool.plan as Plan
+import slicetool.constants as Constants
+
+# Choosing a strategy by sampling
+# ===============================
+
+# Zooming in on diffs pays when they're sparse.  When most of a table differs, every zoom level ends up
+# fingerprinting most of it, only for nearly everything to be transferred anyway.  With --auto-strategy,
+# general() fingerprints a few random ranges first (with md5_row_ranges, as a scan would), estimates what
+# fraction of rows differ, and compares what zooming and reloading would cost (at --plan's throughputs).
+
+Estimate = namedtuple("Estimate", "ranges differing fraction")
+
+# fingerprint random ranges of ids that both sides have, and estimate the fraction of rows that differ
+def estimate(db_pair, table, condition=None, printer=Prindenter()):
+
+    top = min(table.upstream.max_id, table.downstream.max_id)
+    granularity = Constants.sample_granularity
+    size = Constants.sample_range_ids
+
+    # nothing downstream to compare against
+    if top <= 0:
+        return Estimate(0, 0, 1.0)
+
+    # ranges start on range boundaries, so each holds whole fingerprinted pieces
+    samples = Ids.IntervalSet()
+    for _ in range(Constants.sample_ranges):
+        start = random.randrange(0, max(top - size, 0) + 1) // granularity * granularity
+        samples.add(start, min(start + size - 1, top))
+
+    in_samples = " OR ".join(samples.predicates(table.id_col, len(samples)))
+    if condition:
+        in_samples = f"{condition} AND ({in_samples})"
+
+    with Connection(db_pair.downstream.args) as downstream_connection:
+        with downstream_connection.cursor() as downstream_cursor:
+            with db_pair.upstream.connection.cursor() as upstream_cursor:
+                db_pair.reup_maxes(downstream_cursor, upstream_cursor, printer=printer)
+                upstream = Table.md5_row_ranges(upstream_cursor, table.upstream, in_samples, granularity, printer=printer)
+                downstream = Table.md5_row_ranges(downstream_cursor, table.downstream, in_samples, granularity, printer=printer)
+
+    ranges = len(set(upstream.addresses) | set(downstream.addresses))
+    differing = len(list(Db.differing(upstream, downstream)))
+    if not ranges:
+        return Estimate(0, 0, 0.0)
+
+    # a range differs unless all of its rows are the same: p = 1 - (1 - f)^granularity
+    fraction = 1 - (1 - differing / ranges) ** (1 / granularity)
+    return Estimate(ranges, differing, fraction)
+
+# rows hashed and bytes transferred by the ways general() could finish the table, given the fraction of rows that differ
+def costs(rows, avg_row_length, zoom_levels, fraction):
+
+    # the first level scans the whole table, each later one scans the ranges the level before found diffs in
+    rows_hashed = 0
+    share = 1.0
+    for granularity in sorted(set(zoom_levels), reverse=True):
+        rows_hashed += 2 * rows * share
+        share = min(1.0, 1 - (1 - fraction) ** granularity)
+
+    return OrderedDict([ ('zoom diff', (rows_hashed, fraction * rows * avg_row_length)),
+                         ('reload',    (0, rows * avg_row_length)) ])
+
+# print the choice, add it to the summary and the event stream
+def log(table_name, strategy, reason, printer=Prindenter(), **fields):
+    message = f"{table_name} : STRATEGY {strategy} ({reason})"
+    with Indent(printer):
+        printer(message)
+    printer.append_summary(message)
+    printer.event('strategy', table=table_name, strategy=strategy, reason=reason, **fields)
+
+# 'zoom diff' or 'reload'?  (the other outcomes, 'nothing' and 'append-only', are settled by the presync)
+def choose(db_pair, table, zoom_levels, condition=None, printer=Prindenter()):
+
+    printer(f"[Sampling {Constants.sample_ranges} ranges of {table.name} to estimate how much of it differs]")
+    with Indent(printer), printer.metrics.phase('sample'):
+        sampled = estimate(db_pair, table, condition=condition, printer=printer)
+
+        with db_pair.upstream.connection.cursor() as upstream_cursor:
+            stats = Plan.table_stats(upstream_cursor, table.name, table.id_col, printer=printer)
+
+        options = costs(stats.rows, stats.avg_row_length, zoom_levels, sampled.fraction)
+        for name, work in options.items():
+            printer(f"{name:<10} ~{Plan.duration(*work)}")
+
+    seconds = OrderedDict((name, Plan.seconds(*work)) for name, work in options.items())
+    table.strategy = min(seconds, key=seconds.get)
+    log(table.name, table.strategy,
+        f"{sampled.differing} of {sampled.ranges} sampled ranges differ, ~{sampled.fraction:.1%} of rows",
+        printer=printer, fraction=sampled.fraction, seconds=seconds)
+    return table.strategy
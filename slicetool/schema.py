@@ -1,7 +1,7 @@
 #! /usr/bin/env python3
-from slicetool.cli import parse_pull_args, Prindenter, Indent, mysqldump_schema_nofk, mysqlload, show_do_query
+from slicetool.cli import parse_pull_args, make_printer, Prindenter, Indent, mysqldump_schema_nofk, mysqlload, show_do_query
 from slicetool.mysql import Connection
-import re
+import pymysql
 from collections import namedtuple, OrderedDict
 
 class ColumnSchema:
@@ -29,8 +29,45 @@ class TableSchema:
 
 ColumnChanges = namedtuple("ColumnChanges", "added deleted modified")
 
-# return true if changes were made
-def sync_schema(upstream_cursor, downstream_cursor, table_name, printer=Prindenter()):
+# everything we intend to do to a downstream table, worked out before any of it is done
+# clauses are joined into a single ALTER so that InnoDB rebuilds the table (at most) once
+SchemaPlan = namedtuple("SchemaPlan", "table_name clauses algorithm rebuild_bytes report")
+
+# ALTER TABLE algorithms from cheapest to most expensive
+# INSTANT touches only metadata, INPLACE rebuilds the table but allows concurrent writes,
+# COPY rebuilds the table and blocks writes while it does so
+algorithms = ['INSTANT', 'INPLACE', 'COPY']
+
+# errors mysql raises when a requested ALGORITHM can't be used for a given ALTER
+# (or when the server is too old to know about it), try the next one in line
+algorithm_refusals = [ 1800,  # ER_UNKNOWN_ALTER_ALGORITHM
+                       1845,  # ER_ALTER_OPERATION_NOT_SUPPORTED
+                       1846,  # ER_ALTER_OPERATION_NOT_SUPPORTED_REASON
+                       4092 ] # ER_INNODB_INSTANT_ADD_NOT_SUPPORTED_MAX_SIZE
+
+# find the definition of a single column in the output of `show create table`
+def column_definition(create_table, field):
+    for line in create_table.split('\n'):
+        if line.strip().startswith('`{}` '.format(field)):
+            return line.strip().strip(',').strip()
+    raise ValueError("Unable to find a definition for column {} in:\n{}".format(field, create_table))
+
+# how many bytes will be rewritten if this table is rebuilt?
+def rebuild_bytes(cursor, table_name, printer=Prindenter()):
+    result = show_do_query(cursor,
+            """
+            SELECT IFNULL(DATA_LENGTH, 0) + IFNULL(INDEX_LENGTH, 0) AS table_bytes
+            FROM information_schema.tables
+            WHERE table_schema = '{}'
+            AND table_name = '{}';
+            """.format(cursor.connection.db, table_name), printer=printer)
+    if result:
+        return int(result[0]['table_bytes'])
+    else:
+        return 0
+
+# compare schemas and work out a single ALTER that makes downstream look like upstream
+def plan_schema(upstream_cursor, downstream_cursor, table_name, printer=Prindenter()):
 
     # collect schema changes for reporting
     report = ColumnChanges([], [], [])
@@ -44,79 +81,135 @@ def sync_schema(upstream_cursor, downstream_cursor, table_name, printer=Prindent
     up_columns = { x.field : x for x in up.columns }
     down_columns = { x.field : x for x in down.columns }
 
-    add = { k:v for k,v in up_columns.items() if k not in down_columns }
-    delete = { k:v for k,v in down_columns.items() if k not in up_columns }
-
     upstream_creates_q = "show create table {}".format(table_name)
-    upstream_creates = show_do_query(upstream_cursor, upstream_creates_q)
+    create_table = show_do_query(upstream_cursor, upstream_creates_q, printer=printer)[0]['Create Table']
 
-    if add:
-        with Indent(printer):
-            printer("Adding {} columns downstream".format(len(add)))
+    clauses = []
+    algorithm = 'INSTANT'
+    def at_least(needed):
+        return max(algorithm, needed, key=algorithms.index)
 
-            for new_col, schema in add.items():
+    for removed_col in down_columns.keys():
+        if removed_col not in up_columns:
+            clauses.append("DROP COLUMN `{}`".format(removed_col))
+            report.deleted.append(removed_col)
+            algorithm = at_least('INPLACE')
 
-                create = next(filter(lambda x : re.search(new_col, x),
-                    upstream_creates[0]['Create Table'].split('\n'))).strip(',').strip()
+    # simulate the downstream column order as the ALTER proceeds
+    # so that we know which columns actually need to move
+    order = [ x.field for x in down.columns if x.field in up_columns ]
+
+    with Indent(printer):
+        for position, up_col in enumerate(up.columns):
+
+            definition = column_definition(create_table, up_col.field)
+            if up_col.after:
+                placement = "AFTER `{}`".format(up_col.after)
+            else:
+                placement = "FIRST"
+
+            if up_col.field not in down_columns:
+                printer("Adding column: {}".format(up_col.field))
+                clauses.append("ADD COLUMN {} {}".format(definition, placement))
+                report.added.append(up_col.field)
+
+                # appending a column is a metadata change, inserting one in the middle is not
+                if position < len(order):
+                    algorithm = at_least('INPLACE')
+            else:
+                down_col = down_columns[up_col.field]
+                moved = order.index(up_col.field) != position
+
+                if moved or up_col.default != down_col.default or up_col.null != down_col.null or up_col.type != down_col.type:
+                    printer("Modifying column: {}".format(up_col.field))
+                    printer("Old:\n {}".format(down_col))
+                    printer("New:\n {}".format(up_col))
+
+                    clauses.append("MODIFY COLUMN {} {}".format(definition, placement))
+
+                    if up_col.type != down_col.type:
+                        algorithm = at_least('COPY')
+                    elif moved or up_col.null != down_col.null:
+                        algorithm = at_least('INPLACE')
 
-                add_query = "ALTER TABLE {} ADD COLUMN {} ".format(table_name, create)
-                if schema.after:
-                    add_query += "AFTER {}".format(schema.after)
+                    column_report = OrderedDict()
+                    column_report["column"] = up_col.field
+                    column_report["from"] = down_col.__dict__
+                    column_report["to"] = up_col.__dict__
+                    report.modified.append(column_report)
                 else:
-                    add_query += "FIRST"
-                add_query += ";"
-                show_do_query(downstream_cursor, add_query)
-                # TODO: import the new table values explicitly, rather than letting the sync catch them
-
-                report.added.append(new_col)
-
-    if delete:
-        with Indent(printer):
-            printer("Deleting {} columns downstream".format(len(delete)))
-            for removed_col in delete.keys():
-                drop_query = "ALTER TABLE {} DROP COLUMN {};".format(table_name, removed_col)
-                show_do_query(downstream_cursor, drop_query)
-                report.deleted.append(removed_col)
-
-    down = TableSchema(show_do_query(downstream_cursor, describe, printer=printer))
-    down_columns = { x.field : x for x in down.columns }
+                    printer("Column: {} has no schema changes".format(up_col.field))
+
+                order.remove(up_col.field)
+
+            order.insert(position, up_col.field)
+
+    if not clauses:
+        return SchemaPlan(table_name, clauses, None, 0, report)
+
+    if algorithm == 'INSTANT':
+        cost = 0
+    else:
+        cost = rebuild_bytes(downstream_cursor, table_name, printer=printer)
+
+    return SchemaPlan(table_name, clauses, algorithm, cost, report)
+
+# render a plan as a single ALTER statement
+def plan_ddl(plan, algorithm=None):
+    ddl = "ALTER TABLE {}\n    ".format(plan.table_name) + ",\n    ".join(plan.clauses)
+    if algorithm:
+        ddl += ",\n    ALGORITHM={}".format(algorithm)
+    return ddl + ";"
+
+def show_plan(plan, printer=Prindenter()):
+    if not plan.clauses:
+        printer("{} : no schema changes planned".format(plan.table_name))
+        return
+
+    printer("[Planned DDL for {}]".format(plan.table_name))
+    with Indent(printer):
+        printer(plan_ddl(plan, plan.algorithm))
+
+    if plan.algorithm == 'INSTANT':
+        cost = "metadata only, no rebuild"
+    elif plan.algorithm == 'INPLACE':
+        cost = "rebuilds ~{:.1f} MB in place, concurrent writes allowed".format(plan.rebuild_bytes / 1024**2)
+    else:
+        cost = "copies ~{:.1f} MB, writes blocked while it runs".format(plan.rebuild_bytes / 1024**2)
+    printer("Expected algorithm: {} ({})".format(plan.algorithm, cost))
 
-    # check for necessary modifications in upstream column order
-    for up in up_columns.values():
-        down = next(filter(lambda x : x.field == up.field, down_columns.values()))
+# apply the plan as one ALTER, starting with the cheapest algorithm we expect to work
+# and falling back to more expensive ones if the server refuses
+def apply_plan(downstream_cursor, plan, printer=Prindenter()):
 
-        if up.field != down.field:
-            raise ValueError("Unable to compare schemas for table {} column {} != {}".format(
-                table_name,
-                up.field,
-                down.field))
-        else:
+    if not plan.clauses:
+        return
+
+    for algorithm in algorithms[algorithms.index(plan.algorithm):]:
+        try:
+            printer("Altering {} with ALGORITHM={}".format(plan.table_name, algorithm))
             with Indent(printer):
-                if up.after != down.after or up.default != down.default or up.null != down.null or up.type != down.type:
-                    printer("Modifying column: {}".format(up.field))
-                    printer("Old:\n {}".format(down))
-                    printer("New:\n {}".format(up))
-
-                    modify = next(filter(lambda x : re.search(up.field, x),
-                        upstream_creates[0]['Create Table'].split('\n'))).strip(',').strip()
-
-                    modify_query = "ALTER TABLE {} MODIFY COLUMN {} ".format(table_name, modify)
-                    if up.after:
-                        modify_query += "AFTER {}".format(up.after)
-                    else:
-                        modify_query += "FIRST"
-                    modify_query += ";"
-                    show_do_query(downstream_cursor, modify_query)
+                show_do_query(downstream_cursor, plan_ddl(plan, algorithm), printer=printer)
+            return
+        except pymysql.err.MySQLError as err:
+            if err.args[0] in algorithm_refusals and algorithm != algorithms[-1]:
+                with Indent(printer):
+                    printer("ALGORITHM={} refused: {}".format(algorithm, err.args[1]))
+            else:
+                raise
 
-                    column_report = OrderedDict()
-                    column_report["column"] = up.field
-                    column_report["from"] = up.__dict__
-                    column_report["to"] = down.__dict__
-                    report.modified.append(column_report)
-                else:
-                    printer("Column: {} has no schema changes".format(up.field))
+# return a report of the changes made (or that would have been made, if dry_run)
+def sync_schema(upstream_cursor, downstream_cursor, table_name, dry_run=False, printer=Prindenter()):
+
+    plan = plan_schema(upstream_cursor, downstream_cursor, table_name, printer=printer)
 
-    return report
+    with Indent(printer):
+        show_plan(plan, printer=printer)
+        if not dry_run:
+            apply_plan(downstream_cursor, plan, printer=printer)
+            # TODO: import the new column values explicitly, rather than letting the sync catch them
+
+    return plan.report
 
 def pull_schema(args, upstream_connection, printer=Prindenter()):
 
@@ -144,7 +237,7 @@ def pull_schema(args, upstream_connection, printer=Prindenter()):
         mysqlload(args.downstream, tmp_file, printer=printer)
 
 def main(args):
-    printer = Prindenter(indent=0)
+    printer = make_printer(args)
 
     printer('Pulling schema from {} to {}'.format(args.upstream.host, args.downstream.host))
 
@@ -153,11 +246,50 @@ def main(args):
 
     printer('Done')
 
+# print the ALTER that sync_schema would run for each table found on both sides, but don't run it
+def diff_schemas(args, printer=Prindenter()):
+
+    show_tables = 'show tables;'
+
+    with Connection(args.upstream) as upstream_connection, Connection(args.downstream) as downstream_connection:
+        with upstream_connection.cursor() as upstream_cursor, downstream_connection.cursor() as downstream_cursor:
+
+            upstream_tables = [ list(x.values())[0] for x in show_do_query(upstream_cursor, show_tables, printer=printer) ]
+            downstream_tables = [ list(x.values())[0] for x in show_do_query(downstream_cursor, show_tables, printer=printer) ]
+
+            for table_name in upstream_tables:
+                printer('[Table: {}]'.format(table_name))
+                with Indent(printer):
+                    if table_name not in downstream_tables:
+                        printer("missing downstream, it will be created on the next sync")
+                        continue
+
+                    report = sync_schema(upstream_cursor, downstream_cursor, table_name, dry_run=True, printer=printer)
+                    if report.added or report.deleted or report.modified:
+                        printer.append_summary("{} : schema change planned ({} added, {} removed, {} modified)".format(
+                            table_name, len(report.added), len(report.deleted), len(report.modified)))
+
+def dry_run(args):
+    printer = make_printer(args)
+
+    printer('Planning schema changes from {}.{} to {}.{}'.format(args.upstream.host, args.upstream.database,
+                                                                 args.downstream.host, args.downstream.database))
+    with Indent(printer):
+        diff_schemas(args, printer=printer)
+
+    printer('Done (nothing was altered)')
+    printer.print_summary()
+
 # used as entrypoint in setup.py
 def pull():
     cli_args = parse_pull_args('Start with an empty downstream database and replace it with the frail empty shell of an upstream database (schema only, no foreign keys).')
     main(cli_args)
 
+# used as entrypoint in setup.py
+def diff():
+    cli_args = parse_pull_args('Print the ALTER statements (and their expected rebuild cost) that would make downstream tables match upstream ones, without running them.')
+    dry_run(cli_args)
+
 # called when this script is run directly
 if __name__ == '__main__':
     pull()
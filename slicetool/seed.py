@@ -0,0 +1,121 @@
+import os
+import queue
+import threading
+import pymysql
+from concurrent.futures import ThreadPoolExecutor
+from slicetool.cli import Prindenter, Indent, show_do_query, dump_rows, mysqlload, QUIET
+from slicetool.mysql import Connection
+
+# Seeding an empty downstream table in parallel
+# =============================================
+
+# mysqldump_data_batches dumps one id range after another into a single file, and the file is loaded once
+# they're all done.  Here several upstream sessions dump id ranges at the same time, and each range is loaded
+# downstream as soon as it's ready (also several at a time).
+
+# The upstream sessions all read from the same snapshot, mydumper-style: while one session holds a read lock
+# on the table (so that nobody is mid-write), the others each start a consistent-snapshot transaction.
+# Once they've all started, the lock is released.
+
+def synchronized_snapshot(connections, table_name, mysql_args, printer=Prindenter()):
+
+    def start(connection):
+        with connection.cursor() as cursor:
+            show_do_query(cursor, 'SET SESSION TRANSACTION ISOLATION LEVEL REPEATABLE READ;', printer=printer)
+            show_do_query(cursor, 'START TRANSACTION WITH CONSISTENT SNAPSHOT;', printer=printer)
+
+    printer(f"[Starting {len(connections)} upstream sessions on one snapshot of {table_name}]")
+    with Indent(printer):
+        with Connection(mysql_args) as coordinator, coordinator.cursor() as cursor:
+            try:
+                show_do_query(cursor, f'LOCK TABLES {table_name} READ;', printer=printer)
+                locked = True
+            except pymysql.err.MySQLError as err:
+                # no LOCK TABLES privilege, the sessions start close together but not quite on the same snapshot
+                printer(f"Unable to lock {table_name} ({err.args[1]}), snapshots may differ slightly between sessions")
+                printer.append_summary(f"{table_name} : parallel seed snapshots were NOT synchronized")
+                locked = False
+
+            for connection in connections:
+                start(connection)
+
+            if locked:
+                show_do_query(cursor, 'UNLOCK TABLES;', printer=printer)
+
+# dump id ranges (Interval-like tuples) from table concurrently and load each into downstream when it's ready
+def seed(table, cli_args, ranges, condition=None,
+         upstream_streams=None, downstream_streams=None, printer=Prindenter()):
+
+    upstream_streams = min(upstream_streams or cli_args.seed_streams, len(ranges))
+    downstream_streams = downstream_streams or cli_args.load_streams
+
+    printer(f"[Seeding {table.name} from {len(ranges)} id ranges, "
+            f"{upstream_streams} dumping at a time, {downstream_streams} loading at a time]")
+
+    if not ranges:
+        return
+
+    todo = queue.Queue()
+    for number, (start, end) in enumerate(ranges):
+        todo.put((number, start, end))
+
+    # the Prindenter isn't thread safe, workers print through this
+    # (the main thread is blocked while they run, so the indent won't change underneath them)
+    lock = threading.Lock()
+    def progress(msg):
+        with lock:
+            printer(msg)
+
+    # each worker gets its own quiet printer so that its metrics can be collected afterwards
+    worker_printers = []
+    def quiet_printer():
+        with lock:
+            worker_printer = Prindenter(verbosity=QUIET)
+            worker_printers.append(worker_printer)
+        return worker_printer
+
+    def load(number, start, end, outfile, rows):
+        mysqlload(cli_args.downstream, outfile, printer=quiet_printer())
+        os.remove(outfile)
+        progress(f"range {number + 1} of {len(ranges)} ({table.id_col} {start} to {end}): loaded {rows} rows")
+
+    def dump(connection, loader, loads):
+        worker_printer = quiet_printer()
+        while True:
+            try:
+                number, start, end = todo.get_nowait()
+            except queue.Empty:
+                return
+
+            in_range = f"{table.id_col} BETWEEN {start} AND {end}"
+            if condition:
+                in_range = f"{condition} AND {in_range}"
+
+            outfile = f"{table.name}.seed{number}.sql"
+            rows = dump_rows(connection, table.name, in_range, outfile=outfile, printer=worker_printer)
+            progress(f"range {number + 1} of {len(ranges)} ({table.id_col} {start} to {end}): dumped {rows} rows")
+            loads.append(loader.submit(load, number, start, end, outfile, rows))
+
+    connections = []
+    try:
+        with Indent(printer):
+            for _ in range(upstream_streams):
+                connections.append(Connection(cli_args.upstream).__enter__())
+            synchronized_snapshot(connections, table.name, cli_args.upstream, printer=printer)
+
+            loads = []
+            with ThreadPoolExecutor(max_workers=downstream_streams) as loader:
+                with ThreadPoolExecutor(max_workers=upstream_streams) as dumper:
+                    dumps = [ dumper.submit(dump, connection, loader, loads) for connection in connections ]
+
+                    # surface the first error, if any
+                    for future in dumps:
+                        future.result()
+                for future in loads:
+                    future.result()
+    finally:
+        for connection in connections:
+            connection.__exit__(None, None, None)
+
+    for worker_printer in worker_printers:
+        printer.metrics.merge(worker_printer.metrics)
@@ -1,79 +1,149 @@
 #! /usr/bin/env python3
-from slicetool.billing_meta import get_steps as billing_meta_steps
-from slicetool.billing_billing import get_steps as billing_billing_steps
-from slicetool.billingUi_meta import get_steps as billingUi_meta_steps
-from slicetool.test import get_steps as test_steps
-from slicetool.cli import parse_pull_args, Prindenter, Indent
+import os
+from copy import copy
+from contextlib import contextmanager
+from slicetool.cli import parse_pull_args, make_printer, Prindenter, Indent
 from slicetool.mysql import Connection
 import slicetool.db as Db
 
+# upstream results kept for the other downstreams (see Table.shared_upstream), dump files included
+def release(shared):
+    for key, value in shared.items():
+        if key[0] == 'dump' and os.path.exists(value):
+            os.remove(value)
+    shared.clear()
+
+# with --snapshot, read upstream from one snapshot while a table is synced (against every downstream)
+@contextmanager
+def snapshot(db_pair, table_name, cli_args, printer=Prindenter()):
+    if cli_args.snapshot:
+        with Db.upstream_snapshot(db_pair, table_name, printer=printer):
+            yield
+    else:
+        yield
+
 # accepts cli_args and a function to call which provides steps for syncing a slice from remote to downstream
 def main(cli_args, get_steps, slice_name):
 
-    printer = Prindenter(indent=0)
+    printer = make_printer(cli_args)
+    targets = cli_args.downstreams
+
+    if cli_args.changeset and len(targets) > 1:
+        raise ValueError("--changeset records the delta against one downstream, it can't be used with --extra-downstream-database")
 
     printer('Syncing a {} slice from {}.{} to {}.{}'.format(
         slice_name, cli_args.upstream.host, cli_args.upstream.database,
-                    cli_args.downstream.host, cli_args.downstream.database))
+                    cli_args.downstream.host, ','.join(x.database for x in targets)))
 
     with Indent(printer):
         printer('[Upstream connection parameters]')
         with Indent(printer):
             printer(cli_args.upstream.__dict__)
 
-        printer('[Downstream connection parameters]')
-        with Indent(printer):
-            printer(cli_args.downstream.__dict__)
+        for target in targets:
+            printer('[Downstream connection parameters]')
+            with Indent(printer):
+                printer(target.__dict__)
+
+    printer.metrics.labels['slice'] = slice_name
+    printer.metrics.labels['upstream'] = f'{cli_args.upstream.host}/{cli_args.upstream.database}'
+    printer.metrics.labels['downstream'] = f'{cli_args.downstream.host}/' + ','.join(x.database for x in targets)
 
     printer("[Database configuration check]")
     with Connection(cli_args.upstream) as upstream_connection, Indent(printer):
 
-        # collect database-level info into an object
-        with Connection(cli_args.downstream) as downstream_connection:
-            with downstream_connection.cursor() as downstream_cursor:
-                with upstream_connection.cursor() as upstream_cursor:
-                    db_pair = Db.Twin(upstream_cursor, downstream_cursor, printer=printer)
-
-        db_pair.downstream.args = cli_args.downstream
-
-        db_pair.upstream.args = cli_args.upstream
-        db_pair.upstream.connection = upstream_connection
-
+        # one db_pair per downstream, all of them sharing the upstream side
+        pairs = []
+        for target in targets:
+            target_args = copy(cli_args)
+            target_args.downstream = target
+            db_pair = Db.connect_twin(target_args, upstream_connection, printer=printer)
+            if pairs:
+                db_pair.upstream = pairs[0][1].upstream
+            pairs.append((target_args, db_pair))
+
+        # with only one downstream there's nothing to reuse, so don't keep anything
+        shared = pairs[0][1].upstream.shared = {} if len(pairs) > 1 else None
+
+        # record the delta rather than applying it (dump files are needed even if both databases share a server)
+        changeset = None
+        if cli_args.changeset:
+            from slicetool.changeset import Writer
+            changeset = pairs[0][1].changeset = Writer(cli_args.changeset)
+            pairs[0][1].same_server = False
 
         printer("[Database sync]")
         with Indent(printer):
-            # do the sync-steps for each table in the slice
-            for table_name, sync_func in get_steps(db_pair, cli_args, printer=printer).items():
+            steps = [ get_steps(db_pair, target_args, printer=printer) for target_args, db_pair in pairs ]
+
+            # with --snapshot, each table is read from one upstream snapshot, so copies that bypass it are off
+            if cli_args.snapshot:
+                for _, db_pair in pairs:
+                    db_pair.same_server = False
+
+            # do the sync-steps for each table in the slice, against each downstream in turn
+            for table_name in steps[0].keys():
                 printer(f'[Table: {table_name}]')
-                with Indent(printer):
-                    if sync_func:
-                        sync_func()
-                        printer("")
-                    else:
-                        with Indent(printer):
-                            printer("skipped explicitly by slice definition")
-                            printer("")
+                with Indent(printer), snapshot(pairs[0][1], table_name, cli_args, printer=printer):
+                    for (target_args, db_pair), target_steps in zip(pairs, steps):
+
+                        if shared is None:
+                            metrics_name = table_name
+                        else:
+                            metrics_name = f'{target_args.downstream.database}.{table_name}'
+                            printer.summary_prefix = f'{target_args.downstream.database}.'
+                            printer(f'[Downstream: {target_args.downstream.database}]')
+
+                        with Indent(printer), printer.metrics.table(metrics_name):
+                            sync_func = target_steps[table_name]
+                            if sync_func:
+                                sync_func()
+                                printer("")
+                            else:
+                                with Indent(printer):
+                                    printer("skipped explicitly by slice definition")
+                                    printer("")
+
+                    if shared is not None:
+                        release(shared)
+
+        printer.summary_prefix = ''
+
+        if changeset:
+            changeset.close()
+            printer(f"[Changeset written to {cli_args.changeset}, apply it with replay_changeset]")
 
     printer('Done')
     printer.print_summary()
 
+    if cli_args.metrics_json:
+        printer.metrics.write_json(cli_args.metrics_json)
+    if cli_args.metrics_prom:
+        printer.metrics.write_prometheus(cli_args.metrics_prom)
+
+# slice definitions are imported by their entrypoints, so each command only loads what it uses
+
 # used as entrypoint in setup.py
 def billing_meta():
+    from slicetool.billing_meta import get_steps as billing_meta_steps
     cli_args = parse_pull_args('update a downstream (stale) billing-slice of meta with upstream freshness')
     main(cli_args, billing_meta_steps, "billing slice of meta")
 
 # used as entrypoint in setup.py
 def billing_billing():
+    from slicetool.billing_billing import get_steps as billing_billing_steps
     cli_args = parse_pull_args('update a downstream (stale) billing-slice of billing with upstream freshness')
     main(cli_args, billing_billing_steps, "billing slice of billing")
 
 # used as entrypoint in setup.py
 def billingUI_meta():
+    from slicetool.billingUi_meta import get_steps as billingUi_meta_steps
     cli_args = parse_pull_args('update a downstream (stale) billingUi-slice of meta with upstream freshness')
     main(cli_args, billingUi_meta_steps, "billingUI slice of meta")
 
 # used as entrypoint in setup.py
 def test():
+    from slicetool.test import get_steps as test_steps
     cli_args = parse_pull_args('update a downstream (stale) test database with upstream freshness')
     main(cli_args, test_steps, "test slice of things_upstream")
 
@@ -0,0 +1,132 @@
+import os
+import hashlib
+import pymysql
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from slicetool.cli import Prindenter, Indent, pretty_shorten
+from slicetool.mysql import Connection
+import slicetool.table as Table
+import slicetool.ids as Ids
+import slicetool.constants as Constants
+
+# Diffing on the client
+# =====================
+
+# Db.find_diffs has both servers MD5 every row they scan, which is the heaviest thing we ask of the upstream.
+# Here both sides just read their rows in id order (unbuffered) and this machine does the hashing, spread over
+# a pool of processes.  A merge-join of the two hashed streams finds rows that differ, are missing, or are extra.
+# The servers do less work, the network carries whole rows instead of fingerprints.
+
+# runs in a worker process: digest each row, except for its id (the first value)
+def hash_rows(rows):
+    return [ (row[0], hashlib.md5(repr(row[1:]).encode()).digest()) for row in rows ]
+
+# yield (id, digest) for the rows of one side, in id order
+# at most `window` chunks are being hashed at a time, so memory stays bounded however large the table is
+# rows are read through connection if one is given (e.g. the upstream one, during a --snapshot), otherwise through a new one
+def hashed_rows(mysql_args, table_name, id_col, columns, condition, pool, window, connection=None, printer=Prindenter()):
+
+    if connection is None:
+        with Connection(mysql_args) as connection:
+            yield from hashed_rows(mysql_args, table_name, id_col, columns, condition, pool, window,
+                                   connection=connection, printer=printer)
+        return
+
+    with connection.cursor(pymysql.cursors.SSCursor) as cursor:
+        cursor.execute(f"SELECT {id_col}, {', '.join(columns)} FROM {table_name} "
+                       f"WHERE {condition} ORDER BY {id_col};")
+
+        pending = deque()
+        while True:
+            rows = cursor.fetchmany(Constants.stream_chunk_rows)
+            if rows:
+                printer.metrics.count(rows_scanned=len(rows))
+                pending.append(pool.submit(hash_rows, rows))
+
+            # hand back finished chunks in order, once the window is full (or there's nothing left to read)
+            while pending and (len(pending) >= window or not rows):
+                for hashed in pending.popleft().result():
+                    yield hashed
+
+            if not rows:
+                return
+
+# ids in either stream that are missing from the other, or whose digests disagree, in id order
+def merge_join(upstream, downstream, printer=Prindenter()):
+
+    done = (None, None)
+    up = next(upstream, done)
+    down = next(downstream, done)
+    compared = 0
+
+    while up is not done or down is not done:
+        compared += 1
+        if down is done or (up is not done and up[0] < down[0]):
+            yield up[0]                  # missing downstream
+            up = next(upstream, done)
+        elif up is done or down[0] < up[0]:
+            yield down[0]                # extra downstream
+            down = next(downstream, done)
+        else:
+            if up[1] != down[1]:
+                yield up[0]              # differs
+            up = next(upstream, done)
+            down = next(downstream, done)
+
+    printer.metrics.count(fingerprints_compared=compared)
+
+# a drop-in for Db.find_diffs (same scopes in, same kind of addresses out)
+# with granularity 1 it yields ids, otherwise the Intervals of that size that contain differing ids
+def find_diffs(db_pair, table, scopes, granularity, condition=None, printer=Prindenter()):
+
+    conditions = [ f"{table.id_col} BETWEEN {scope.start} AND {scope.end}" for scope in scopes ]
+
+    batched_conditions = []
+    for batch in Ids.partition(Constants.batch_fingerprints, conditions):
+        if condition:
+            batched_conditions.append(condition + " AND (" + " OR ".join(batch) + ")")
+        else:
+            batched_conditions.append(" OR ".join(batch))
+
+    # both sides select the same columns, in the same order
+    with db_pair.upstream.connection.cursor() as upstream_cursor:
+        columns = Table.column_names(upstream_cursor, table.name, printer=printer)
+
+    processes = Constants.stream_hash_processes or os.cpu_count()
+    window = Constants.stream_window
+
+    printer(f"[Streaming {table.name} from both sides and hashing it here, "
+            f"{processes} processes, {window} chunks of {Constants.stream_chunk_rows} rows in flight per side]")
+
+    with ProcessPoolExecutor(max_workers=processes) as pool:
+        for ct, batched_condition in enumerate(batched_conditions):
+
+            # yield the batch's diffs once its phase is over, so the caller's work isn't counted as streaming
+            addresses = []
+            with Indent(printer), printer.metrics.phase('stream'):
+                printer(f"[ Batch {ct + 1} of {len(batched_conditions)} where {pretty_shorten(batched_condition)[:-1]} ]")
+
+                upstream = hashed_rows(db_pair.upstream.args, table.name, table.id_col, columns,
+                                       batched_condition, pool, window,
+                                       connection=db_pair.upstream.connection if db_pair.upstream.snapshot else None,
+                                       printer=printer)
+                downstream = hashed_rows(db_pair.downstream.args, table.name, table.id_col, columns,
+                                         batched_condition, pool, window, printer=printer)
+
+                found = 0
+                last = None
+                for id in merge_join(upstream, downstream, printer=printer):
+                    found += 1
+                    if granularity <= 1:
+                        addresses.append(id)
+                    else:
+                        address = Ids.Interval((id // granularity) * granularity, (id // granularity + 1) * granularity - 1)
+                        if address != last:
+                            last = address
+                            addresses.append(address)
+
+                with Indent(printer):
+                    printer(f"{found} rows differ")
+
+            for address in addresses:
+                yield address
@@ -0,0 +1,127 @@
+from collections import namedtuple, OrderedDict
+from slicetool.cli import Prindenter, Indent
+from slicetool.mysql import Connection
+import slicetool.db as Db
+import slicetool.ids as Ids
+import slicetool.table as Table
+import slicetool.sync as Sync
+import slicetool.plan as Plan
+import slicetool.constants as Constants
+
+# Subset slices
+# =============
+
+# Some tables are only wanted in part: the rows matching some predicate, plus whatever rows they refer to (and
+# sometimes whatever refers to them).  Describe that with seed predicates and relationships, and this works out
+# which rows are needed (the closure), then brings downstream in line with just those rows: differing and
+# missing rows are transferred, rows that are no longer needed are deleted, everything else is left alone.
+
+# rows of `child` refer to rows of `parent` through child.column = parent.id
+# a needed child row always makes its parent needed, with children=True a needed parent also needs all its children
+Relationship = namedtuple("Relationship", "child column parent children")
+
+# which rows of each table are needed?  seeds are {table name : predicate}
+# returns {table name : IntervalSet of ids}, found by following relationships on the upstream server until nothing new turns up
+def closure(connection, seeds, relationships, id_col='id', printer=Prindenter()):
+
+    tables = list(seeds.keys()) + [ x for r in relationships for x in [r.child, r.parent] ]
+    needed = OrderedDict((x, Ids.IntervalSet()) for x in tables)
+    frontier = OrderedDict((x, Ids.IntervalSet()) for x in tables)
+
+    printer("[Selecting seed rows]")
+    with Indent(printer):
+        for table_name, predicate in seeds.items():
+            frontier[table_name] = Db.select_ids(connection,
+                                                 f"SELECT {id_col} FROM {table_name} WHERE {predicate} ORDER BY {id_col};",
+                                                 printer=printer)
+            printer(f"{table_name}: {frontier[table_name].count()} rows")
+
+    printer("[Following relationships]")
+    with Indent(printer):
+        while any(frontier.values()):
+            table_name = next(x for x, ids in frontier.items() if ids)
+            new = frontier[table_name] - needed[table_name]
+            frontier[table_name] = Ids.IntervalSet()
+            if not new:
+                continue
+            needed[table_name] = needed[table_name] | new
+
+            # ask about the new rows in batches, the server does the joining
+            for relationship in relationships:
+                if relationship.child == table_name:
+                    for predicate in new.predicates(id_col, Constants.batch_conditions):
+                        parents = Db.select_ids(connection,
+                                                f"SELECT DISTINCT {relationship.column} FROM {relationship.child} "
+                                                f"WHERE {predicate} ORDER BY {relationship.column};",
+                                                printer=printer)
+                        frontier[relationship.parent] = frontier[relationship.parent] | parents
+
+                if relationship.parent == table_name and relationship.children:
+                    for predicate in new.predicates(relationship.column, Constants.batch_conditions):
+                        children = Db.select_ids(connection,
+                                                 f"SELECT {id_col} FROM {relationship.child} "
+                                                 f"WHERE {predicate} ORDER BY {id_col};",
+                                                 printer=printer)
+                        frontier[relationship.child] = frontier[relationship.child] | children
+
+            printer(f"{table_name}: +{new.count()} rows")
+
+    return needed
+
+# bring one downstream table in line with the needed rows of its upstream twin
+# returns how many rows were transferred and deleted, or None if the table can't be recorded to the changeset
+def sync_table(table_name, needed, db_pair, cli_args, id_col='id', printer=Prindenter()):
+
+    printer(f"[Syncing {needed.count()} needed rows of {table_name}]")
+    with Indent(printer):
+        with Connection(db_pair.downstream.args) as downstream_connection:
+            with downstream_connection.cursor() as downstream_cursor:
+                with db_pair.upstream.connection.cursor() as upstream_cursor:
+
+                    with printer.metrics.phase('introspection'):
+                        # with --changeset the downstream schema is left alone, tables whose schema differs are skipped
+                        if db_pair.changeset:
+                            if not db_pair.changeset.schema(upstream_cursor, downstream_cursor, table_name, printer=printer):
+                                return None
+                        table = Table.Twin(table_name, downstream_cursor, upstream_cursor, id_col, printer=printer)
+                        if not db_pair.changeset:
+                            table.try_sync_schema(upstream_cursor, downstream_cursor, throw=False, printer=printer)
+
+                    # rows that are no longer needed
+                    present = Db.select_ids(downstream_connection, f"SELECT {id_col} FROM {table_name} ORDER BY {id_col};",
+                                            printer=printer)
+                    unneeded = present - needed
+
+                    # needed rows that are missing or differ
+                    if needed:
+                        differing = Ids.IntervalSet(Db.find_diffs(upstream_cursor, downstream_cursor, table, needed, 1,
+                                                                  shared=db_pair.upstream.shared,
+                                                                  same_server=db_pair.same_server, printer=printer))
+                    else:
+                        differing = Ids.IntervalSet()
+
+        for condition in unneeded.predicates(id_col, Constants.batch_conditions):
+            Sync.delete_downstream(db_pair, table_name, condition, printer=printer)
+
+        for condition in differing.predicates(id_col, Constants.batch_conditions):
+            Sync.transfer(db_pair, cli_args, table_name, condition, printer=printer)
+
+    return differing.count(), unneeded.count()
+
+# sync the closure of seeds (see closure) for each table it touches
+def sync(subset_name, seeds, relationships, db_pair, cli_args, id_col='id', printer=Prindenter()):
+
+    if cli_args.plan:
+        return Plan.custom(subset_name, printer=printer)
+
+    printer(f"[Computing the {subset_name} subset]")
+    with Indent(printer), printer.metrics.phase('closure'):
+        needed = closure(db_pair.upstream.connection, seeds, relationships, id_col=id_col, printer=printer)
+
+    for table_name, ids in needed.items():
+        synced = sync_table(table_name, ids, db_pair, cli_args, id_col=id_col, printer=printer)
+        if synced is None:
+            continue
+        transferred, deleted = synced
+        printer.append_summary(f"{table_name} : UP TO DATE for the {subset_name} subset "
+                               f"({ids.count()} rows, {transferred} transferred, {deleted} no longer needed)")
@@ -1,6 +1,7 @@
+import os
 import textwrap
 import json
-import sh
+from copy import copy
 from collections import namedtuple, OrderedDict
 from sortedcontainers import SortedDict
 
@@ -8,25 +9,370 @@ import slicetool.db as Db
 import slicetool.ids as Ids
 import slicetool.table as Table
 import slicetool.constants as Constants
+import slicetool.plan as Plan
+import slicetool.seed as Seed
+import slicetool.stream as Stream
+import slicetool.sample as Sample
+import slicetool.partition as Partition
 from slicetool.cli import Prindenter, Indent, mysqldump_data_batches, mysqldump_data, \
-                          mysqlload, mysqldump_schema_nofk, show_do_query
+                          mysqlload, mysqldump_schema_nofk, show_do_query, bulk_session, dump_rows
 from slicetool.mysql import Connection
 from slicetool.schema import sync_schema
 
-import IPython
+# clear rows from the downstream table (or, with --changeset, record that they should be cleared)
+def delete_downstream(db_pair, table_name, condition, printer=Prindenter()):
+    if db_pair.changeset:
+        db_pair.changeset.delete(table_name, condition, printer=printer)
+        return
+
+    with Connection(db_pair.downstream.args) as downstream_connection:
+        with downstream_connection.cursor() as cursor, printer.metrics.phase('delete'):
+            with bulk_session(cursor, db_pair.downstream.args, printer=printer):
+                result = show_do_query(cursor, f'delete from {table_name} where {condition};', printer=printer)
+                printer.metrics.count(rows_deleted=max(cursor.rowcount, 0))
+            return result
+
+# load a dump file into the downstream table (or, with --changeset, record it for later)
+def load_downstream(db_pair, cli_args, table_name, dumpfile, printer=Prindenter()):
+    if db_pair.changeset:
+        db_pair.changeset.load(table_name, dumpfile, printer=printer)
+    else:
+        mysqlload(cli_args.downstream, dumpfile, printer=printer)
+
+# dump upstream rows of table_name (by calling dump) and return the file to load them from
+# when there are several downstreams, the file is renamed after what's in it so later downstreams can load it too
+def dump_upstream(db_pair, table_name, key, dump, printer=Prindenter()):
+    shared = db_pair.upstream.shared
+    if shared is None:
+        dump()
+        return table_name + '.sql'
+
+    key = ('dump', table_name) + key
+    if key in shared:
+        printer(f"[Reusing {shared[key]}, dumped for an earlier downstream]")
+    else:
+        dump()
+        shared[key] = f"{table_name}.fanout{len(shared)}.sql"
+        os.replace(table_name + '.sql', shared[key])
+    return shared[key]
+
+# like mysqldump_data_batches, but through the upstream connection, so that with --snapshot the rows come from its snapshot
+def dump_rows_batches(db_pair, table_name, batch_size, max_id, min_id=0, id_col='id', condition=None, apply='reload',
+                      printer=Prindenter()):
+
+    starts = range(min_id, max_id + 1, batch_size)
+    printer(f"[Dump proceeding across {len(starts)} batches with size < {batch_size}]")
+    with Indent(printer):
+        for number, start in enumerate(starts):
+            in_batch = f"{id_col} >= {start} and {id_col} <= {start + batch_size - 1}"
+            if condition:
+                in_batch = f"{condition} and {in_batch}"
+            dump_rows(db_pair.upstream.connection, table_name, in_batch, append=number > 0, apply=apply, printer=printer)
+
+# dump upstream rows where condition into table_name.sql, written the way --apply wants them
+# (through the upstream connection if it's reading a --snapshot, or for upserts, which mysqldump can't write)
+def dump_data(db_pair, cli_args, table_name, condition, printer=Prindenter()):
+    if db_pair.upstream.snapshot or cli_args.apply == 'upsert':
+        dump_rows(db_pair.upstream.connection, table_name, condition, apply=cli_args.apply, printer=printer)
+    else:
+        mysqldump_data(cli_args.upstream, table_name, condition, apply=cli_args.apply, printer=printer)
+
+# Apply modes
+# ===========
+
+# By default (--apply reload) rows that are about to be transferred are deleted downstream first.  With --apply
+# replace or upsert they're overwritten by key instead, so the only rows deleted are those whose keys are gone
+# upstream.  That's less index work, and no moment where a unique key is held by a row that's on its way out.
+
+# the key rows are overwritten by, or None if they should be deleted and reloaded
+def overwrite_key(db_pair, cli_args, table_name, printer=Prindenter()):
+    if cli_args.apply == 'reload':
+        return None
+
+    with db_pair.upstream.connection.cursor() as cursor:
+        key = Table.primary_key(cursor, table_name, printer=printer)
+    if not key:
+        printer(f"{table_name} has no primary key, deleting and reloading its rows instead")
+    return key or None
+
+# delete downstream rows where condition whose key_columns don't match any upstream row where condition
+def delete_vanished(db_pair, table_name, key_columns, condition, printer=Prindenter()):
+
+    select = "SELECT {} FROM {} WHERE {};".format(", ".join(f"`{x}`" for x in key_columns), table_name, condition)
+    keys = lambda cursor : set(tuple(row[x] for x in key_columns) for row in show_do_query(cursor, select, printer=printer))
+
+    printer(f"[Finding keys of {table_name} that are gone upstream]")
+    with Indent(printer):
+        with db_pair.upstream.connection.cursor() as upstream_cursor:
+            upstream = keys(upstream_cursor)
+        with Connection(db_pair.downstream.args) as downstream_connection:
+            with downstream_connection.cursor() as downstream_cursor:
+                vanished = sorted(keys(downstream_cursor) - upstream)
+                escape = downstream_cursor.connection.escape
+        printer(f"{len(vanished)} found")
+
+        for batch in Ids.partition(Constants.batch_conditions, vanished):
+            if len(key_columns) == 1:
+                in_batch = "`{}` in ({})".format(key_columns[0], ",".join(escape(x[0]) for x in batch))
+            else:
+                in_batch = "({}) in ({})".format(",".join(f"`{x}`" for x in key_columns), ",".join(escape(x) for x in batch))
+            delete_downstream(db_pair, table_name, in_batch, printer=printer)
+
+# clear the way for upstream's rows where condition
+def make_room(db_pair, cli_args, table_name, condition, printer=Prindenter()):
+    key = overwrite_key(db_pair, cli_args, table_name, printer=printer)
+    if key:
+        delete_vanished(db_pair, table_name, key, condition, printer=printer)
+    else:
+        delete_downstream(db_pair, table_name, condition, printer=printer)
+
+# on the same server, copy upstream rows into downstream without them leaving the server
+# (the downstream user reads the upstream database, see Db.same_server)
+def copy_on_server(db_pair, table_name, condition, apply='reload', printer=Prindenter()):
+
+    with Connection(db_pair.downstream.args) as downstream_connection:
+        with downstream_connection.cursor() as cursor, printer.metrics.phase('load'):
+            names = Table.column_names(cursor, table_name, printer=printer)
+            columns = ", ".join(names)
+            if apply == 'upsert':
+                on_duplicate = "ON DUPLICATE KEY UPDATE " + ", ".join(f"{x}=VALUES({x})" for x in names)
+            else:
+                on_duplicate = ""
+            with bulk_session(cursor, db_pair.downstream.args, printer=printer):
+                show_do_query(cursor,
+                              f"""
+                              {'REPLACE' if apply == 'replace' else 'INSERT'} INTO {table_name} ({columns})
+                              SELECT {columns} FROM `{db_pair.upstream.args.database}`.{table_name}
+                              WHERE {condition}
+                              {on_duplicate};
+                              """,
+                              printer=printer)
+                printer.metrics.count(rows_transferred=max(cursor.rowcount, 0))
+
+# replace the downstream rows matching condition with their upstream counterparts
+def transfer(db_pair, cli_args, table_name, condition, printer=Prindenter()):
+
+    if db_pair.same_server:
+        make_room(db_pair, cli_args, table_name, condition, printer=printer)
+        copy_on_server(db_pair, table_name, condition, apply=cli_args.apply, printer=printer)
+        return
+
+    # dump upstream data
+    dumpfile = dump_upstream(db_pair, table_name, ('rows', condition),
+                             lambda : dump_data(db_pair, cli_args, table_name, condition, printer=printer),
+                             printer=printer)
+
+    # clear old rows from downstream (or with --apply replace/upsert, just the ones that are gone upstream)
+    make_room(db_pair, cli_args, table_name, condition, printer=printer)
+
+    # load new rows into downstream
+    load_downstream(db_pair, cli_args, table_name, dumpfile, printer=printer)
+
+# Column deltas
+# =============
+
+# With --column-deltas, rows that general() found to differ are fingerprinted again, a digest per column group
+# (see Table.column_groups).  Rows that both sides have, and that differ in only some groups, get just those
+# columns UPDATEd, so a status flip in a row with a large TEXT column doesn't mean reloading the TEXT.
+
+# set columns of the downstream rows to upstream's values, rows is a list of dicts with id_col and columns
+def update_downstream(db_pair, table, columns, rows, printer=Prindenter()):
+    with Connection(db_pair.downstream.args) as downstream_connection:
+        with downstream_connection.cursor() as cursor, printer.metrics.phase('update'):
+            escape = cursor.connection.escape
+            ids = ",".join(str(row[table.id_col]) for row in rows)
+            assignments = [ "`{0}` = CASE `{1}` {2} END".format(column, table.id_col,
+                                                                 " ".join(f"WHEN {row[table.id_col]} THEN {escape(row[column])}" for row in rows))
+                            for column in columns ]
+            with bulk_session(cursor, db_pair.downstream.args, printer=printer):
+                show_do_query(cursor, f"UPDATE {table.name} SET {', '.join(assignments)} WHERE {table.id_col} in ({ids});",
+                              printer=printer)
+                printer.metrics.count(rows_transferred=len(rows))
+
+# returns the ids that still need a transfer: those missing on either side, and those that differ in every group
+def update_columns(db_pair, table, ids, printer=Prindenter()):
+
+    remaining = Ids.IntervalSet()
+    updates = OrderedDict() # differing groups -> ids
+
+    printer(f"[Fingerprinting column groups of {ids.count()} differing rows]")
+    with Indent(printer):
+        with Connection(db_pair.downstream.args) as downstream_connection:
+            with downstream_connection.cursor() as downstream_cursor:
+                with db_pair.upstream.connection.cursor() as upstream_cursor, printer.metrics.phase('fingerprint@columns'):
+
+                    groups = Table.column_groups(upstream_cursor, table.name, table.id_col, printer=printer)
+                    names = [ x.strip('`') for x in Table.column_names(upstream_cursor, table.name, printer=printer) ]
+
+                    for condition in ids.predicates(table.id_col, Constants.batch_conditions):
+                        upstream = { row['id'] : row for row in show_do_query(upstream_cursor,
+                                                                              Table.md5_column_groups_sql(table.upstream, groups, condition),
+                                                                              printer=printer) }
+                        downstream = { row['id'] : row for row in show_do_query(downstream_cursor,
+                                                                                Table.md5_column_groups_sql(table.downstream, groups, condition),
+                                                                                printer=printer) }
+                        printer.metrics.count(rows_scanned=len(upstream) + len(downstream))
+
+                        for id in sorted(set(upstream) | set(downstream)):
+                            if id not in upstream or id not in downstream:
+                                remaining.add(id, id)
+                                continue
+                            differing = tuple(n for n in range(len(groups)) if upstream[id][f'g{n}'] != downstream[id][f'g{n}'])
+                            if len(differing) == len(groups):
+                                remaining.add(id, id)
+                            elif differing:
+                                updates.setdefault(differing, []).append(id)
+
+        for differing, update_ids in updates.items():
+            columns = [ names[x] for n in differing for x in groups[n] ]
+            printer(f"[Updating {', '.join(columns)} in {len(update_ids)} rows]")
+            with Indent(printer):
+                for batch in Ids.partition(Constants.dump_rows_per_insert, update_ids):
+                    select = "SELECT `{}`, {} FROM {} WHERE {} in ({});".format(table.id_col,
+                                                                                ", ".join(f"`{x}`" for x in columns),
+                                                                                table.name, table.id_col,
+                                                                                ",".join(str(x) for x in batch))
+                    with db_pair.upstream.connection.cursor() as upstream_cursor, printer.metrics.phase('dump'):
+                        rows = show_do_query(upstream_cursor, select, printer=printer)
+                    update_downstream(db_pair, table, columns, rows, printer=printer)
+
+        printer(f"{sum(len(x) for x in updates.values())} rows updated in place, {remaining.count()} left to transfer")
+    return remaining
+
+# Id presence
+# ===========
+
+# pull_missing_ids only looks past the downstream's max id, so rows inserted or deleted below it are otherwise only
+# found by fingerprinting content.  With --presence-diff, both sides first summarize their ids per range (count,
+# min, max, xor), then the ranges that disagree are compared id by id, as bitmaps.  Both passes read the primary
+# key only.  Missing rows are transferred and extra ones deleted, so a table whose only changes were inserts and
+# deletes passes the interim checksum, and never gets a content scan.
+
+# ids set in the bitmaps of `a` (see Table.id_bitmaps) that aren't set in those of `b`
+def bitmap_difference(a, b):
+    ids = Ids.IntervalSet()
+    for word in sorted(a):
+        bits = a[word] & ~b.get(word, 0)
+        while bits:
+            lowest = bits & -bits
+            id = word * Table.id_bitmap_bits + lowest.bit_length() - 1
+            ids.add(id, id)
+            bits ^= lowest
+    return ids
+
+# return value indicates whether data was actually transferred
+def pull_presence_diffs(table, db_pair, cli_args, condition=None, printer=Prindenter()):
+
+    condition = condition or 'TRUE'
+    granularity = Constants.presence_granularity
+
+    with Connection(db_pair.downstream.args) as downstream_connection:
+        with downstream_connection.cursor() as downstream_cursor:
+            with db_pair.upstream.connection.cursor() as upstream_cursor, printer.metrics.phase('presence'):
+
+                printer(f"[Comparing ids in ranges of size {granularity}]")
+                with Indent(printer):
+                    downstream = Table.id_ranges(downstream_cursor, table.downstream, condition, granularity, printer=printer)
+                    upstream = Table.shared_upstream(table.shared, ('id ranges', table.name, condition, granularity),
+                                                     lambda : Table.id_ranges(upstream_cursor, table.upstream, condition,
+                                                                              granularity, printer=printer),
+                                                     printer=printer)
+
+                addresses = sorted(set(upstream) | set(downstream))
+                ranges = Ids.IntervalSet(Ids.Interval(x, x + granularity - 1) for x in addresses
+                                         if upstream.get(x) != downstream.get(x))
+                if not ranges:
+                    printer("No ranges with missing or extra ids")
+                    return False
+
+                printer(f"[Comparing ids one by one in {ranges.count() // granularity} of {len(addresses)} ranges]")
+                missing = Ids.IntervalSet()
+                extra = Ids.IntervalSet()
+                with Indent(printer):
+                    for batch in ranges.predicates(table.id_col, Constants.batch_fingerprints):
+                        in_batch = f"{condition} AND ({batch})"
+                        downstream_bits = Table.id_bitmaps(downstream_cursor, table.downstream, in_batch, printer=printer)
+                        upstream_bits = Table.shared_upstream(table.shared, ('id bitmaps', table.name, in_batch),
+                                                              lambda : Table.id_bitmaps(upstream_cursor, table.upstream,
+                                                                                        in_batch, printer=printer),
+                                                              printer=printer)
+                        missing = missing | bitmap_difference(upstream_bits, downstream_bits)
+                        extra = extra | bitmap_difference(downstream_bits, upstream_bits)
+
+    printer(f"{missing.count()} ids missing downstream, {extra.count()} ids only downstream")
+    with Indent(printer):
+        for batch in extra.predicates(table.id_col, Constants.batch_conditions):
+            delete_downstream(db_pair, table.name, batch, printer=printer)
+        for batch in missing.predicates(table.id_col, Constants.batch_conditions):
+            transfer(db_pair, cli_args, table.name, batch, printer=printer)
+
+    return bool(missing or extra)
 
 # return value indicates whether data was actually transferred
 def pull_missing_ids(table, db_pair, cli_args, batch_rows, condition=None, printer=Prindenter()):
 
     def make_space_downstream(printer):
-        with Connection(db_pair.downstream.args) as downstream_connection:
-            with downstream_connection.cursor() as cursor:
+        if condition:
+            beyond = f'{table.id_col} > {table.upstream.max_id} and {condition}'
+        else:
+            beyond = f'{table.id_col} > {table.upstream.max_id}'
+        with Indent(printer):
+            delete_downstream(db_pair, table.name, beyond, printer=printer)
+
+    def pull(empty, printer):
+
+        if db_pair.same_server:
+            # copy the missing ids over in batches, without dumping them
+            printer("Making space downstream")
+            make_space_downstream(printer)
+
+            min_id = 0 if empty else table.downstream.max_id + 1
+            for start in range(min_id, table.upstream.max_id + 1, batch_rows):
+                in_batch = f"{table.id_col} BETWEEN {start} AND {start + batch_rows - 1}"
                 if condition:
-                    delete = f'delete from {table.name} where {table.id_col} > {table.upstream.max_id} and {condition};'
-                else:
-                    delete = f'delete from {table.name} where {table.id_col} > {table.upstream.max_id};'
-                with Indent(printer):
-                    result = show_do_query(cursor, delete, printer=printer)
+                    in_batch = f"{condition} AND {in_batch}"
+                copy_on_server(db_pair, table.name, in_batch, apply=cli_args.apply, printer=printer)
+            return
+
+        if empty and cli_args.parallel_seed and not db_pair.changeset and not db_pair.upstream.snapshot:
+            # if the target table is empty, dump and load everything, several ranges at a time
+            printer("Making space downstream")
+            make_space_downstream(printer)
+
+            ranges = [ Ids.Interval(x, x + batch_rows - 1) for x in range(0, table.upstream.max_id + 1, batch_rows) ]
+            Seed.seed(table, cli_args, ranges, condition=condition, printer=printer)
+            return
+
+        # dump to a file
+        if empty:
+            # if the target table is empty, dump everything
+            min_id = 0
+        else:
+            # otherwise, dump just the rows whose ids aren't in the target
+            min_id = table.downstream.max_id + 1
+
+        if db_pair.upstream.snapshot or cli_args.apply == 'upsert':
+            dump = lambda : dump_rows_batches(db_pair, table.name, batch_rows, table.upstream.max_id, min_id=min_id,
+                                              id_col=table.id_col, condition=condition, apply=cli_args.apply,
+                                              printer=printer)
+        else:
+            dump = lambda : mysqldump_data_batches(cli_args.upstream,
+                                                   table.name,
+                                                   batch_rows,    # batch size
+                                                   table.upstream.max_id, # max id
+                                                   min_id=min_id,
+                                                   id_col=table.id_col,
+                                                   condition=condition,
+                                                   apply=cli_args.apply,
+                                                   printer=printer)
+        dumpfile = dump_upstream(db_pair, table.name, ('ids', min_id, table.upstream.max_id, condition), dump, printer=printer)
+
+        printer("Making space downstream")
+        make_space_downstream(printer)
+
+        # load from a file
+        printer("Loading updated rows")
+        load_downstream(db_pair, cli_args, table.name, dumpfile, printer=printer)
 
     if table.downstream.max_id == table.upstream.max_id:
         printer("Nothing to sync")
@@ -40,34 +386,14 @@ def pull_missing_ids(table, db_pair, cli_args, batch_rows, condition=None, print
     else:
         printer("Upstream db has more rows, pulling them.")
 
-        # dump to a file
-        if table.downstream.max_id == None or table.downstream.max_id == 0:
-            # if the target table is empty, dump everything
-            mysqldump_data_batches(cli_args.upstream,
-                                   table.name,
-                                   batch_rows,
-                                   table.upstream.max_id,
-                                   id_col=table.id_col,
-                                   condition=condition,
-                                   printer=printer)
+        empty = table.downstream.max_id == None or table.downstream.max_id == 0
 
+        # filling an empty table is a big load, build its secondary indexes afterwards instead of during
+        if empty and cli_args.defer_indexes and not db_pair.changeset:
+            with Table.deferred_indexes(cli_args.downstream, table.name, printer=printer):
+                pull(empty, printer)
         else:
-            # otherwise, dump just the rows whose ids aren't in the target
-            mysqldump_data_batches(cli_args.upstream,
-                                   table.name,
-                                   batch_rows,    # batch size
-                                   table.upstream.max_id, # max id
-                                   min_id=table.downstream.max_id + 1,
-                                   id_col=table.id_col,
-                                   condition=condition,
-                                   printer=printer)
-
-        printer("Making space downstream")
-        make_space_downstream(printer)
-
-        # load from a file
-        printer("Loading updated rows")
-        mysqlload(cli_args.downstream, table.name, printer=printer)
+            pull(empty, printer)
 
     return True
 
@@ -75,6 +401,10 @@ def pull_missing_ids(table, db_pair, cli_args, batch_rows, condition=None, print
 # if changes persist, groups by that key, sorts by the rest, and syncs based on md5 of md5's of rows in group
 def multikey(table, db_pair, cli_args, keycolumns, condition=None, printer=Prindenter()):
 
+    # with --apply replace/upsert, differing groups are overwritten rather than cleared first
+    # (unless there's no primary key for the overwrite to go by, see overwrite_key)
+    overwrite = overwrite_key(db_pair, cli_args, table.name, printer=printer) is not None
+
     # given a query result for both up and downstream, sync the rows where check_col differs
     def group_sync(id_col, check_col, upstream, downstream, made_changes, printer=Prindenter()):
 
@@ -86,6 +416,7 @@ def multikey(table, db_pair, cli_args, keycolumns, condition=None, printer=Prind
                     store.setdefault(row[key], {})
                     store[row[key]][name] = row[check_col]
                 except KeyError:
+                    import IPython # debug-only, so not imported up top
                     IPython.embed()
 
         populate('up', upstream, id_col, group_fingerprints_by_id)
@@ -101,7 +432,8 @@ def multikey(table, db_pair, cli_args, keycolumns, condition=None, printer=Prind
                 to_write.append(id)
             else:
                 if stream['up'] != stream['down']:
-                    to_delete.append(id)
+                    if not overwrite:
+                        to_delete.append(id)
                     to_write.append(id)
 
         if any(to_write):
@@ -117,10 +449,7 @@ def multikey(table, db_pair, cli_args, keycolumns, condition=None, printer=Prind
         if write_condition:
             printer(f"Found {str(len(to_write))} groups to pull down from upstream")
             made_changes = True
-            mysqldump_data(cli_args.upstream,
-                           table.name,
-                           write_condition,
-                           printer=printer)
+            dump_data(db_pair, cli_args, table.name, write_condition, printer=printer)
         else:
             printer(f"Nothing to pull down from upstream")
 
@@ -128,12 +457,15 @@ def multikey(table, db_pair, cli_args, keycolumns, condition=None, printer=Prind
             printer("Making space downstream")
             made_changes = True
             with Indent(printer):
-                with Connection(db_pair.downstream.args) as downstream_connection:
-                    with downstream_connection.cursor() as cursor:
-                        result = show_do_query(cursor, f'delete from {table.name} where {delete_condition};', printer=printer)
+                delete_downstream(db_pair, table.name, delete_condition, printer=printer)
         else:
             printer(f"Downstream space is open for new data")
 
+        # rows that are gone from groups that are being overwritten
+        if write_condition and overwrite:
+            with Indent(printer):
+                delete_vanished(db_pair, table.name, keycolumns, write_condition, printer=printer)
+
         if write_condition:
             # load from a file
             printer("Loading rows")
@@ -209,6 +541,10 @@ def pull_modifications_since(date, table, column, db_pair, cli_args, condition=N
             ids_to_sync = [ x[table.id_col] for x in newer_than_result ]
             printer("Found {} such rows".format(len(ids_to_sync)))
 
+            # the downstream won't change, so keep general's scan from recording these again
+            if db_pair.changeset:
+                table.recorded = table.recorded | Ids.IntervalSet(sorted(ids_to_sync))
+
             id_lists = Ids.partition(Constants.batch_conditions, ids_to_sync)
             conditions = []
             for ids in id_lists:
@@ -218,18 +554,7 @@ def pull_modifications_since(date, table, column, db_pair, cli_args, condition=N
             with Indent(printer):
                 printer("Proceeding in {} batches".format(len(conditions)))
                 for condition in conditions:
-
-                    # dump upstream data
-                    mysqldump_data(cli_args.upstream, table.name, condition, printer=printer)
-
-                    # clear old rows from downstream
-                    delete = 'delete from {} where {};'.format(table.name, condition)
-                    with Connection(db_pair.downstream.args) as downstream_connection:
-                        with downstream_connection.cursor() as cursor:
-                            show_do_query(cursor, delete, printer=printer)
-
-                    # load new rows into downstream
-                    mysqlload(cli_args.downstream, table.name, printer=printer)
+                    transfer(db_pair, cli_args, table.name, condition, printer=printer)
             return True
 
         else:
@@ -267,7 +592,9 @@ def unknown(table, preposition, printer):
         printer(message)
     return table
 
-def pre_general(table_name, db_pair, cli_args, id_col, batch_rows, condition=None, printer=Prindenter()):
+# hashing is {column name : strategy} for columns to fingerprint cheaply (see Table.examine_columns)
+# returns None if the table can't be recorded to the changeset
+def pre_general(table_name, db_pair, cli_args, id_col, batch_rows, condition=None, hashing=None, printer=Prindenter()):
 
     # keep track of which syncs were performed
     presync_types = []
@@ -277,9 +604,24 @@ def pre_general(table_name, db_pair, cli_args, id_col, batch_rows, condition=Non
         with downstream_connection.cursor() as downstream_cursor:
             with db_pair.upstream.connection.cursor() as upstream_cursor:
 
-                table = Table.Twin(table_name, downstream_cursor, upstream_cursor, id_col, printer=printer)
+                with printer.metrics.phase('introspection'):
+
+                    # with --changeset the downstream schema is the baseline too, tables whose schema differs are skipped
+                    # (check before Twin, which would create a missing downstream table)
+                    if db_pair.changeset:
+                        if not db_pair.changeset.schema(upstream_cursor, downstream_cursor, table_name, printer=printer):
+                            return None
 
-                table.try_sync_schema(upstream_cursor, downstream_cursor, throw=False, printer=printer)
+                    by_type = Constants.cheap_hash_types if cli_args.cheap_hashes else None
+                    table = Table.Twin(table_name, downstream_cursor, upstream_cursor, id_col,
+                                       hashing=hashing, by_type=by_type, printer=printer)
+                    table.shared = db_pair.upstream.shared
+
+                    if not db_pair.changeset:
+                        table.try_sync_schema(upstream_cursor, downstream_cursor, throw=False, printer=printer)
+
+                        # a previous --defer-indexes run may have been interrupted before it rebuilt them
+                        Table.restore_secondary_indexes(downstream_cursor, table_name, printer=printer)
 
                 # TODO : move modified_time / last_touched checks into Table.Twin
                 # before id_sync touches the table, get the downstream last modified time
@@ -293,6 +635,11 @@ def pre_general(table_name, db_pair, cli_args, id_col, batch_rows, condition=Non
                         if pull_missing_ids(table, db_pair, cli_args, batch_rows, condition=condition, printer=printer):
                             presync_types.append("missing-id comparison")
 
+                        # (a changeset doesn't change the downstream, so the content scan would record these rows again)
+                        if cli_args.presence_diff and not db_pair.changeset:
+                            if pull_presence_diffs(table, db_pair, cli_args, condition=condition, printer=printer):
+                                presync_types.append("id-presence comparison")
+
                 # pull latest based on modified time
                 if '`modified_time`' in table.upstream.columns:
                     printer("[syncing (on 'modified_time') table: {}]".format(table_name))
@@ -301,6 +648,7 @@ def pre_general(table_name, db_pair, cli_args, id_col, batch_rows, condition=Non
                             presync_types.append("modified_time comparison")
 
                 # prepare report.  What was done and where does that leave us?
+                table.presync_types = list(presync_types)
                 if not any(presync_types):
                     presync_types.append("not finding any changes")
                 preposition = "after " + " & ".join(presync_types)
@@ -321,17 +669,29 @@ def pre_general(table_name, db_pair, cli_args, id_col, batch_rows, condition=Non
 # groups by the first one, syncs first based on group size, then scans row ranges for data changes
 def composite_key_sync(table_name, db_pair, cli_args, keys, condition=None, printer=Prindenter()):
 
+    if cli_args.plan:
+        return Plan.composite_key_sync(table_name, db_pair, cli_args, keys, printer=printer)
+
     if condition:
         printer("WARNING, use of 'condition' here is untested")
 
+    # multikey rescans the downstream after each change it makes, so it has to actually make them
+    if db_pair.changeset:
+        message = f"{table_name} : NOT RECORDED (composite key syncs can't write to a changeset)"
+        with Indent(printer):
+            printer.append_summary(message)
+            printer(message)
+        return
+
     # Check to see if work needs to be done
     with Connection(db_pair.downstream.args) as downstream_connection:
         with downstream_connection.cursor() as downstream_cursor:
             with db_pair.upstream.connection.cursor() as upstream_cursor:
 
-                table = Table.Twin(table_name, downstream_cursor, upstream_cursor, keys[0], printer=printer)
-
-                table.try_sync_schema(upstream_cursor, downstream_cursor, throw=False, printer=printer)
+                with printer.metrics.phase('introspection'):
+                    table = Table.Twin(table_name, downstream_cursor, upstream_cursor, keys[0], printer=printer)
+                    table.shared = db_pair.upstream.shared
+                    table.try_sync_schema(upstream_cursor, downstream_cursor, throw=False, printer=printer)
 
                 # do not assume that the use_col is a primary key--it may not be
                 delattr(table, 'id_col')
@@ -352,6 +712,34 @@ def composite_key_sync(table_name, db_pair, cli_args, keys, condition=None, prin
                 return has_changes_final(table, f"after {','.join(syncs_completed)}, "
                                                 "because this function is not fully implemented", printer=printer)
 
+# replace the downstream rows (where condition) with all of upstream's, seeding them in parallel where possible
+# for tables that differ so much that finding the differences doesn't pay (see Sample.choose)
+def reload(table, db_pair, cli_args, batch_rows, condition=None, printer=Prindenter()):
+
+    printer(f"[Reloading {table.name}]")
+    with Indent(printer):
+        if condition or db_pair.changeset:
+            delete_downstream(db_pair, table.name, condition or 'TRUE', printer=printer)
+        else:
+            with Connection(db_pair.downstream.args) as downstream_connection:
+                with downstream_connection.cursor() as cursor, printer.metrics.phase('delete'):
+                    show_do_query(cursor, f'truncate {table.name};', printer=printer)
+
+        # the downstream table is empty now, so this pulls everything
+        reload_args = copy(cli_args)
+        reload_args.parallel_seed = True
+        table.downstream.max_id = 0
+        pull_missing_ids(table, db_pair, reload_args, batch_rows, condition=condition, printer=printer)
+
+    if db_pair.changeset:
+        printer.append_summary(f"{table.name} : RECORDED in {db_pair.changeset.path}")
+        return
+
+    with Connection(db_pair.downstream.args) as downstream_connection:
+        with downstream_connection.cursor() as downstream_cursor:
+            with db_pair.upstream.connection.cursor() as upstream_cursor:
+                table.is_synced_warn(upstream_cursor, downstream_cursor, message='(after reload)', printer=printer)
+
 # original caller will provide zoom_levels like: [100,10,1] and a table like "foo_table"
 # then we examine the table and replace it with Table.Twin (see above)
 # then we scan the whole thing and recurse with zoom_levels like :
@@ -377,21 +765,32 @@ def composite_key_sync(table_name, db_pair, cli_args, keys, condition=None, prin
 #                                            7651 : [(0-7651)] }
 
 # then we see that there are no 'None' rows, so we stop recursing and just sync id's: [1, 3, 65, 66, 67, 772]
-def general(table, zoom_levels, db_pair, cli_args, id_col='id', batch_rows=Constants.batch_rows, condition=None, printer=Prindenter()):
+# engine picks how fingerprints are compared: 'md5' has the servers hash rows, 'stream' hashes them here (see stream.py)
+# it defaults to --diff-engine
+# hashing picks cheap signatures for large columns, as {column name : strategy} (see Table.examine_columns)
+def general(table, zoom_levels, db_pair, cli_args, id_col='id', batch_rows=Constants.batch_rows, condition=None,
+            engine=None, hashing=None, printer=Prindenter()):
 
     # prepare for recursion if not already in it
 
+    engine = engine or cli_args.diff_engine
+
+    if type(table) == str and cli_args.plan:
+        return Plan.general(table, zoom_levels, db_pair, cli_args, id_col=id_col, batch_rows=batch_rows, printer=printer)
+
     if type(table) == str:
+        import sh # for its exception types, cli imports it lazily too
         printer("[Examining table: {}]".format(table))
         with Indent(printer):
             try:
-                table = pre_general(table, db_pair, cli_args, id_col, batch_rows, condition=condition, printer=printer)
+                table = pre_general(table, db_pair, cli_args, id_col, batch_rows, condition=condition, hashing=hashing,
+                                    printer=printer)
             except sh.ErrorReturnCode_1 as err:
 
-                # handle schema mismatches with a sledgehammer
+                # handle schema mismatches with a sledgehammer (but never to a --changeset's baseline)
                 # TODO: allow user to provide path to migration scripts,
                 # run outstanding ones if they show up in migration_tracker
-                if "Column count doesn't match" in str(err):
+                if "Column count doesn't match" in str(err) and not db_pair.changeset:
 
                     printer("Upstream schema differs, pulling it down")
 
@@ -412,21 +811,63 @@ def general(table, zoom_levels, db_pair, cli_args, id_col='id', batch_rows=Const
 
                     # try again
                     printer("[New schema loaded, downstream table is empty]")
-                    table = pre_general(table, db_pair, cli_args, id_col, condition=condition, printer=printer)
+                    table = pre_general(table, db_pair, cli_args, id_col, batch_rows, condition=condition, hashing=hashing,
+                                    printer=printer)
                 else:
                     raise
 
+        # not recordable to the changeset (see pre_general)
+        if table is None:
+            return
+
     if type(zoom_levels) == list:
         # set up for recursion
         if table.needs_work:
+
+            # with --auto-strategy, a table where most rows differ is reloaded rather than zoomed into
+            if cli_args.auto_strategy and not table.strategy:
+                if Sample.choose(db_pair, table, zoom_levels, condition=condition, printer=printer) == 'reload':
+                    return reload(table, db_pair, cli_args, batch_rows, condition=condition, printer=printer)
+
+            # the outermost zoom level (completed in general)
+            # (with --changeset, ids past the downstream's max were recorded by pull_missing_ids, but are still missing downstream)
+            top = table.upstream.max_id
+            if db_pair.changeset:
+                top = min(top, table.downstream.max_id or 0)
+            top_scopes = Ids.IntervalSet([ Ids.Interval(0, top) ]) - table.recorded
+
+            # with --partitions, partitions that match on both sides are left out of it
+            if cli_args.partitions:
+                top_scopes = Partition.differing(db_pair, cli_args, table, top_scopes, condition=condition, printer=printer)
+                if not top_scopes and table.cheap() and not db_pair.changeset:
+                    printer("[No partitions differ, rescanning with whole columns instead of cheap signatures]")
+                    table.use_full_columns()
+                    with Indent(printer):
+                        return general(table, zoom_levels, db_pair, cli_args, condition=condition, engine=engine, printer=printer)
+                if not top_scopes and not db_pair.changeset:
+                    printer("Sync: 'general' finished early: no partitions differ")
+                    printer.append_summary("{} : IDENTICAL? (TABLE CHECKSUM failed but no partition fingerprints differ)".format(table.name))
+                    return
+
+            # with --changeset, the presync may have recorded everything there is to scan
+            if not top_scopes and db_pair.changeset:
+                printer("Sync: 'general' finished early: nothing to scan beyond what the presync recorded")
+                printer.append_summary(f"{table.name} : RECORDED in {db_pair.changeset.path}")
+                return
+
             printer("Sync: 'general' received magnification list instead of zoom_level map, building zoom_level map...", end='')
             with Indent(printer):
+                # streaming finds differing rows in one pass, so it only needs the finest level
+                if engine == 'stream':
+                    zoom_levels = [ min(zoom_levels) ]
+
                 # prepare the zoom-level map
                 zoom_levels = SortedDict({ x : None for x in zoom_levels })
-
-                # append the outermost zoom level (completed in general)
-                zoom_levels[table.upstream.max_id] = [ Ids.Interval(0,table.upstream.max_id) ]
+                zoom_levels[table.upstream.max_id] = top_scopes
         else:
+            if cli_args.auto_strategy:
+                Sample.log(table.name, 'append-only' if 'missing-id comparison' in table.presync_types else 'nothing',
+                           "presync was sufficient", printer=printer)
             printer("Sync: 'general' finished early: presync was sufficient")
             return
 
@@ -435,7 +876,7 @@ def general(table, zoom_levels, db_pair, cli_args, id_col='id', batch_rows=Const
         # begin recursion
         printer("[Sync: 'general' top-level recursion]")
         with Indent(printer):
-            return general(table, zoom_levels, db_pair, cli_args, condition=condition, printer=printer)
+            return general(table, zoom_levels, db_pair, cli_args, condition=condition, engine=engine, printer=printer)
 
     # if control gets this far, recursion has begun
 
@@ -454,59 +895,52 @@ def general(table, zoom_levels, db_pair, cli_args, id_col='id', batch_rows=Const
     if not scopes:
         printer("Zoom-level map fully populated, no more 'general' recursions will follow")
 
-        conditions = []
         final_size = zoom_levels.keys()[0]
+        final_scopes = zoom_levels.values()[0]
 
-        final_scopes = list(zoom_levels.values()[0])
-        final_scopes.sort()
-
-        if final_size <= 1 and type(final_scopes[0]) == int:
-            printer("Scanned down to individual rows")
-            row_lists = Ids.partition(Constants.batch_fingerprints, final_scopes)
-
-            for rows in row_lists:
-                conditions.append("{} in ({})".format(table.id_col, ",".join([str(x) for x in rows])))
-
-        elif final_size > 1 and isinstance(final_scopes[0], Ids.Interval):
-            printer("Scanned down to row-ranges of size {}".format(final_size))
-            interval_lists = Ids.partition(Constants.batch_fingerprints, final_scopes)
+        if final_size <= 1:
+            printer("Scanned down to individual rows ({} of them, in {} runs)".format(final_scopes.count(), len(final_scopes)))
+        else:
+            printer("Scanned down to row-ranges of size {} ({} runs)".format(final_size, len(final_scopes)))
 
-            conditions = []
-            for intervals in interval_lists:
-                conditions.append(
-                    " OR ".join(["{} BETWEEN {} AND {}".format(table.id_col, i.start, i.end) for i in intervals]))
+        # rows that both sides have might only need a few of their columns set
+        if final_size <= 1 and cli_args.column_deltas and not db_pair.changeset:
+            final_scopes = update_columns(db_pair, table, final_scopes, printer=printer)
 
-        else:
-            raise ValueError("Can't decide whether to transfer rows, or row-ranges")
+        # adjacent rows (or ranges) were merged as they were found, so clustered diffs make for few, wide predicates
+        conditions = final_scopes.predicates(table.id_col, Constants.batch_fingerprints)
 
         printer("[Transfer proceeding in {} batches]".format(len(conditions)))
         with Indent(printer):
 
-            for condition in conditions:
-
-                # dump upstream data
-                mysqldump_data(cli_args.upstream, table.name, condition, printer=printer)
+            for batch in conditions:
+                transfer(db_pair, cli_args, table.name, batch, printer=printer)
 
-                # clear old rows from downstream
-                delete = 'delete from {} where {};'.format(table.name, condition)
-                with Connection(db_pair.downstream.args) as downstream_connection:
-                    with downstream_connection.cursor() as cursor:
-                        show_do_query(cursor, delete, printer=printer)
-
-                # load new rows into downstream
-                mysqlload(cli_args.downstream, table.name, printer=printer)
+        # the downstream hasn't changed, there's nothing to check
+        if db_pair.changeset:
+            printer.append_summary(f"{table.name} : RECORDED in {db_pair.changeset.path}")
+            return
 
         with Connection(db_pair.downstream.args) as downstream_connection:
             with downstream_connection.cursor() as downstream_cursor:
                 with db_pair.upstream.connection.cursor() as upstream_cursor:
-                    table.is_synced_warn(upstream_cursor, downstream_cursor, message='(after general sync)', printer=printer)
-                    table.try_sync_schema(upstream_cursor, downstream_cursor, throw=True, printer=printer)
+
+                    # cheap signatures miss changes that keep them the same, so if the checksums disagree, look again at whole columns
+                    rescan = table.cheap() and not table.is_synced(upstream_cursor, downstream_cursor, printer=printer)
+                    if not rescan:
+                        table.is_synced_warn(upstream_cursor, downstream_cursor, message='(after general sync)', printer=printer)
+                        table.try_sync_schema(upstream_cursor, downstream_cursor, throw=True, printer=printer)
+
+        if rescan:
+            printer("[Checksums still differ, rescanning with whole columns instead of cheap signatures]")
+            table.use_full_columns()
+            with Indent(printer):
+                return general(table, zoom_levels.keys()[:-1], db_pair, cli_args, condition=condition, engine=engine, printer=printer)
 
     # if we found a row with unpopulated scopes, then we have more scanning to do
     else:
         printer("[Given {} larger-granules, making smaller granules of size {} and fingerprinting them]".format(
                  len(scopes), granularity))
-        next_scopes = []
         with Indent(printer):
             with Connection(db_pair.downstream.args) as downstream_connection:
                 with downstream_connection.cursor() as downstream_cursor:
@@ -520,13 +954,35 @@ def general(table, zoom_levels, db_pair, cli_args, id_col='id', batch_rows=Const
                         #                                       printer=printer))
                         # rather than making a round trip for each one, lets do them all at once
 
-                        next_scopes += list(Db.find_diffs(upstream_cursor, downstream_cursor, table, scopes, granularity,
-                                                          condition=condition, printer=printer))
+                        if engine == 'stream':
+                            found = Stream.find_diffs(db_pair, table, scopes, granularity,
+                                                      condition=condition, printer=printer)
+                        else:
+                            found = Db.find_diffs(upstream_cursor, downstream_cursor, table, scopes, granularity,
+                                                  condition=condition, shared=db_pair.upstream.shared,
+                                                  same_server=db_pair.same_server, printer=printer)
+
+                        # a range at the edge of a scope can stick out past it, trim it to what we were asked about
+                        next_scopes = Ids.IntervalSet(found) & scopes
                         printer('') # Db.find_diffs ends without a newline... add one
 
         # if no ranges were found to contain diffs
         if len(next_scopes) == 0: # note that any([0]) is False, but len([0]) == 0 is True
                                   # we want the latter, else we ignore row 0
+
+            # the downstream hasn't changed, so the checksums differ because of what the presync recorded
+            if db_pair.changeset:
+                printer("Found no ranges with diffs beyond what the presync recorded")
+                printer.append_summary(f"{table.name} : RECORDED in {db_pair.changeset.path}")
+                return
+
+            # the checksums differ, so whatever differs may be hidden by cheap signatures
+            if table.cheap():
+                printer("[Found no ranges with diffs, rescanning with whole columns instead of cheap signatures]")
+                table.use_full_columns()
+                with Indent(printer):
+                    return general(table, zoom_levels.keys()[:-1], db_pair, cli_args, condition=condition, engine=engine, printer=printer)
+
             message = textwrap.dedent("""
             Found no ranges with diffs.  Nothing to do.
             If the tables were truly identical, TABLE CHECKSUM would have
@@ -542,4 +998,4 @@ def general(table, zoom_levels, db_pair, cli_args, id_col='id', batch_rows=Const
             zoom_levels[granularity] = next_scopes
             printer("[Another 'general' recursion]")
             with Indent(printer):
-                return general(table, zoom_levels, db_pair, cli_args, condition=condition, printer=printer)
+                return general(table, zoom_levels, db_pair, cli_args, condition=condition, engine=engine, printer=printer)
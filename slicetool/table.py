@@ -1,24 +1,45 @@
+import os
+import re
 import traceback
 import json
-from collections import OrderedDict
+import hashlib
+from array import array
+from collections import OrderedDict, namedtuple
+from contextlib import contextmanager
 from slicetool.mysql import Connection
 from slicetool.cli import Prindenter, Indent, show_do_query, pretty_shorten
 from slicetool.schema import sync_schema
-from slicetool.ids import Interval
-
+from slicetool.ids import Interval, IntervalSet
+import slicetool.constants as Constants
+
+
+# what goes into a fingerprint in place of a whole (large) column, see examine_columns
+def hash_strategy_sql(strategy, column_name):
+    if strategy == 'length':
+        return f"IFNULL(LENGTH(`{column_name}`), 'NULL')"
+    elif strategy == 'length_prefix':
+        return f"IFNULL(CONCAT(LENGTH(`{column_name}`), ':', LEFT(`{column_name}`, {Constants.hash_prefix_length})), 'NULL')"
+    elif strategy.startswith('column:'):
+        # a column that already holds a hash of this one (e.g. a stored generated column)
+        return f"IFNULL(`{strategy[len('column:'):]}`, 'NULL')"
+    else:
+        raise ValueError(f"Unknown hashing strategy for column {column_name}: {strategy}")
 
 # not all columns can be concatenated (i.e. NULL)
 # this gets the list of columns and figures out how to make them concatenatabale
-def examine_columns(cursor, table_name, printer=Prindenter()):
+# hashing ({column name : strategy}) and by_type ({DATA_TYPE : strategy}) swap large columns for cheaper signatures,
+# strategies are 'full' (the default), 'length', 'length_prefix' or 'column:<name of a hash column>'
+def examine_columns(cursor, table_name, hashing=None, by_type=None, printer=Prindenter()):
 
     printer(f"[Examining Columns on {cursor.connection.db}.{table_name}]")
     with Indent(printer):
         result = show_do_query(cursor,
                f"""
-                SELECT COLUMN_NAME, IS_NULLABLE, COLUMN_TYPE, COLLATION_NAME
+                SELECT COLUMN_NAME, IS_NULLABLE, COLUMN_TYPE, DATA_TYPE, COLLATION_NAME
                 FROM information_schema.columns
                 WHERE table_schema='{cursor.connection.db}'
-                AND table_name='{table_name}';
+                AND table_name='{table_name}'
+                ORDER BY ORDINAL_POSITION;
                 """,
                 printer=printer)
 
@@ -41,12 +62,79 @@ def examine_columns(cursor, table_name, printer=Prindenter()):
             # your data may deviate in new and exciting ways
             # handle them here ...
 
+            strategy = (hashing or {}).get(column['COLUMN_NAME']) or (by_type or {}).get(column['DATA_TYPE']) or 'full'
+            if strategy != 'full':
+                converted = hash_strategy_sql(strategy, column['COLUMN_NAME'])
+
             with Indent(printer):
                 printer(converted)
             column_conversions.append(converted)
 
         return column_conversions
 
+# plain names of the primary key's columns, in key order (empty if there isn't one)
+def primary_key(cursor, table_name, printer=Prindenter()):
+    result = show_do_query(cursor,
+           f"""
+            SELECT COLUMN_NAME
+            FROM information_schema.key_column_usage
+            WHERE table_schema='{cursor.connection.db}'
+            AND table_name='{table_name}'
+            AND constraint_name='PRIMARY'
+            ORDER BY ORDINAL_POSITION;
+            """,
+            printer=printer)
+    return [ x['COLUMN_NAME'] for x in result ]
+
+# plain column names, in table order (for INSERT ... SELECT)
+def column_names(cursor, table_name, printer=Prindenter()):
+    result = show_do_query(cursor,
+           f"""
+            SELECT COLUMN_NAME
+            FROM information_schema.columns
+            WHERE table_schema='{cursor.connection.db}'
+            AND table_name='{table_name}'
+            ORDER BY ORDINAL_POSITION;
+            """,
+            printer=printer)
+    return [ f"`{x['COLUMN_NAME']}`" for x in result ]
+
+# a cheap stand-in for `describe`: hash the parts of each column definition that sync_schema compares
+def schema_fingerprint(cursor, table_name, printer=Prindenter()):
+
+    printer(f"[Fingerprinting schema of {cursor.connection.db}.{table_name}]")
+    with Indent(printer):
+        result = show_do_query(cursor,
+               f"""
+                SELECT COLUMN_NAME, COLUMN_TYPE, IS_NULLABLE, COLUMN_DEFAULT
+                FROM information_schema.columns
+                WHERE table_schema='{cursor.connection.db}'
+                AND table_name='{table_name}'
+                ORDER BY ORDINAL_POSITION;
+                """,
+                printer=printer)
+
+        columns = [ [ x['COLUMN_NAME'], x['COLUMN_TYPE'], x['IS_NULLABLE'], x['COLUMN_DEFAULT'] ] for x in result ]
+        return hashlib.md5(json.dumps(columns, default=str).encode()).hexdigest()
+
+# the fingerprint cache maps a table pair to the fingerprints both sides had when they were last reconciled
+def schema_pair_key(upstream_cursor, downstream_cursor, table_name):
+    return (f"{upstream_cursor.connection.host}/{upstream_cursor.connection.db}.{table_name} -> "
+            f"{downstream_cursor.connection.host}/{downstream_cursor.connection.db}.{table_name}")
+
+def read_schema_cache():
+    if os.path.exists(Constants.schema_fingerprint_cache):
+        with open(Constants.schema_fingerprint_cache) as f:
+            return json.load(f)
+    else:
+        return {}
+
+def write_schema_cache(key, fingerprints):
+    cache = read_schema_cache()
+    cache[key] = fingerprints
+    with open(Constants.schema_fingerprint_cache, 'w') as f:
+        json.dump(cache, f, indent=2, sort_keys=True)
+
 def show_create(cursor, table_name, printer=Prindenter()):
 
     printer(f"[Extracting creation SQL from {cursor.connection.db}.{table_name}]")
@@ -59,6 +147,95 @@ def show_create(cursor, table_name, printer=Prindenter()):
 
         return result[0]['Create Table'].strip()
 
+# when syncing several downstreams from one upstream, compute upstream results for the first one and reuse them
+# shared is a dict (cleared between tables) or None, in which case nothing is kept
+def shared_upstream(shared, key, compute, printer=Prindenter()):
+    if shared is None:
+        return compute()
+    if key not in shared:
+        shared[key] = compute()
+    else:
+        printer(f"[Reusing upstream {key[0]} from an earlier downstream]")
+    return shared[key]
+
+# Deferred Secondary Indexes
+# ==========================
+
+# loading into a table without its secondary indexes, then building them all at once,
+# is much faster than maintaining each index row by row as the load happens
+
+# secondary index definitions from `show create table`, by name
+# indexes that might be backing a foreign key are left out, mysql won't let us drop those
+def secondary_indexes(create_table):
+
+    lines = [ x.strip().rstrip(',') for x in create_table.split('\n') ]
+
+    foreign_key_columns = [ re.search(r'FOREIGN KEY \((.*?)\)', x).group(1) for x in lines if 'FOREIGN KEY' in x ]
+
+    indexes = OrderedDict()
+    for line in lines:
+        match = re.match(r'^((?:UNIQUE |FULLTEXT |SPATIAL )?KEY) `(.*?)` \((.*?)\)', line)
+        if match:
+            name, columns = match.group(2), match.group(3)
+            if not any(columns.startswith(x) for x in foreign_key_columns):
+                indexes[name] = line
+    return indexes
+
+# where to keep dropped index definitions, so that an interrupted run can put them back
+def deferred_index_file(cursor, table_name):
+    return Constants.deferred_index_file.format(f'{cursor.connection.db}.{table_name}')
+
+def drop_secondary_indexes(cursor, table_name, printer=Prindenter()):
+
+    indexes = secondary_indexes(show_create(cursor, table_name, printer=printer))
+    if not indexes:
+        printer(f"{table_name} has no secondary indexes to defer")
+        return
+
+    # save first, drop second
+    with open(deferred_index_file(cursor, table_name), 'w') as f:
+        json.dump(indexes, f, indent=2)
+
+    printer(f"[Deferring {len(indexes)} secondary indexes on {cursor.connection.db}.{table_name}]")
+    with Indent(printer), printer.metrics.phase('indexes'):
+        show_do_query(cursor,
+                      f"ALTER TABLE {table_name} " + ", ".join(f"DROP INDEX `{x}`" for x in indexes.keys()) + ";",
+                      printer=printer)
+
+# rebuild any indexes that drop_secondary_indexes saved (in one ALTER), no-op if there aren't any
+def restore_secondary_indexes(cursor, table_name, printer=Prindenter()):
+
+    saved = deferred_index_file(cursor, table_name)
+    if not os.path.exists(saved):
+        return
+
+    with open(saved) as f:
+        indexes = json.load(f, object_pairs_hook=OrderedDict)
+
+    # if we were interrupted partway through a restore, some may already be back
+    existing = secondary_indexes(show_create(cursor, table_name, printer=printer))
+    missing = [ definition for name, definition in indexes.items() if name not in existing ]
+
+    if missing:
+        printer(f"[Rebuilding {len(missing)} secondary indexes on {cursor.connection.db}.{table_name}]")
+        with Indent(printer), printer.metrics.phase('indexes'):
+            show_do_query(cursor,
+                          f"ALTER TABLE {table_name} " + ", ".join(f"ADD {x}" for x in missing) + ";",
+                          printer=printer)
+
+    os.remove(saved)
+
+# drop secondary indexes for the duration of a with block (e.g. a big load), then rebuild them
+@contextmanager
+def deferred_indexes(mysql_args, table_name, printer=Prindenter()):
+    with Connection(mysql_args) as connection, connection.cursor() as cursor:
+        drop_secondary_indexes(cursor, table_name, printer=printer)
+
+    yield
+
+    with Connection(mysql_args) as connection, connection.cursor() as cursor:
+        restore_secondary_indexes(cursor, table_name, printer=printer)
+
 def create_twin_if_not_exists(upstream_cursor, downstream_cursor, table_name, printer=Prindenter()):
 
     printer(f"[Checking for table existence: {downstream_cursor.connection.db}.{table_name}]")
@@ -83,14 +260,20 @@ def create_twin_if_not_exists(upstream_cursor, downstream_cursor, table_name, pr
 
 # One side of a Twin (see below)
 class One:
-    def __init__(self, table_name, cursor, id_col, printer=Prindenter()):
+    def __init__(self, table_name, cursor, id_col, hashing=None, by_type=None, printer=Prindenter()):
 
         # Initialize values also found on Twin and that don't disagree between upstream and downstream
         self.id_col = id_col
         self.name = table_name
 
         # column descriptions with concatentate-friendly modifications
-        self.columns = examine_columns(cursor, table_name, printer=printer)
+        self.full_columns = examine_columns(cursor, table_name, printer=printer)
+
+        # what fingerprints are made of, cheaper signatures may stand in for large columns (see examine_columns)
+        if hashing or by_type:
+            self.columns = examine_columns(cursor, table_name, hashing=hashing, by_type=by_type, printer=printer)
+        else:
+            self.columns = self.full_columns
 
         # how many rows?
         target = f'max({self.id_col})'
@@ -102,30 +285,43 @@ class One:
 
 # A table which exists both downstream and upstream, but may differ in data or host configuration
 class Twin:
-    def __init__(self, table_name, downstream_cursor, upstream_cursor, id_col, printer=Prindenter()):
+    def __init__(self, table_name, downstream_cursor, upstream_cursor, id_col, hashing=None, by_type=None, printer=Prindenter()):
 
         self.name = table_name
         self.id_col = id_col
 
         printer(f"[Upstream {table_name}]")
         with Indent(printer):
-            self.upstream = One(table_name, upstream_cursor, id_col, printer=printer)
+            self.upstream = One(table_name, upstream_cursor, id_col, hashing=hashing, by_type=by_type, printer=printer)
 
         create_twin_if_not_exists(upstream_cursor, downstream_cursor, table_name, printer=printer)
 
         # separate properties
         printer(f"[Downstream {table_name}]")
         with Indent(printer):
-            self.downstream = One(table_name, downstream_cursor, id_col, printer=printer)
+            self.downstream = One(table_name, downstream_cursor, id_col, hashing=hashing, by_type=by_type, printer=printer)
 
         self.successful_schema_sync = False # set true when sync completes
+        self.shared = None                  # see shared_upstream
+        self.strategy = None                # see Sample.choose
+        self.recorded = IntervalSet()       # ids a --changeset already holds, see Sync.pull_modifications_since
+
+    # are fingerprints using cheap signatures for some columns?
+    def cheap(self):
+        return self.upstream.columns != self.upstream.full_columns
+
+    # fingerprint whole columns from now on
+    def use_full_columns(self):
+        for side in [self.upstream, self.downstream]:
+            side.columns = side.full_columns
 
     def is_synced(self, upstream_cursor, downstream_cursor, printer=Prindenter()):
-        with Indent(printer):
+        with Indent(printer), printer.metrics.phase('checksum'):
             get_checksum = f'checksum table {self.name};'
 
-            result = show_do_query(upstream_cursor, get_checksum, printer=printer)
-            upstream_checksum = result[0]['Checksum']
+            upstream_checksum = shared_upstream(self.shared, ('checksum', self.name),
+                                                lambda : show_do_query(upstream_cursor, get_checksum, printer=printer)[0]['Checksum'],
+                                                printer=printer)
 
             result = show_do_query(downstream_cursor, get_checksum, printer=printer)
             downstream_checksum = result[0]['Checksum']
@@ -180,51 +376,148 @@ class Twin:
                     table.successful_schema_sync = True
 
             if not self.successful_schema_sync:
-                if throw:
-                    go(self, upstream_cursor, downstream_cursor, printer)
+
+                # skip the full comparison if these exact definitions have been reconciled before
+                key = schema_pair_key(upstream_cursor, downstream_cursor, self.name)
+                fingerprints = { 'upstream' : schema_fingerprint(upstream_cursor, self.name, printer=printer),
+                                 'downstream' : schema_fingerprint(downstream_cursor, self.name, printer=printer) }
+
+                if fingerprints['upstream'] == fingerprints['downstream'] or read_schema_cache().get(key) == fingerprints:
+                    printer("Schema fingerprints match, skipping column-by-column comparison")
+                    self.successful_schema_sync = True
+
                 else:
-                    try:
+                    if throw:
                         go(self, upstream_cursor, downstream_cursor, printer)
-                    except Exception:
-                        printer("Error occurred while syncing schema, but errors were suppressed")
-                        printer("Will retry schema sync after data sync")
-                        printer(traceback.format_exc())
+                    else:
+                        try:
+                            go(self, upstream_cursor, downstream_cursor, printer)
+                        except Exception:
+                            printer("Error occurred while syncing schema, but errors were suppressed")
+                            printer("Will retry schema sync after data sync")
+                            printer(traceback.format_exc())
+
+                    # the fingerprints differ but the comparison found nothing to change
+                    # (e.g. the servers render defaults differently), remember this pair as reconciled
+                    if self.successful_schema_sync:
+                        write_schema_cache(key, fingerprints)
+
             if self.successful_schema_sync:
                 printer("...schemas are in sync".format(self.name))
             else:
                 printer("...schemas are NOT in syc".format(self.name))
 
+# the queries behind md5_row_ranges and md5_rows (aio.py runs them too)
+def md5_row_ranges_sql(table, condition, granularity):
+    converted_columns_str = ",".join(table.columns)
+    return f"""
+                SELECT UNHEX(MD5(GROUP_CONCAT(row_fingerprint ORDER BY id))) AS range_fingerprint,
+                       row_group * {granularity} as range_begin,
+                       COUNT(*) as range_rows
+                FROM
+                    (SELECT MD5(CONCAT_WS('|', {converted_columns_str})) as row_fingerprint,
+                            {table.id_col} DIV {granularity} as row_group,
+                            {table.id_col} as id
+                    FROM {table.name}
+                    WHERE {condition}
+                    ORDER BY {table.id_col}) as r
+                GROUP BY row_group
+                ORDER BY row_group;
+                """
+
 def md5_row_ranges(cursor, table, condition, granularity, printer=Prindenter()):
 
     if granularity <= 1:
         raise ValueError("Variable granularity scanner called, but a trivial granule size was provided")
 
-    converted_columns_str = ",".join(table.columns)
-
     shortened_condition = pretty_shorten(condition)[:-1]
 
     printer(f"[ Fingerprinting {cursor.connection.db}.{table.name} in row-ranges of size {granularity}\n"
             f"  where {table.id_col} in {shortened_condition} ]")
     with Indent(printer):
 
-        result = show_do_query(cursor,
-                f"""
-                SELECT MD5(GROUP_CONCAT(row_fingerprint ORDER BY id)) AS range_fingerprint,
-                       row_group * {granularity} as range_begin,
-                       (row_group + 1) * {granularity} - 1 as range_end
-                FROM
-                    (SELECT MD5(CONCAT_WS('|', {converted_columns_str})) as row_fingerprint,
-                            FLOOR({table.id_col}/{granularity}) as row_group,
-                            {table.id_col} as id
+        result = show_do_query(cursor, md5_row_ranges_sql(table, condition, granularity), printer=printer)
+
+        printer.metrics.count(rows_scanned=sum(row['range_rows'] for row in result))
+
+    # ranges are addressed by their first id
+    return fingerprints(result, 'range_begin', 'range_fingerprint')
+
+# for --presence-diff: which ids each side has, read from the primary key without touching row data
+# per range of granularity ids (addressed by its first id): how many there are, the first, the last, and their xor
+def id_ranges(cursor, table, condition, granularity, printer=Prindenter()):
+
+    result = show_do_query(cursor,
+            f"""
+            SELECT {table.id_col} DIV {granularity} AS row_group,
+                   COUNT(*) AS range_rows,
+                   MIN({table.id_col}) AS range_min,
+                   MAX({table.id_col}) AS range_max,
+                   BIT_XOR({table.id_col}) AS range_xor
+            FROM {table.name}
+            WHERE {condition}
+            GROUP BY row_group
+            ORDER BY row_group;
+            """, printer=printer)
+
+    printer.metrics.count(rows_scanned=sum(row['range_rows'] for row in result))
+    return { row['row_group'] * granularity : (row['range_rows'], row['range_min'], row['range_max'], int(row['range_xor']))
+             for row in result }
+
+# ids per word of id_bitmaps
+id_bitmap_bits = 64
+
+# for --presence-diff: {word : bitmap}, bit n of word w is set if id w * id_bitmap_bits + n is present
+def id_bitmaps(cursor, table, condition, printer=Prindenter()):
+
+    result = show_do_query(cursor,
+            f"""
+            SELECT {table.id_col} DIV {id_bitmap_bits} AS word,
+                   BIT_OR(1 << ({table.id_col} MOD {id_bitmap_bits})) AS bits
+            FROM {table.name}
+            WHERE {condition}
+            GROUP BY word
+            ORDER BY word;
+            """, printer=printer)
+
+    return { row['word'] : int(row['bits']) for row in result }
+
+# for --column-deltas: positions (as in examine_columns) of columns that are fingerprinted together
+# each wide column (see Constants.column_delta_wide_types) is a group of its own, the other columns (except id_col) share one
+def column_groups(cursor, table_name, id_col, printer=Prindenter()):
+    result = show_do_query(cursor,
+           f"""
+            SELECT COLUMN_NAME, DATA_TYPE
+            FROM information_schema.columns
+            WHERE table_schema='{cursor.connection.db}'
+            AND table_name='{table_name}'
+            ORDER BY ORDINAL_POSITION;
+            """,
+            printer=printer)
+
+    narrow = [ n for n, x in enumerate(result) if x['COLUMN_NAME'] != id_col and x['DATA_TYPE'] not in Constants.column_delta_wide_types ]
+    wide = [ [n] for n, x in enumerate(result) if x['COLUMN_NAME'] != id_col and x['DATA_TYPE'] in Constants.column_delta_wide_types ]
+    return ([ narrow ] if narrow else []) + wide
+
+# one fingerprint per row per column group, as g0, g1, ...
+def md5_column_groups_sql(table, groups, condition):
+    fingerprints = [ f"UNHEX(MD5(CONCAT_WS('|', {','.join(table.columns[x] for x in group)}))) as g{n}"
+                     for n, group in enumerate(groups) ]
+    return f"""
+                    SELECT {table.id_col} as id, {', '.join(fingerprints)}
                     FROM {table.name}
                     WHERE {condition}
-                    ORDER BY {table.id_col}) as r
-                GROUP BY row_group;
-                """, printer=printer)
-
-        # organize fingerprints by interval
-    return { Interval(row['range_begin'], row['range_end']) : row['range_fingerprint'] for row in result }
+                    ORDER BY {table.id_col};
+                """
 
+def md5_rows_sql(table, condition):
+    converted_columns_str = ",".join(table.columns)
+    return f"""
+                    SELECT {table.id_col} as id, UNHEX(MD5(CONCAT_WS('|', {converted_columns_str}))) as fingerprint
+                    FROM {table.name}
+                    WHERE {condition}
+                    ORDER BY {table.id_col};
+                """
 
 # fingerprint individual rows within multiple scopes for later comparison
 def md5_rows(cursor, table, condition, granularity, printer=Prindenter()):
@@ -232,23 +525,72 @@ def md5_rows(cursor, table, condition, granularity, printer=Prindenter()):
     if granularity > 1:
         raise ValueError("Individual row scanner called, but a nontrivial row-range size was provided")
 
-    converted_columns_str = ",".join(table.columns)
-
     shortened_condition = pretty_shorten(condition)[:-1]
     printer(f"[ Fingerprinting each row in {cursor.connection.db}.{table.name}\n"
             f"  where {table.id_col} in {shortened_condition} ]")
     with Indent(printer):
 
+        result = show_do_query(cursor, md5_rows_sql(table, condition), printer=printer)
+
+        printer.metrics.count(rows_scanned=len(result))
+
+        return fingerprints(result, 'id', 'fingerprint')
+
+# scan results, kept compactly: addresses (integer ids, or first ids of ranges) in an array,
+# and their 16-byte digests back to back in one bytes object, both in address order
+Fingerprints = namedtuple("Fingerprints", "addresses digests")
+
+def fingerprints(result, address_col, digest_col):
+    try:
+        addresses = array('q', (row[address_col] for row in result))
+    except (TypeError, OverflowError):
+        # not integers, so mysql's order might not be python's, put them in python's
+        result = sorted(result, key=lambda row: row[address_col])
+        addresses = [ row[address_col] for row in result ]
+
+    return Fingerprints(addresses, b''.join(row[digest_col] for row in result))
+
+# when both databases are on the same server, there's no need to bring fingerprints back to compare them
+# instead, fingerprint both sides and compare them in one query, and return only the addresses that differ
+# (ids if granularity is 1, Intervals otherwise)
+def diff_on_server(cursor, table, upstream_db, downstream_db, condition, granularity, printer=Prindenter()):
+
+    def fingerprints(side, database):
+        row_fingerprint = f"MD5(CONCAT_WS('|', {','.join(side.columns)}))"
+        if granularity <= 1:
+            return f"""
+                    SELECT {table.id_col} as address, {row_fingerprint} as fingerprint
+                    FROM `{database}`.{table.name}
+                    WHERE {condition}"""
+        else:
+            return f"""
+                    SELECT {table.id_col} DIV {granularity} as address,
+                           MD5(GROUP_CONCAT({row_fingerprint} ORDER BY {table.id_col})) as fingerprint
+                    FROM `{database}`.{table.name}
+                    WHERE {condition}
+                    GROUP BY address"""
+
+    shortened_condition = pretty_shorten(condition)[:-1]
+    printer(f"[ Comparing {upstream_db}.{table.name} with {downstream_db}.{table.name} on the server, size {granularity}\n"
+            f"  where {table.id_col} in {shortened_condition} ]")
+    with Indent(printer):
+
+        # an address that appears once is missing from one side, one that appears twice may disagree
         result = show_do_query(cursor,
                 f"""
-                    SELECT {table.id_col} as id, MD5(CONCAT_WS('|', {converted_columns_str})) as fingerprint
-                    FROM {table.name}
-                    WHERE {condition}
-                    ORDER BY {table.id_col};
-                """,
-                printer=printer)
+                SELECT address
+                FROM ({fingerprints(table.upstream, upstream_db)}
+                      UNION ALL
+                      {fingerprints(table.downstream, downstream_db)}) as both_sides
+                GROUP BY address
+                HAVING COUNT(*) = 1 OR MIN(fingerprint) != MAX(fingerprint)
+                ORDER BY address;
+                """, printer=printer)
 
-        return { row[table.id_col] : row['fingerprint'] for row in result }
+    if granularity <= 1:
+        return [ row['address'] for row in result ]
+    else:
+        return [ Interval(row['address'] * granularity, (row['address'] + 1) * granularity - 1) for row in result ]
 
 # get a date for use in pul_modifications_since
 def get_last_touched_date(table, column, db, printer=Prindenter()):
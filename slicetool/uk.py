@@ -1,7 +1,6 @@
 #! /usr/bin/env python3
-from slicetool.cli import parse_single_db_args, Prindenter, Indent, show_do_query
+from slicetool.cli import parse_single_db_args, make_printer, Prindenter, Indent, show_do_query
 from slicetool.mysql import Connection
-from slicetool.sync import TwinTable
 
 def strip_uk(target_args, printer=Prindenter()):
     target_db = target_args.database
@@ -26,7 +25,7 @@ def strip_uk(target_args, printer=Prindenter()):
                     result = show_do_query(cursor, drop_constraint, printer=printer)
 
 def main(args):
-    printer = Prindenter(indent=0)
+    printer = make_printer(args)
 
     printer('Dropping unique keys from database: {}'.format(target_args.database))
     strip_uk(args, args, printer=printer)